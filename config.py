@@ -16,6 +16,74 @@ class Settings(BaseSettings):
     - ACCESS_TOKEN_EXPIRE_MINUTES: The expiration time of access tokens in minutes.
     - DATABASE_URL: The URL for the asynchronous database connection.
     - SYNC_DATABASE_URL: The URL for the synchronous database connection (if needed).
+    - CONTEXT_TOKEN_BUDGET: The maximum number of (estimated) tokens of document context sent to the LLM.
+    - CONTEXT_CANDIDATES: How many scored chunks are retrieved as candidates for the context.
+    - CONTEXT_DEDUP_THRESHOLD: Word-overlap ratio above which a chunk is treated as a near-duplicate.
+    - INDEX_CACHE_SIZE: How many loaded document indexes each worker keeps in memory.
+    - REINDEX_FULL_REBUILD_RATIO: Share of changed chunks above which a replaced document is indexed from scratch.
+    - GC_INTERVAL_SECONDS: Interval of the background removal of orphaned files (0 disables it).
+    - GC_MIN_AGE_SECONDS: Minimum age of an unreferenced file before it is removed.
+    - INDEX_STORAGE_BACKEND: Where index artifacts are stored: "files" (one file per artifact) or "segments".
+    - SEGMENT_MAX_BYTES: Size at which the segment store starts a new segment file.
+    - SEGMENT_COMPACT_RATIO: Share of dead bytes above which a segment file is compacted.
+    - SHARED_INDEX_STORE: Whether workers memory-map shared index artifacts instead of loading private copies.
+    - INDEX_GENERATION_CHECK_SECONDS: How often workers check whether other workers replaced or deleted indexes.
+    - ADMISSION_UPLOAD_CONCURRENCY / ADMISSION_QUERY_CONCURRENCY: Global caps on concurrent uploads and queries.
+    - ADMISSION_USER_CONCURRENCY / ADMISSION_ADMIN_CONCURRENCY: Per-user caps on concurrent expensive requests.
+    - ADMISSION_USER_RATE / ADMISSION_ADMIN_RATE: Sustained expensive requests per second per user.
+    - ADMISSION_USER_BURST / ADMISSION_ADMIN_BURST: Token bucket capacity per user.
+    - ADMISSION_MAX_QUEUE: How many requests may wait for a free slot at a time.
+    - ADMISSION_MAX_WAIT_SECONDS: How long a request waits for a free slot before it is rejected.
+    - SEMANTIC_CACHE_THRESHOLD: Cosine similarity above which a cached answer is reused for a new query.
+    - SEMANTIC_CACHE_ENTRIES: How many answered queries are cached per document index (0 disables the cache).
+    - SEMANTIC_CACHE_INDEXES: How many document indexes have cached answers.
+    - BATCH_INDEX_WORKERS: Number of worker processes that index the files of batch uploads.
+    - BATCH_ARCHIVE_MAX_FILES: Maximum number of files in an archive uploaded to a batch upload.
+    - BATCH_ARCHIVE_MAX_BYTES: Maximum total size of the files extracted from an archive of a batch upload.
+    - RETRIEVAL_BACKEND: How chunks are retrieved for a query, "faiss" (TF-IDF vectors) or "fts5" (SQLite BM25).
+    - FTS_DATABASE_PATH: Path of the SQLite full-text search database, one per node or shard. Defaults to
+      `chunks_fts.db` in FAISS_INDEX_DIR.
+    - INDEX_BUILD_BATCH_SIZE: Maximum number of chunks vectorized and added to an index at once.
+    - INDEX_BUILD_MAX_MEMORY_MB: Peak memory an index build may use, counting the document text, its chunks, the
+      vectorizer and the vectors; larger documents are rejected (0 disables).
+    - INDEX_TYPE: How index vectors are stored: "flat" (float32), "fp16", "sq8" (8-bit) or "pq" (product quantization).
+    - PQ_SUBQUANTIZERS: Bytes per vector of "pq" indexes.
+    - PQ_MIN_CHUNKS: Documents with fewer chunks get an "sq8" index when INDEX_TYPE is "pq".
+    - TIERED_STORAGE: Whether indexes are kept in hot (in memory), warm (memory-mapped) and cold (compressed) tiers
+      by popularity.
+    - TIER_INTERVAL_SECONDS: How often indexes are promoted and demoted between tiers.
+    - TIER_HOT_INDEXES: How many of the most popular indexes every worker keeps loaded.
+    - TIER_COLD_AFTER_SECONDS: How long an index must go unqueried before it is compressed.
+    - TIER_HALF_LIFE_SECONDS: Half-life of the query count that ranks indexes by popularity.
+    - CHUNK_STORE: Whether chunk texts are stored once per node in a content-addressed chunk store that
+      indexes reference by chunk id, instead of in every index's own chunks artifact.
+    - CHUNK_CACHE_SIZE: Maximum number of chunk texts from the chunk store each worker keeps in memory.
+    - GENERATION_BATCH_WINDOW_MS: How long concurrent answer prompts are collected into one batched completion
+      call (0 sends every prompt on its own).
+    - GENERATION_BATCH_MAX_SIZE: Maximum number of prompts per batched completion call.
+    - GENERATION_TIMEOUT_SECONDS: How long a query waits for its answer before it fails with 504.
+    - RETRIEVAL_WORKERS: Number of retrieval worker processes (`python -m documents.retrieval_worker`) that own
+      the indexes of the node and run the searches of the web workers (0 searches in the web workers).
+    - RETRIEVAL_SOCKET_DIR: Directory of the retrieval workers' Unix sockets. Defaults to
+      FAISS_INDEX_DIR/retrieval.
+    - RETRIEVAL_WORKER_TIMEOUT_SECONDS: How long a web worker waits for a retrieval worker before searching
+      itself.
+    - RESUMABLE_UPLOAD_MAX_BYTES: Maximum size of a file uploaded in parts with a resumable upload. Files are
+      further limited to a third of INDEX_BUILD_MAX_MEMORY_MB, since they are read into memory to be indexed.
+    - RESUMABLE_UPLOAD_EXPIRY_SECONDS: How long a resumable upload may go without receiving a part before it
+      is removed by garbage collection.
+    - BULK_USERS_BATCH_SIZE: Number of users hashed and inserted together by bulk provisioning.
+    - BULK_USERS_HASH_WORKERS: Number of worker processes that hash the passwords of bulk provisioning.
+    - DOCUMENT_SUMMARIES: Whether an extractive summary and a section outline of every document are computed
+      when it is indexed. Indexes without one get it computed when it is first requested.
+    - SUMMARY_SENTENCES: Number of sentences in the extractive summary of a document.
+    - SUMMARY_ROUTING: Whether overview questions ("What is this document about?") are answered with the
+      document's summary instead of retrieval and generation.
+    - PROFILE_DIR: Directory where request profiles and their metadata are saved.
+    - PROFILE_SAMPLE_RATE: Fraction of all requests that are profiled (0 profiles only requests admins flag).
+    - PROFILE_MAX_FILES: How many request profiles are kept; the oldest are removed first.
+    - WARMUP_IMPORTS: Whether workers import the heavy document pipeline modules in the background at startup.
+    - WARMUP_DOCUMENT_IDS: Comma-separated IDs of documents whose indexes are loaded in the background at startup.
 
     This class inherits from `BaseSettings` provided by `pydantic_settings` to load
     environment variables and perform validation.
@@ -27,6 +95,66 @@ class Settings(BaseSettings):
     SYNC_DATABASE_URL: str = os.getenv("SYNC_DATABASE_URL")
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
     FAISS_INDEX_DIR: str = os.getenv("FAISS_INDEX_DIR")
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+    CONTEXT_CANDIDATES: int = int(os.getenv("CONTEXT_CANDIDATES", 20))
+    CONTEXT_DEDUP_THRESHOLD: float = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+    INDEX_CACHE_SIZE: int = int(os.getenv("INDEX_CACHE_SIZE", 32))
+    REINDEX_FULL_REBUILD_RATIO: float = float(os.getenv("REINDEX_FULL_REBUILD_RATIO", 0.5))
+    GC_INTERVAL_SECONDS: int = int(os.getenv("GC_INTERVAL_SECONDS", 3600))
+    GC_MIN_AGE_SECONDS: int = int(os.getenv("GC_MIN_AGE_SECONDS", 3600))
+    INDEX_STORAGE_BACKEND: str = os.getenv("INDEX_STORAGE_BACKEND", "files")
+    SEGMENT_MAX_BYTES: int = int(os.getenv("SEGMENT_MAX_BYTES", 1024 ** 3))
+    SEGMENT_COMPACT_RATIO: float = float(os.getenv("SEGMENT_COMPACT_RATIO", 0.5))
+    SHARED_INDEX_STORE: bool = os.getenv("SHARED_INDEX_STORE", "false").lower() == "true"
+    INDEX_GENERATION_CHECK_SECONDS: float = float(os.getenv("INDEX_GENERATION_CHECK_SECONDS", 1.0))
+    ADMISSION_UPLOAD_CONCURRENCY: int = int(os.getenv("ADMISSION_UPLOAD_CONCURRENCY", 4))
+    ADMISSION_QUERY_CONCURRENCY: int = int(os.getenv("ADMISSION_QUERY_CONCURRENCY", 32))
+    ADMISSION_USER_CONCURRENCY: int = int(os.getenv("ADMISSION_USER_CONCURRENCY", 2))
+    ADMISSION_ADMIN_CONCURRENCY: int = int(os.getenv("ADMISSION_ADMIN_CONCURRENCY", 8))
+    ADMISSION_USER_RATE: float = float(os.getenv("ADMISSION_USER_RATE", 1.0))
+    ADMISSION_ADMIN_RATE: float = float(os.getenv("ADMISSION_ADMIN_RATE", 10.0))
+    ADMISSION_USER_BURST: float = float(os.getenv("ADMISSION_USER_BURST", 5))
+    ADMISSION_ADMIN_BURST: float = float(os.getenv("ADMISSION_ADMIN_BURST", 50))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+    ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 10))
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9))
+    SEMANTIC_CACHE_ENTRIES: int = int(os.getenv("SEMANTIC_CACHE_ENTRIES", 256))
+    SEMANTIC_CACHE_INDEXES: int = int(os.getenv("SEMANTIC_CACHE_INDEXES", 1000))
+    BATCH_INDEX_WORKERS: int = int(os.getenv("BATCH_INDEX_WORKERS", os.cpu_count() or 1))
+    BATCH_ARCHIVE_MAX_FILES: int = int(os.getenv("BATCH_ARCHIVE_MAX_FILES", 1000))
+    BATCH_ARCHIVE_MAX_BYTES: int = int(os.getenv("BATCH_ARCHIVE_MAX_BYTES", 1024 ** 3))
+    RETRIEVAL_BACKEND: str = os.getenv("RETRIEVAL_BACKEND", "faiss")
+    FTS_DATABASE_PATH: str = os.getenv("FTS_DATABASE_PATH", "")
+    INDEX_BUILD_BATCH_SIZE: int = int(os.getenv("INDEX_BUILD_BATCH_SIZE", 10000))
+    INDEX_BUILD_MAX_MEMORY_MB: int = int(os.getenv("INDEX_BUILD_MAX_MEMORY_MB", 4096))
+    INDEX_TYPE: str = os.getenv("INDEX_TYPE", "flat")
+    PQ_SUBQUANTIZERS: int = int(os.getenv("PQ_SUBQUANTIZERS", 64))
+    PQ_MIN_CHUNKS: int = int(os.getenv("PQ_MIN_CHUNKS", 10000))
+    TIERED_STORAGE: bool = os.getenv("TIERED_STORAGE", "false").lower() == "true"
+    TIER_INTERVAL_SECONDS: int = int(os.getenv("TIER_INTERVAL_SECONDS", 300))
+    TIER_HOT_INDEXES: int = int(os.getenv("TIER_HOT_INDEXES", 16))
+    TIER_COLD_AFTER_SECONDS: int = int(os.getenv("TIER_COLD_AFTER_SECONDS", 7 * 24 * 3600))
+    TIER_HALF_LIFE_SECONDS: int = int(os.getenv("TIER_HALF_LIFE_SECONDS", 24 * 3600))
+    CHUNK_STORE: bool = os.getenv("CHUNK_STORE", "true").lower() == "true"
+    CHUNK_CACHE_SIZE: int = int(os.getenv("CHUNK_CACHE_SIZE", 100000))
+    GENERATION_BATCH_WINDOW_MS: float = float(os.getenv("GENERATION_BATCH_WINDOW_MS", 20))
+    GENERATION_BATCH_MAX_SIZE: int = int(os.getenv("GENERATION_BATCH_MAX_SIZE", 16))
+    GENERATION_TIMEOUT_SECONDS: float = float(os.getenv("GENERATION_TIMEOUT_SECONDS", 60))
+    RETRIEVAL_WORKERS: int = int(os.getenv("RETRIEVAL_WORKERS", 0))
+    RETRIEVAL_SOCKET_DIR: str = os.getenv("RETRIEVAL_SOCKET_DIR", "")
+    RETRIEVAL_WORKER_TIMEOUT_SECONDS: float = float(os.getenv("RETRIEVAL_WORKER_TIMEOUT_SECONDS", 30))
+    RESUMABLE_UPLOAD_MAX_BYTES: int = int(os.getenv("RESUMABLE_UPLOAD_MAX_BYTES", 4 * 1024 ** 3))
+    RESUMABLE_UPLOAD_EXPIRY_SECONDS: int = int(os.getenv("RESUMABLE_UPLOAD_EXPIRY_SECONDS", 24 * 3600))
+    BULK_USERS_BATCH_SIZE: int = int(os.getenv("BULK_USERS_BATCH_SIZE", 500))
+    BULK_USERS_HASH_WORKERS: int = int(os.getenv("BULK_USERS_HASH_WORKERS", os.cpu_count() or 1))
+    DOCUMENT_SUMMARIES: bool = os.getenv("DOCUMENT_SUMMARIES", "true").lower() == "true"
+    SUMMARY_SENTENCES: int = int(os.getenv("SUMMARY_SENTENCES", 5))
+    SUMMARY_ROUTING: bool = os.getenv("SUMMARY_ROUTING", "true").lower() == "true"
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+    PROFILE_MAX_FILES: int = int(os.getenv("PROFILE_MAX_FILES", 100))
+    WARMUP_IMPORTS: bool = os.getenv("WARMUP_IMPORTS", "false").lower() == "true"
+    WARMUP_DOCUMENT_IDS: str = os.getenv("WARMUP_DOCUMENT_IDS", "")
 
 
 # Instantiate settings based on the loaded environment variables
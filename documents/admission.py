@@ -0,0 +1,200 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, HTTPException
+
+from config import settings
+from users.auth import get_current_user
+from users.models import User
+from users.permissions import get_oso
+
+# How often buckets of users that have not sent requests for a while are dropped
+BUCKET_EVICTION_SECONDS = 60.0
+
+
+class TokenBucket:
+    """
+    Token bucket that refills `rate` tokens per second up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """
+        Take one token if available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the number of seconds until one is available.
+        """
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """
+        Return a token taken by `acquire`, for a request that was not admitted after all.
+        """
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self, now: float) -> bool:
+        """
+        Tell whether the bucket has refilled completely, so it holds no state worth keeping.
+        """
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+def _too_many_requests(detail: str, retry_after: float):
+    return HTTPException(
+        status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class AdmissionController:
+    """
+    Limits how many requests of an expensive endpoint run at once, globally and per user.
+
+    A request first takes a token from its user's token bucket, then waits for a free slot under both
+    the global and the per-user concurrency cap. At most `max_queue` requests wait at a time and each
+    waits at most `max_wait` seconds; requests that cannot be admitted are rejected with 429 and a
+    `Retry-After` header, and their token is returned to the bucket. Admins (the `use_admin_limits`
+    permission of `users/policy.polar`) get their own, separate per-user limits.
+
+    Buckets that have refilled completely are dropped every `BUCKET_EVICTION_SECONDS`, so the buckets of
+    users that stopped sending requests do not accumulate.
+    """
+
+    def __init__(self, name: str, global_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.global_concurrency = global_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._active = 0
+        self._active_per_user = {}
+        self._buckets = {}
+        self._buckets_evicted = time.monotonic()
+        self._queue_depth = 0
+        self._condition = asyncio.Condition()
+        self.counters = {"admitted": 0, "rejected_rate": 0, "rejected_queue_full": 0, "shed_deadline": 0}
+
+    @staticmethod
+    def _limits(is_admin: bool):
+        if is_admin:
+            return settings.ADMISSION_ADMIN_CONCURRENCY, settings.ADMISSION_ADMIN_RATE, settings.ADMISSION_ADMIN_BURST
+        return settings.ADMISSION_USER_CONCURRENCY, settings.ADMISSION_USER_RATE, settings.ADMISSION_USER_BURST
+
+    def _evict_idle_buckets(self):
+        now = time.monotonic()
+        if now - self._buckets_evicted < BUCKET_EVICTION_SECONDS:
+            return
+        self._buckets_evicted = now
+        for user_id in [user_id for user_id, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[user_id]
+
+    def _can_run(self, user_id: int, user_concurrency: int) -> bool:
+        return (
+            self._active < self.global_concurrency
+            and self._active_per_user.get(user_id, 0) < user_concurrency
+        )
+
+    @asynccontextmanager
+    async def admit(self, user: User):
+        """
+        Hold an admission slot for the duration of the block.
+
+        Raises:
+            HTTPException: 429 if the user's rate is exceeded, the wait queue is full or no slot became
+                           free within `max_wait` seconds.
+        """
+        is_admin = get_oso().is_allowed(user, "use_admin_limits", None)
+        user_concurrency, rate, burst = self._limits(is_admin)
+
+        self._evict_idle_buckets()
+        bucket = self._buckets.get(user.id)
+        if bucket is None or bucket.rate != rate:
+            bucket = self._buckets[user.id] = TokenBucket(rate, burst)
+        retry_after = bucket.acquire()
+        if retry_after:
+            self.counters["rejected_rate"] += 1
+            raise _too_many_requests("Rate limit exceeded", retry_after)
+
+        async with self._condition:
+            if not self._can_run(user.id, user_concurrency):
+                if self._queue_depth >= self.max_queue:
+                    bucket.refund()
+                    self.counters["rejected_queue_full"] += 1
+                    raise _too_many_requests("Server is busy", self.max_wait)
+
+                deadline = time.monotonic() + self.max_wait
+                self._queue_depth += 1
+                try:
+                    while not self._can_run(user.id, user_concurrency):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            bucket.refund()
+                            self.counters["shed_deadline"] += 1
+                            raise _too_many_requests("Server is busy", self.max_wait)
+                        try:
+                            await asyncio.wait_for(self._condition.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                except asyncio.CancelledError:
+                    # The client went away while the request was queued
+                    bucket.refund()
+                    raise
+                finally:
+                    self._queue_depth -= 1
+
+            self._active += 1
+            self._active_per_user[user.id] = self._active_per_user.get(user.id, 0) + 1
+            self.counters["admitted"] += 1
+
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._active -= 1
+                self._active_per_user[user.id] -= 1
+                if not self._active_per_user[user.id]:
+                    del self._active_per_user[user.id]
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "active_users": len(self._active_per_user),
+            "queue_depth": self._queue_depth,
+            "buckets": len(self._buckets),
+            "global_concurrency": self.global_concurrency,
+            **self.counters,
+        }
+
+
+def admission(controller: AdmissionController):
+    """
+    Build a route dependency that holds an admission slot of `controller` while the request is handled.
+    """
+    async def dependency(current_user: User = Depends(get_current_user)):
+        async with controller.admit(current_user):
+            yield
+
+    return dependency
+
+
+upload_admission = AdmissionController(
+    "upload", settings.ADMISSION_UPLOAD_CONCURRENCY, settings.ADMISSION_MAX_QUEUE, settings.ADMISSION_MAX_WAIT_SECONDS
+)
+query_admission = AdmissionController(
+    "query", settings.ADMISSION_QUERY_CONCURRENCY, settings.ADMISSION_MAX_QUEUE, settings.ADMISSION_MAX_WAIT_SECONDS
+)
@@ -0,0 +1,464 @@
+import fcntl
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+from config import settings
+
+# File suffix of each named artifact in the file store
+ARTIFACT_SUFFIXES = {
+    "index": ".index",
+    "chunks": "_chunks.pkl",
+    "vectorizer": "_vectorizer.pkl",
+    "shared": ".shared",
+    "summary": "_summary.json",
+}
+
+# Segment entries start at a multiple of this, so mapped arrays are aligned
+SEGMENT_ALIGNMENT = 64
+
+# Size of the blocks artifacts given as file objects are copied into the store in
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+# Prefix of artifacts compressed by the cold storage tier; pickles and FAISS indexes never start with it
+COMPRESSED_MAGIC = b"\0ZLB"
+
+
+def compress_artifact(data) -> bytes:
+    return COMPRESSED_MAGIC + zlib.compress(data, 6)
+
+
+def is_compressed(data) -> bool:
+    return bytes(data[:len(COMPRESSED_MAGIC)]) == COMPRESSED_MAGIC
+
+
+def decompress_artifact(data) -> bytes:
+    """
+    Return the original bytes of an artifact that may have been compressed with `compress_artifact`.
+    """
+    if is_compressed(data):
+        return zlib.decompress(memoryview(data)[len(COMPRESSED_MAGIC):])
+    return data
+
+
+def _write_artifact(f, data) -> tuple:
+    """
+    Write an artifact given as bytes, or as a binary file object that is copied block by block, to `f`.
+
+    Returns:
+        tuple: The length and CRC-32 checksum of the written bytes.
+    """
+    if not hasattr(data, "read"):
+        f.write(data)
+        return len(data), zlib.crc32(data)
+
+    length = checksum = 0
+    for block in iter(lambda: data.read(WRITE_BLOCK_SIZE), b""):
+        f.write(block)
+        length += len(block)
+        checksum = zlib.crc32(block, checksum)
+    return length, checksum
+
+
+class FileArtifactStore:
+    """
+    Stores each artifact of an index ID as its own file in `settings.FAISS_INDEX_DIR`.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, document_id: str, name: str) -> str:
+        return os.path.join(self.directory, f"{document_id}{ARTIFACT_SUFFIXES[name]}")
+
+    def write(self, document_id: str, artifacts: dict):
+        """
+        Write artifacts of an index ID, each under a temporary name that is renamed into place, so a file
+        is never seen half-written.
+
+        Artifacts are given as bytes or as binary file objects, which are copied without being read into
+        memory as a whole.
+        """
+        for name, data in artifacts.items():
+            path = self.path(document_id, name)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                _write_artifact(f, data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    def read(self, document_id: str, name: str, decompress: bool = True) -> bytes:
+        with open(self.path(document_id, name), "rb") as f:
+            data = f.read()
+        return decompress_artifact(data) if decompress else data
+
+    def map(self, document_id: str, name: str) -> memoryview:
+        with open(self.path(document_id, name), "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def exists(self, document_id: str, name: str) -> bool:
+        return os.path.exists(self.path(document_id, name))
+
+    def fingerprint(self, document_id: str, name: str) -> tuple:
+        """
+        Return a value that changes when an artifact is rewritten.
+
+        Raises:
+            FileNotFoundError: If the artifact does not exist.
+        """
+        stat = os.stat(self.path(document_id, name))
+        return stat.st_size, stat.st_mtime_ns
+
+    def delete(self, document_id: str, names=None) -> int:
+        bytes_reclaimed = 0
+        for name in names or ARTIFACT_SUFFIXES:
+            try:
+                path = self.path(document_id, name)
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            bytes_reclaimed += size
+        return bytes_reclaimed
+
+    def touch(self, document_id: str):
+        """
+        Restart the age of the artifacts of an index ID, which `collect_garbage` measures from now on.
+        """
+        for name in ARTIFACT_SUFFIXES:
+            try:
+                os.utime(self.path(document_id, name))
+            except FileNotFoundError:
+                continue
+
+    def document_ids(self) -> set:
+        suffix = ARTIFACT_SUFFIXES["vectorizer"]
+        return {name[:-len(suffix)] for name in os.listdir(self.directory) if name.endswith(suffix)}
+
+    def _artifact_document_id(self, filename: str):
+        """
+        Return the index ID an artifact file belongs to, or None if the file is not an index artifact.
+
+        Leftovers of interrupted writes (`<artifact>.<pid>.<thread>.tmp`) belong to the index ID of the artifact.
+        """
+        if filename.endswith(".tmp"):
+            filename = filename.rsplit(".", 3)[0]
+        for suffix in ARTIFACT_SUFFIXES.values():
+            if filename.endswith(suffix):
+                return filename[:-len(suffix)]
+        return None
+
+    def collect_garbage(self, referenced_document_ids: set, min_age: float) -> dict:
+        """
+        Remove the artifacts of index IDs that are not referenced and older than `min_age` seconds.
+        """
+        cutoff = time.time() - min_age
+        files_removed = 0
+        bytes_reclaimed = 0
+
+        for entry in os.scandir(self.directory):
+            document_id = self._artifact_document_id(entry.name)
+            if not entry.is_file() or document_id is None or document_id in referenced_document_ids:
+                continue
+            stat = entry.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            files_removed += 1
+            bytes_reclaimed += stat.st_size
+
+        return {"files_removed": files_removed, "bytes_reclaimed": bytes_reclaimed}
+
+    def compact(self) -> dict:
+        """
+        Files are removed individually, so there is nothing to compact.
+        """
+        return {"segments_compacted": 0, "bytes_reclaimed": 0}
+
+
+class SegmentArtifactStore:
+    """
+    Appends the artifacts of all index IDs into a few large segment files.
+
+    A SQLite offset index maps `(document_id, name)` to `(segment, offset, length, checksum)`. Writes
+    append to the active segment and fsync it before the offset records are committed, so after a crash
+    a segment can contain unreferenced bytes but an offset record never points at incomplete data.
+    Appends from all worker processes are serialized with an exclusive lock on `write.lock`.
+
+    Deleting an index ID only removes its offset records. `compact` rewrites the live entries of sealed
+    segments with too many dead bytes into the active segment and removes the old segment files.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._maps = {}
+        self._maps_lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "document_id TEXT NOT NULL, name TEXT NOT NULL, segment INTEGER NOT NULL, "
+                "offset INTEGER NOT NULL, length INTEGER NOT NULL, checksum INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (document_id, name))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_segment ON entries (segment)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Return this thread's connection to the offset index.
+        """
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.directory, "offsets.db"), timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=FULL")
+            self._local.db = db
+        return db
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}.seg")
+
+    def _segments(self) -> list:
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+    def _append(self, entries: dict, exclude: set = frozenset()) -> list:
+        """
+        Append blobs to the active segment and return their `(name, segment, offset, length, checksum)`.
+
+        Must be called while holding the write lock. A new segment is started when the active one has
+        reached `settings.SEGMENT_MAX_BYTES` or is in `exclude`.
+        """
+        segments = self._segments()
+        segment = segments[-1] if segments else 1
+        if segment in exclude or (
+            os.path.exists(self.segment_path(segment))
+            and os.path.getsize(self.segment_path(segment)) >= settings.SEGMENT_MAX_BYTES
+        ):
+            segment = max(segments + list(exclude)) + 1
+
+        records = []
+        with open(self.segment_path(segment), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for name, data in entries.items():
+                padding = -offset % SEGMENT_ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                length, checksum = _write_artifact(f, data)
+                records.append((name, segment, offset, length, checksum))
+                offset += length
+            f.flush()
+            os.fsync(f.fileno())
+        return records
+
+    def _write_lock(self):
+        lock = open(os.path.join(self.directory, "write.lock"), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def write(self, document_id: str, artifacts: dict):
+        """
+        Append artifacts of an index ID, given as bytes or binary file objects, and commit their offset records.
+        """
+        with self._write_lock():
+            records = self._append(artifacts)
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(document_id, *record, time.time()) for record in records],
+                )
+
+    def _lookup(self, document_id: str, name: str):
+        row = self._connect().execute(
+            "SELECT segment, offset, length, checksum FROM entries WHERE document_id = ? AND name = ?",
+            (document_id, name),
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"No artifact {name!r} for index {document_id}")
+        return row
+
+    def read(self, document_id: str, name: str, decompress: bool = True) -> bytes:
+        """
+        Read an artifact with `pread`, verifying its checksum.
+        """
+        for attempt in range(2):
+            segment, offset, length, checksum = self._lookup(document_id, name)
+            try:
+                fd = os.open(self.segment_path(segment), os.O_RDONLY)
+            except FileNotFoundError:
+                # The segment was compacted between the lookup and the open; look the entry up again
+                if attempt:
+                    raise
+                continue
+            try:
+                data = os.pread(fd, length, offset)
+            finally:
+                os.close(fd)
+            if zlib.crc32(data) != checksum:
+                raise IOError(f"Checksum mismatch for artifact {name!r} of index {document_id}")
+            return decompress_artifact(data) if decompress else data
+
+    def map(self, document_id: str, name: str) -> memoryview:
+        """
+        Return a read-only view of an artifact in the memory-mapped segment file.
+        """
+        self._drop_stale_maps()
+        for attempt in range(2):
+            segment, offset, length, _ = self._lookup(document_id, name)
+            with self._maps_lock:
+                cached = self._maps.get(segment)
+                if cached is None or len(cached[0]) < offset + length:
+                    try:
+                        with open(self.segment_path(segment), "rb") as f:
+                            cached = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), os.fstat(f.fileno()).st_ino
+                    except FileNotFoundError:
+                        # The segment was compacted between the lookup and the open; look the entry up again
+                        if attempt:
+                            raise
+                        continue
+                    self._maps[segment] = cached
+            return memoryview(cached[0])[offset:offset + length]
+
+    def _drop_stale_maps(self):
+        """
+        Forget the mappings of segments that were removed or replaced since they were mapped, e.g. by `compact`
+        in another process, so their disk space is freed once the views of them are released.
+        """
+        with self._maps_lock:
+            for segment, (_, inode) in list(self._maps.items()):
+                try:
+                    current = os.stat(self.segment_path(segment)).st_ino
+                except FileNotFoundError:
+                    current = None
+                if current != inode:
+                    del self._maps[segment]
+
+    def exists(self, document_id: str, name: str) -> bool:
+        try:
+            self._lookup(document_id, name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def fingerprint(self, document_id: str, name: str) -> tuple:
+        """
+        Return a value that changes when an artifact is rewritten, but not when it is moved by compaction.
+
+        Raises:
+            FileNotFoundError: If the artifact does not exist.
+        """
+        _, _, length, checksum = self._lookup(document_id, name)
+        return length, checksum
+
+    def delete(self, document_id: str, names=None) -> int:
+        names = list(names or ARTIFACT_SUFFIXES)
+        placeholders = ", ".join("?" * len(names))
+        db = self._connect()
+        with db:
+            (length,) = db.execute(
+                f"SELECT COALESCE(SUM(length), 0) FROM entries WHERE document_id = ? AND name IN ({placeholders})",
+                (document_id, *names),
+            ).fetchone()
+            db.execute(f"DELETE FROM entries WHERE document_id = ? AND name IN ({placeholders})", (document_id, *names))
+        return length
+
+    def touch(self, document_id: str):
+        """
+        Restart the age of the artifacts of an index ID, which `collect_garbage` measures from now on.
+        """
+        db = self._connect()
+        with db:
+            db.execute("UPDATE entries SET created_at = ? WHERE document_id = ?", (time.time(), document_id))
+
+    def document_ids(self) -> set:
+        return {row[0] for row in self._connect().execute("SELECT DISTINCT document_id FROM entries")}
+
+    def collect_garbage(self, referenced_document_ids: set, min_age: float) -> dict:
+        """
+        Delete the offset records of unreferenced index IDs older than `min_age` seconds, then compact the
+        segments to reclaim their space. The removed files are the compacted segments.
+        """
+        cutoff = time.time() - min_age
+        rows = self._connect().execute(
+            "SELECT document_id, MAX(created_at) FROM entries GROUP BY document_id"
+        ).fetchall()
+        orphans = [
+            document_id for document_id, created_at in rows
+            if document_id not in referenced_document_ids and created_at <= cutoff
+        ]
+        for document_id in orphans:
+            self.delete(document_id)
+
+        compacted = self.compact()
+        return {
+            "files_removed": compacted["segments_compacted"],
+            "bytes_reclaimed": compacted["bytes_reclaimed"],
+            "indexes_removed": len(orphans),
+        }
+
+    def compact(self) -> dict:
+        """
+        Rewrite sealed segments whose share of dead bytes exceeds `settings.SEGMENT_COMPACT_RATIO`.
+
+        The live entries are copied into a new segment and their offset records are switched in one
+        transaction before the old segment is removed. Readers that already mapped the old segment keep
+        their mapping; readers that look an entry up again find it in the new segment.
+        """
+        segments_compacted = 0
+        bytes_reclaimed = 0
+
+        with self._write_lock():
+            db = self._connect()
+            segments = self._segments()
+            for segment in segments[:-1]:
+                size = os.path.getsize(self.segment_path(segment))
+                live = db.execute(
+                    "SELECT document_id, name, offset, length FROM entries WHERE segment = ?", (segment,)
+                ).fetchall()
+                live_bytes = sum(length for *_, length in live)
+                if size == 0 or (size - live_bytes) / size < settings.SEGMENT_COMPACT_RATIO:
+                    continue
+
+                fd = os.open(self.segment_path(segment), os.O_RDONLY)
+                try:
+                    for document_id, name, offset, length in live:
+                        (record,) = self._append({name: os.pread(fd, length, offset)}, exclude=set(segments))
+                        db.execute(
+                            "UPDATE entries SET segment = ?, offset = ?, length = ?, checksum = ? "
+                            "WHERE document_id = ? AND name = ?",
+                            (*record[1:], document_id, name),
+                        )
+                finally:
+                    os.close(fd)
+                db.commit()
+
+                new_size = sum(length for *_, length in live)
+                os.remove(self.segment_path(segment))
+                with self._maps_lock:
+                    self._maps.pop(segment, None)
+                segments_compacted += 1
+                bytes_reclaimed += size - new_size
+
+        return {"segments_compacted": segments_compacted, "bytes_reclaimed": bytes_reclaimed}
+
+
+@lru_cache(maxsize=None)
+def get_artifact_store():
+    """
+    Return the artifact store selected by `settings.INDEX_STORAGE_BACKEND` ("files" or "segments").
+    """
+    if settings.INDEX_STORAGE_BACKEND == "segments":
+        return SegmentArtifactStore(os.path.join(settings.FAISS_INDEX_DIR, "segments"))
+    if settings.INDEX_STORAGE_BACKEND == "files":
+        return FileArtifactStore(settings.FAISS_INDEX_DIR)
+    raise ValueError(f"Unknown index storage backend {settings.INDEX_STORAGE_BACKEND!r}")
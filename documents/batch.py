@@ -0,0 +1,164 @@
+import asyncio
+import os
+import tarfile
+import zipfile
+from typing import Callable
+from uuid import uuid4
+
+from config import settings
+from process_pool import ProcessPool
+from documents.indexer import IndexTooLargeError, index_document, max_file_bytes
+from documents.storage import UPLOAD_DIR
+from documents.utils import CONTENT_TYPES_BY_EXTENSION, extract_text_from_bytes
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# Size of the blocks uploads and archive members are copied in
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _extension(filename: str) -> str:
+    return os.path.splitext(filename)[1].lower()
+
+
+class ArchiveTooLargeError(Exception):
+    """
+    Raised when an uploaded archive has more files, or expands to more bytes, than a batch upload allows.
+    """
+
+
+def _store_stream(stream, filename: str, budget: list = None) -> str:
+    """
+    Copy a file-like object into the upload directory under a unique name, block by block.
+
+    Args:
+        stream: The file-like object to copy.
+        filename (str): Name of the file; its extension is kept.
+        budget (list, optional): Remaining number of bytes the copy may take, as a one-element list that
+                                 is decremented by the copied bytes.
+
+    Raises:
+        ArchiveTooLargeError: If the copy exceeds the budget; the partial file is removed.
+    """
+    file_path = os.path.join(UPLOAD_DIR, f"{uuid4()}{_extension(filename)}")
+    with open(file_path, "wb") as f:
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b""):
+            if budget is not None:
+                budget[0] -= len(block)
+                if budget[0] < 0:
+                    break
+            f.write(block)
+    if budget is not None and budget[0] < 0:
+        os.remove(file_path)
+        raise ArchiveTooLargeError(f"The archive expands to more than {settings.BATCH_ARCHIVE_MAX_BYTES} bytes")
+    return file_path
+
+
+def _stage_member(stream, filename: str, content_type: str = None, budget: list = None) -> dict:
+    """
+    Store one file of a batch and describe it, or record why it cannot be indexed.
+    """
+    content_type = content_type or CONTENT_TYPES_BY_EXTENSION.get(_extension(filename))
+    if content_type not in CONTENT_TYPES_BY_EXTENSION.values():
+        return {"filename": filename, "error": "Unsupported file type"}
+    return {
+        "filename": filename, "content_type": content_type, "file_path": _store_stream(stream, filename, budget)
+    }
+
+
+def _check_member_count(staged: list):
+    """
+    Count the files of an archive against `settings.BATCH_ARCHIVE_MAX_FILES` as they are staged.
+    """
+    if len(staged) >= settings.BATCH_ARCHIVE_MAX_FILES:
+        raise ArchiveTooLargeError(f"The archive holds more than {settings.BATCH_ARCHIVE_MAX_FILES} files")
+
+
+def stage_upload(file) -> list:
+    """
+    Store an uploaded file, or every file of an uploaded zip/tar archive, in the upload directory.
+
+    Archives are read from the spooled upload on disk one member at a time, so they are never loaded into
+    memory as a whole. The content type of archive members is derived from their file extension. An
+    archive with more than `settings.BATCH_ARCHIVE_MAX_FILES` files, or whose files add up to more than
+    `settings.BATCH_ARCHIVE_MAX_BYTES`, is rejected as a whole, counting the bytes actually extracted
+    rather than the sizes the archive declares.
+
+    Args:
+        file (UploadFile): An uploaded document or archive.
+
+    Returns:
+        list: One dict per file with its name and either its stored path and content type, or an error.
+    """
+    name = file.filename.lower()
+    if not name.endswith(ARCHIVE_EXTENSIONS):
+        return [_stage_member(file.file, file.filename, file.content_type)]
+
+    staged = []
+    budget = [settings.BATCH_ARCHIVE_MAX_BYTES]
+    try:
+        if name.endswith(".zip"):
+            with zipfile.ZipFile(file.file) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        _check_member_count(staged)
+                        with archive.open(info) as member:
+                            staged.append(_stage_member(member, info.filename, budget=budget))
+        else:
+            with tarfile.open(fileobj=file.file, mode="r|*") as archive:
+                for info in archive:
+                    if info.isfile():
+                        _check_member_count(staged)
+                        staged.append(_stage_member(archive.extractfile(info), info.name, budget=budget))
+    except (zipfile.BadZipFile, tarfile.TarError, ArchiveTooLargeError) as e:
+        for entry in staged:
+            if "file_path" in entry:
+                os.remove(entry["file_path"])
+        error = str(e) if isinstance(e, ArchiveTooLargeError) else f"Invalid archive: {e}"
+        staged = [{"filename": file.filename, "error": error}]
+    return staged
+
+
+def index_file(file_path: str, content_type: str, progress: Callable = None) -> str:
+    """
+    Extract the text of a stored file and index it. Runs in a worker process of the index pool, or in a
+    thread for single uploads that report their progress.
+
+    Returns:
+        str: The unique identifier of the created index.
+
+    Raises:
+        IndexTooLargeError: If the file is too large to be read and indexed within the memory ceiling.
+    """
+    limit = max_file_bytes()
+    if limit is not None and os.path.getsize(file_path) > limit:
+        raise IndexTooLargeError(
+            f"Files larger than {limit} bytes cannot be indexed within {settings.INDEX_BUILD_MAX_MEMORY_MB} MB"
+        )
+    with open(file_path, "rb") as f:
+        content = extract_text_from_bytes(f.read(), content_type)
+    return index_document(content, progress)
+
+
+# Process pool batch uploads are indexed in
+index_pool = ProcessPool(lambda: settings.BATCH_INDEX_WORKERS)
+
+
+async def index_staged_files(staged: list):
+    """
+    Index the successfully staged files of a batch in parallel across the index pool.
+
+    Each entry gets a `document_id` on success or an `error` on failure; the stored file of a failed
+    entry is removed. A file whose indexing process died is retried once on a restarted pool.
+    """
+    pending = [entry for entry in staged if "error" not in entry]
+    results = await asyncio.gather(
+        *[index_pool.run(index_file, entry["file_path"], entry["content_type"]) for entry in pending],
+        return_exceptions=True,
+    )
+    for entry, result in zip(pending, results):
+        if isinstance(result, Exception):
+            entry["error"] = f"Indexing failed: {result}"
+            os.remove(entry.pop("file_path"))
+        else:
+            entry["document_id"] = result
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionBatcher:
+    """
+    Collects concurrent completion prompts with the same parameters into batched completion calls.
+
+    The first prompt for a set of parameters opens a batch that is sent after `window` seconds, or as
+    soon as it holds `max_batch` prompts. The batch is sent as one call with a list of prompts, and every
+    caller receives the completion of its own prompt. If the batched call fails, the prompts are retried
+    as individual calls, so one bad prompt only fails its own caller. Prompts the call returned no
+    completion for fail right away rather than when their callers time out.
+    """
+
+    def __init__(self, complete, window: float, max_batch: int):
+        """
+        Args:
+            complete (Callable): Blocking function that takes a list of prompts and keyword parameters
+                                 and returns the completion texts in prompt order.
+            window (float): Seconds a batch collects prompts before it is sent.
+            max_batch (int): Maximum number of prompts per call.
+        """
+        self.complete = complete
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        # Keep references to the tasks sending batches so they are not garbage collected while running
+        self._tasks = set()
+        self.counters = {"calls": 0, "prompts": 0, "fallback_calls": 0, "timeouts": 0}
+
+    async def submit(self, prompt: str, timeout: float = None, **params) -> str:
+        """
+        Add a prompt to the open batch for its parameters and wait for its completion.
+
+        Args:
+            prompt (str): The prompt to complete.
+            timeout (float, optional): Seconds to wait for the completion before giving up.
+            **params: Completion parameters; only prompts with equal parameters share a call.
+
+        Returns:
+            str: The completion text of the prompt.
+
+        Raises:
+            asyncio.TimeoutError: If the completion did not arrive within `timeout` seconds.
+        """
+        key = tuple(sorted(params.items()))
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((prompt, future))
+        if len(batch) >= self.max_batch:
+            self._send(key)
+        elif len(batch) == 1:
+            asyncio.get_running_loop().call_later(self.window, self._send, key, batch)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+
+    def _send(self, key: tuple, batch: list = None):
+        """
+        Close the open batch for a parameter key and send it, unless it was already sent.
+        """
+        if key not in self._pending or (batch is not None and self._pending[key] is not batch):
+            return
+        batch = self._pending.pop(key)
+        task = asyncio.ensure_future(self._run(dict(key), batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, params: dict, batch: list):
+        prompts = [prompt for prompt, _ in batch]
+        self.counters["calls"] += 1
+        self.counters["prompts"] += len(prompts)
+        try:
+            texts = await asyncio.to_thread(self.complete, prompts, **params)
+        except Exception as e:
+            if len(batch) == 1:
+                self._resolve(batch[0][1], error=e)
+                return
+            logger.warning("Batched completion of %d prompts failed, retrying them one by one: %s", len(batch), e)
+            self.counters["fallback_calls"] += len(batch)
+            results = await asyncio.gather(
+                *[asyncio.to_thread(self.complete, [prompt], **params) for prompt in prompts],
+                return_exceptions=True,
+            )
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self._resolve(future, error=result)
+                elif not result:
+                    self._resolve(future, error=RuntimeError("The completion call returned no completion"))
+                else:
+                    self._resolve(future, result[0])
+            return
+
+        for position, (_, future) in enumerate(batch):
+            if position < len(texts):
+                self._resolve(future, texts[position])
+            else:
+                self._resolve(future, error=RuntimeError(
+                    f"The completion call returned {len(texts)} completions for {len(batch)} prompts"
+                ))
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: str = None, error: Exception = None):
+        # The caller may have timed out, which leaves the shielded future pending but unobserved
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        calls = self.counters["calls"]
+        return {
+            **self.counters,
+            "average_batch_size": self.counters["prompts"] / calls if calls else 0.0,
+            "pending": sum(len(batch) for batch in self._pending.values()),
+        }
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tarfile
+import tempfile
+import time
+import uuid
+import zlib
+
+from config import settings
+from documents import fts
+from documents.artifacts import COMPRESSED_MAGIC, get_artifact_store, is_compressed
+from documents.batch import COPY_BUFFER_SIZE
+from documents.chunk_store import decode_chunks, encode_chunks
+from documents.storage import UPLOAD_DIR, delete_index_artifacts
+from documents.utils import CONTENT_TYPES_BY_EXTENSION
+
+BUNDLE_FORMAT = "document-bundle"
+BUNDLE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+# Bundle member names of the artifacts of each document, relative to the document's directory
+ARTIFACT_MEMBERS = {"index": "index.faiss", "vectorizer": "vectorizer.pkl", "chunks": "chunks.json"}
+
+
+class BundleError(Exception):
+    """
+    Raised when a bundle cannot be imported because it is malformed or its contents do not match its manifest.
+    """
+
+
+def _artifact_blocks(store, document_id: str, name: str):
+    """
+    Yield the original bytes of an artifact block by block, decompressing artifacts of the cold tier.
+    """
+    view = store.map(document_id, name)
+    try:
+        if is_compressed(view):
+            decompressor = zlib.decompressobj()
+            for start in range(len(COMPRESSED_MAGIC), len(view), COPY_BUFFER_SIZE):
+                yield decompressor.decompress(view[start:start + COPY_BUFFER_SIZE])
+            yield decompressor.flush()
+        else:
+            for start in range(0, len(view), COPY_BUFFER_SIZE):
+                yield bytes(view[start:start + COPY_BUFFER_SIZE])
+    finally:
+        view.release()
+
+
+def _chunk_blocks(chunks):
+    """
+    Yield the chunks of an index as a JSON array: [chunk id, text] pairs, or plain texts for indexes
+    without chunk ids.
+    """
+    items = chunks if isinstance(chunks, list) else chunks.items()
+    yield b"["
+    for position, item in enumerate(items):
+        yield (", " if position else "").encode("utf-8") + json.dumps(item).encode("utf-8")
+    yield b"]"
+
+
+def _write_member(directory: str, name: str, blocks) -> dict:
+    """
+    Write the blocks of a bundle member to the staging directory and describe it for the manifest.
+    """
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as f:
+        for block in blocks:
+            f.write(block)
+            digest.update(block)
+            size += len(block)
+    return {"size": size, "sha256": digest.hexdigest()}
+
+
+def _file_blocks(path: str):
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(COPY_BUFFER_SIZE), b"")
+
+
+def stage_bundle(documents: list) -> str:
+    """
+    Write the members of a bundle of documents, and the manifest describing them, to a staging directory.
+
+    Args:
+        documents (list): The Document rows to export.
+
+    Returns:
+        str: The staging directory, to be streamed with `bundle_blocks` and removed afterwards.
+
+    Raises:
+        FileNotFoundError: If the file or an index artifact of a document is missing.
+    """
+    store = get_artifact_store()
+    directory = tempfile.mkdtemp(prefix="bundle-")
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "created_at": time.time(),
+        "documents": [],
+        "files": {},
+    }
+    try:
+        for position, document in enumerate(documents):
+            chunks = decode_chunks(store.read(document.document_id, "chunks"))
+            members = {"source": f"{position}/source{os.path.splitext(document.file_path)[1].lower()}"}
+            manifest["files"][members["source"]] = _write_member(
+                directory, members["source"], _file_blocks(document.file_path)
+            )
+            for name, member in ARTIFACT_MEMBERS.items():
+                members[name] = f"{position}/{member}"
+                blocks = _chunk_blocks(chunks) if name == "chunks" else _artifact_blocks(
+                    store, document.document_id, name
+                )
+                manifest["files"][members[name]] = _write_member(directory, members[name], blocks)
+            manifest["documents"].append({
+                "filename": document.filename,
+                "created_at": document.created_at.isoformat() if document.created_at else None,
+                "chunks": len(chunks),
+                "members": members,
+            })
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+    return directory
+
+
+def _tar_header(name: str, size: int) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    return info.tobuf(tarfile.PAX_FORMAT)
+
+
+def bundle_blocks(directory: str):
+    """
+    Yield a staged bundle as an uncompressed tar stream, the manifest first, and remove the staging
+    directory once it was sent.
+
+    The tar headers are written here rather than with `tarfile.TarFile.addfile`, which copies a whole
+    member into its output at once; this way no more than one block is held in memory.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        for name in [MANIFEST_NAME, *manifest["files"]]:
+            path = os.path.join(directory, name)
+            size = os.path.getsize(path)
+            yield _tar_header(name, size)
+            yield from _file_blocks(path)
+            if size % tarfile.BLOCKSIZE:
+                yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _read_manifest(archive) -> dict:
+    member = archive.next()
+    if member is None or member.name != MANIFEST_NAME or not member.isfile():
+        raise BundleError(f"The bundle does not start with {MANIFEST_NAME}")
+    try:
+        manifest = json.load(archive.extractfile(member))
+    except ValueError as e:
+        raise BundleError(f"Invalid manifest: {e}")
+    if not isinstance(manifest, dict):
+        raise BundleError("Invalid manifest: expected a JSON object")
+    if manifest.get("format") != BUNDLE_FORMAT or manifest.get("version") != BUNDLE_VERSION:
+        raise BundleError(f"Unsupported bundle format {manifest.get('format')!r} {manifest.get('version')!r}")
+    if not isinstance(manifest.get("documents"), list) or not isinstance(manifest.get("files"), dict):
+        raise BundleError("The manifest does not list the documents and files of the bundle")
+
+    for name, expected in manifest["files"].items():
+        if not (isinstance(expected, dict) and isinstance(expected.get("size"), int)
+                and isinstance(expected.get("sha256"), str)):
+            raise BundleError(f"The manifest has no size and checksum of {name}")
+    for position, document in enumerate(manifest["documents"]):
+        members = document.get("members") if isinstance(document, dict) else None
+        if not (isinstance(members, dict) and set(members) == {"source", *ARTIFACT_MEMBERS}
+                and set(members.values()) <= set(manifest["files"]) and isinstance(document.get("filename"), str)):
+            raise BundleError(f"The manifest entry of document {position} is incomplete")
+        if os.path.splitext(members["source"])[1] not in CONTENT_TYPES_BY_EXTENSION:
+            raise BundleError(f"Unsupported file type of {document['filename']!r}")
+    return manifest
+
+
+def _copy_member(archive, member, path: str, expected: dict):
+    """
+    Copy a bundle member to `path` block by block, verifying its size and SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    stream = archive.extractfile(member)
+    with open(path, "wb") as f:
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b""):
+            f.write(block)
+            digest.update(block)
+            size += len(block)
+    if size != expected["size"] or digest.hexdigest() != expected["sha256"]:
+        raise BundleError(f"The checksum of {member.name} does not match the manifest")
+
+
+def _read_chunks(path: str):
+    with open(path, "rb") as f:
+        try:
+            items = json.load(f)
+        except ValueError as e:
+            raise BundleError(f"Invalid chunks: {e}")
+    if not isinstance(items, list):
+        raise BundleError("Invalid chunks: expected a JSON array")
+    if all(isinstance(item, str) for item in items):
+        return items
+    try:
+        return {int(chunk_id): str(text) for chunk_id, text in items}
+    except (TypeError, ValueError) as e:
+        raise BundleError(f"Invalid chunks: {e}")
+
+
+def import_bundle(fileobj) -> list:
+    """
+    Import the documents of a bundle: store their files and write their prebuilt index artifacts under
+    new index IDs, without re-indexing.
+
+    The bundle is read as a stream, one member at a time, and every member is verified against the size
+    and SHA-256 digest in the manifest. Nothing is kept if any member does not match. The index and
+    vectorizer of each document are then copied into the artifact store block by block; only the chunk
+    texts of one document at a time are held in memory. Chunk texts go to the chunk store and, with
+    `settings.RETRIEVAL_BACKEND` set to "fts5", to the full-text search database, like those of documents
+    indexed here.
+
+    Bundles contain pickled vectorizers and serialized FAISS indexes, which execute code when they are
+    loaded, so they must only be imported from trusted sources.
+
+    Args:
+        fileobj: File-like object the tar stream of the bundle is read from.
+
+    Returns:
+        list: The filename, stored file path and index ID of every imported document.
+
+    Raises:
+        BundleError: If the bundle is malformed or a member does not match the manifest.
+    """
+    staging = tempfile.mkdtemp(prefix="bundle-")
+    stored = {}
+    staged = {}
+    index_ids = []
+    try:
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|") as archive:
+                manifest = _read_manifest(archive)
+                sources = {document["members"]["source"] for document in manifest["documents"]}
+                for member in iter(archive.next, None):
+                    if member.name not in manifest["files"] or member.name in stored or member.name in staged:
+                        raise BundleError(f"Unexpected bundle member {member.name}")
+                    if not member.isfile():
+                        raise BundleError(f"Bundle member {member.name} is not a regular file")
+                    if member.name in sources:
+                        path = stored[member.name] = os.path.join(
+                            UPLOAD_DIR, f"{uuid.uuid4()}{os.path.splitext(member.name)[1]}"
+                        )
+                    else:
+                        path = staged[member.name] = os.path.join(staging, str(len(staged)))
+                    _copy_member(archive, member, path, manifest["files"][member.name])
+        except tarfile.TarError as e:
+            raise BundleError(f"Invalid bundle: {e}")
+
+        missing = set(manifest["files"]) - set(stored) - set(staged)
+        if missing:
+            raise BundleError(f"The bundle is missing {', '.join(sorted(missing))}")
+
+        store = get_artifact_store()
+        imported = []
+        for document in manifest["documents"]:
+            members = document["members"]
+            chunks = _read_chunks(staged[members["chunks"]])
+            index_id = str(uuid.uuid4())
+            index_ids.append(index_id)
+            with open(staged[members["index"]], "rb") as index, open(staged[members["vectorizer"]], "rb") as vectorizer:
+                store.write(index_id, {
+                    "index": index,
+                    "vectorizer": vectorizer,
+                    "chunks": pickle.dumps(chunks) if isinstance(chunks, list) else encode_chunks(chunks),
+                })
+            if settings.RETRIEVAL_BACKEND == "fts5" and isinstance(chunks, dict):
+                fts.add_chunks(index_id, chunks)
+            imported.append({
+                "filename": document["filename"],
+                "file_path": stored[members["source"]],
+                "document_id": index_id,
+            })
+        return imported
+    except BaseException:
+        for index_id in index_ids:
+            delete_index_artifacts(index_id)
+        for path in stored.values():
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
@@ -0,0 +1,244 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import settings
+from documents.artifacts import get_artifact_store
+
+_local = threading.local()
+
+# Recently read chunk texts of all indexes of this worker, least recently used first
+_text_cache = OrderedDict()
+_text_cache_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Return this thread's connection to the chunk store shared by all workers on the node.
+    """
+    db = getattr(_local, "db", None)
+    if db is None:
+        db = sqlite3.connect(os.path.join(settings.FAISS_INDEX_DIR, "chunk_store.db"), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, text TEXT NOT NULL, referenced_at REAL NOT NULL)"
+        )
+        _local.db = db
+    return db
+
+
+def put_chunks(chunks: dict):
+    """
+    Store chunk texts under their chunk ids, each text only once.
+
+    Chunk ids are hashes of the chunk text, so a chunk that is already stored is only marked as
+    referenced now, which keeps garbage collection from removing it before the new index is saved.
+    """
+    now = time.time()
+    db = _connect()
+    with db:
+        db.executemany(
+            "INSERT INTO chunks (id, text, referenced_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET referenced_at = excluded.referenced_at",
+            [(chunk_id, text, now) for chunk_id, text in chunks.items()],
+        )
+
+
+def get_texts(chunk_ids) -> dict:
+    """
+    Return the texts of chunk ids, reading the ones missing from the in-process text cache from the store.
+
+    The cache holds up to `settings.CHUNK_CACHE_SIZE` texts, each once however many indexes reference it.
+
+    Raises:
+        KeyError: If a chunk id is not in the store.
+    """
+    texts = {}
+    missing = []
+    with _text_cache_lock:
+        for chunk_id in chunk_ids:
+            text = _text_cache.get(chunk_id)
+            if text is None:
+                missing.append(chunk_id)
+            else:
+                _text_cache.move_to_end(chunk_id)
+                texts[chunk_id] = text
+
+    db = _connect()
+    loaded = {}
+    # Stay below SQLite's limit on the number of query parameters
+    for start in range(0, len(missing), 500):
+        batch = missing[start:start + 500]
+        loaded.update(db.execute(
+            f"SELECT id, text FROM chunks WHERE id IN ({', '.join('?' * len(batch))})", batch
+        ).fetchall())
+    for chunk_id in missing:
+        if chunk_id not in loaded:
+            raise KeyError(chunk_id)
+
+    with _text_cache_lock:
+        for chunk_id, text in loaded.items():
+            _text_cache[chunk_id] = text
+        while len(_text_cache) > settings.CHUNK_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+    texts.update(loaded)
+    return texts
+
+
+class ChunkRefs:
+    """
+    The chunks of an index as references into the chunk store, in document order.
+
+    It supports the subset of the dict interface used on loaded chunks; texts are read from the chunk
+    store when they are accessed.
+    """
+
+    def __init__(self, ids: np.ndarray):
+        self.ids = ids
+        self._order = np.argsort(ids)
+        self._sorted_ids = ids[self._order]
+
+    def offset(self, chunk_id: int) -> int:
+        """
+        Return the position of a chunk in the document, raising KeyError for unknown ids.
+        """
+        position = int(np.searchsorted(self._sorted_ids, chunk_id))
+        if position >= len(self._sorted_ids) or self._sorted_ids[position] != chunk_id:
+            raise KeyError(chunk_id)
+        return int(self._order[position])
+
+    def __getitem__(self, chunk_id: int) -> str:
+        if chunk_id not in self:
+            raise KeyError(chunk_id)
+        return get_texts([int(chunk_id)])[int(chunk_id)]
+
+    def __contains__(self, chunk_id: int) -> bool:
+        try:
+            self.offset(chunk_id)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def keys(self):
+        return self.ids.tolist()
+
+    def values(self):
+        return [text for _, text in self.items()]
+
+    def items(self):
+        ids = self.ids.tolist()
+        texts = get_texts(ids)
+        return [(chunk_id, texts[chunk_id]) for chunk_id in ids]
+
+
+def encode_chunks(chunks: dict) -> bytes:
+    """
+    Serialize the chunks artifact of an index.
+
+    With `settings.CHUNK_STORE` enabled, the texts are put into the chunk store and the artifact only
+    holds the chunk ids; otherwise it holds the chunks themselves.
+    """
+    if settings.CHUNK_STORE:
+        put_chunks(chunks)
+        return pickle.dumps(np.array(list(chunks), dtype=np.int64))
+    return pickle.dumps(chunks)
+
+
+def decode_chunks(data: bytes):
+    """
+    Deserialize the chunks artifact of an index.
+
+    Returns:
+        ChunkRefs for indexes that reference the chunk store, otherwise the stored dict of chunks (or
+        list, for indexes without chunk ids).
+    """
+    chunks = pickle.loads(data)
+    if isinstance(chunks, np.ndarray):
+        return ChunkRefs(chunks)
+    return chunks
+
+
+def read_chunk_ids(document_id: str):
+    """
+    Return the chunk ids an index references in the chunk store, or None if it stores its chunks itself.
+
+    Raises:
+        FileNotFoundError: If the index has no chunks artifact.
+    """
+    chunks = decode_chunks(get_artifact_store().read(document_id, "chunks"))
+    return chunks.ids if isinstance(chunks, ChunkRefs) else None
+
+
+def collect_garbage(referenced_chunk_ids: np.ndarray, min_age: float) -> int:
+    """
+    Remove the chunks no index references that were last referenced more than `min_age` seconds ago.
+
+    Returns:
+        int: The number of removed chunks.
+    """
+    db = _connect()
+    with db:
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS referenced (id INTEGER PRIMARY KEY)")
+        db.execute("DELETE FROM referenced")
+        db.executemany("INSERT OR IGNORE INTO referenced VALUES (?)", ((int(i),) for i in referenced_chunk_ids))
+        removed = db.execute(
+            "DELETE FROM chunks WHERE referenced_at <= ? AND id NOT IN (SELECT id FROM referenced)",
+            (time.time() - min_age,),
+        ).rowcount
+        db.execute("DELETE FROM referenced")
+    return removed
+
+
+def dedup_stats(index_ids_by_tenant: dict) -> dict:
+    """
+    Report how much the chunk store deduplicates, per tenant and over all tenants.
+
+    The dedup ratio is the share of chunk references that did not need their own copy of the text:
+    1 - unique chunks / chunk references.
+
+    Args:
+        index_ids_by_tenant (dict): The index IDs of each tenant's documents, keyed by tenant. Indexes that
+                                    do not reference the chunk store, or no longer exist, are skipped.
+
+    Returns:
+        dict: Chunk references, unique chunks and dedup ratio per tenant and in total.
+    """
+    def summarize(ids: list) -> dict:
+        references = sum(len(chunk_ids) for chunk_ids in ids)
+        unique = len(np.unique(np.concatenate(ids))) if ids else 0
+        return {
+            "chunk_references": references,
+            "unique_chunks": unique,
+            "dedup_ratio": 1 - unique / references if references else 0.0,
+        }
+
+    def referenced(index_ids) -> list:
+        ids = []
+        for document_id in index_ids:
+            try:
+                chunk_ids = read_chunk_ids(document_id)
+            except FileNotFoundError:
+                continue
+            if chunk_ids is not None:
+                ids.append(chunk_ids)
+        return ids
+
+    tenants = {}
+    all_ids = []
+    for tenant, index_ids in index_ids_by_tenant.items():
+        ids = referenced(index_ids)
+        tenants[tenant] = summarize(ids)
+        all_ids.extend(ids)
+    return {"tenants": tenants, "total": summarize(all_ids)}
@@ -0,0 +1,62 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one in-flight computation.
+
+    The first caller for a key starts the computation as a task; callers that arrive while it is running
+    await the same task instead of starting their own. All of them receive its result or its exception.
+    Nothing is cached: once the task finishes, the next call for the key starts a new computation.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def _finished(self, key, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Retrieve the exception so it is not reported as unhandled when every caller was cancelled
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1
+
+    async def do(self, key, func, *args):
+        """
+        Run `await func(*args)` for a key, or join the computation already running for it.
+
+        A caller that is cancelled stops waiting without cancelling the computation for the others.
+
+        Args:
+            key: Hashable identifier of the computation.
+            func: Coroutine function that performs the computation.
+            *args: Arguments passed to `func`.
+
+        Returns:
+            The result of the computation.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished: self._finished(key, finished))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "in_flight": len(self._in_flight),
+        }
+
+
+# Loads of the same index and identical questions about the same document
+index_loads = SingleFlight("index_loads")
+answers = SingleFlight("answers")
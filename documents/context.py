@@ -0,0 +1,135 @@
+import math
+import re
+from typing import List, Tuple
+
+from config import settings
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens in a piece of text without calling a remote tokenizer.
+
+    Every punctuation mark counts as one token and every word counts as one token per four
+    characters, which is close to what BPE tokenizers produce for English prose.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def _normalize(chunk: str) -> frozenset:
+    """
+    Reduce a chunk to the set of its lower-cased words, used for near-duplicate detection.
+    """
+    return frozenset(_WORD_PATTERN.findall(chunk.lower()))
+
+
+def _is_near_duplicate(words: frozenset, selected: List[frozenset], threshold: float) -> bool:
+    """
+    Check whether a chunk mostly overlaps with a chunk that is already part of the context.
+
+    The overlap is measured relative to the smaller of the two word sets, so a chunk that is
+    contained in (or contains) an already selected chunk is treated as a duplicate as well.
+    """
+    for other in selected:
+        smaller = min(len(words), len(other))
+        if smaller and len(words & other) / smaller >= threshold:
+            return True
+    return False
+
+
+def build_context(scored_chunks: List[Tuple[str, float]], token_budget: int = None) -> Tuple[str, int]:
+    """
+    Pack the best scoring chunks into a prompt context that fits a token budget.
+
+    Chunks are considered in order of decreasing retrieval score. Empty chunks, exact duplicates and
+    chunks that overlap with an already selected chunk are skipped, and every remaining chunk that still
+    fits into the budget is added. The selected chunks keep their score order in the resulting context.
+    Chunks scoring 0 or less share no term with the query and are left out, unless no chunk scores
+    higher; then the top chunks are used as they are, so the prompt never goes without context.
+
+    Args:
+        scored_chunks (List[Tuple[str, float]]): Pairs of chunk text and retrieval score, higher is better.
+        token_budget (int, optional): The maximum number of estimated tokens. Defaults to
+                                      `settings.CONTEXT_TOKEN_BUDGET`.
+
+    Returns:
+        Tuple[str, int]: The context text and the number of estimated tokens it uses.
+    """
+    if token_budget is None:
+        token_budget = settings.CONTEXT_TOKEN_BUDGET
+
+    selected_chunks = []
+    selected_words = []
+    tokens_used = 0
+
+    ranked = sorted(scored_chunks, key=lambda pair: pair[1], reverse=True)
+    if ranked and ranked[0][1] > 0:
+        ranked = [(chunk, score) for chunk, score in ranked if score > 0]
+
+    for chunk, _ in ranked:
+        words = _normalize(chunk)
+        if not words or _is_near_duplicate(words, selected_words, settings.CONTEXT_DEDUP_THRESHOLD):
+            continue
+
+        # Account for the newline that joins this chunk to the previous one
+        tokens = estimate_tokens(chunk) + (1 if selected_chunks else 0)
+        if tokens_used + tokens > token_budget:
+            continue
+
+        selected_chunks.append(chunk.strip())
+        selected_words.append(words)
+        tokens_used += tokens
+
+    return "\n".join(selected_chunks), tokens_used
+
+
+def highlight_snippet(text: str, query: str, window: int = 16) -> str:
+    """
+    Cut a snippet of a chunk around the first query term it contains, with the query terms marked.
+
+    Query terms are the lower-cased words of the query that are not English stop words (the list the
+    TF-IDF vectorizer uses), or all of its words if only stop words remain. Matches are wrapped in
+    `<b></b>` and cut parts are replaced by "...", like the snippets of the "fts5" backend.
+
+    Args:
+        text (str): The chunk text.
+        query (str): The search query.
+        window (int): The maximum number of words in the snippet.
+
+    Returns:
+        str: The snippet, or the start of the chunk if it contains none of the query terms.
+    """
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    query_words = {word.lower() for word in _WORD_PATTERN.findall(query)}
+    terms = (query_words - ENGLISH_STOP_WORDS) or query_words
+    words = list(_WORD_PATTERN.finditer(text))
+    if not words:
+        return text
+
+    matches = [i for i, word in enumerate(words) if word.group().lower() in terms]
+    first = max(0, min(matches[0] - window // 4, len(words) - window)) if matches else 0
+    last = min(len(words), first + window)
+
+    pieces = ["..."] if first > 0 else []
+    position = words[first].start()
+    for word in words[first:last]:
+        pieces.append(text[position:word.start()])
+        if word.group().lower() in terms:
+            pieces.append(f"<b>{word.group()}</b>")
+        else:
+            pieces.append(word.group())
+        position = word.end()
+    if last < len(words):
+        pieces.append("...")
+    else:
+        pieces.append(text[position:])
+    return "".join(pieces)
@@ -0,0 +1,150 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import settings
+
+_local = threading.local()
+
+_PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Return this thread's connection to the full-text search database, creating the table on first use.
+    """
+    db = getattr(_local, "db", None)
+    if db is None:
+        path = settings.FTS_DATABASE_PATH or os.path.join(settings.FAISS_INDEX_DIR, "chunks_fts.db")
+        db = sqlite3.connect(path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            "text, document_id, chunk_id UNINDEXED, created_at UNINDEXED, tokenize='porter unicode61')"
+        )
+        _local.db = db
+    return db
+
+
+def _document_filter(document_id: str) -> str:
+    # Index IDs are UUIDs, which the tokenizer splits on the dashes; as a phrase they match exactly
+    return f'document_id : "{document_id}"'
+
+
+def to_match_expression(query: str) -> str:
+    """
+    Turn a free-text user query into an FTS5 MATCH expression.
+
+    Double-quoted parts of the query are kept as phrase queries, every other word that is not an English
+    stop word (the list the TF-IDF vectorizer uses) becomes a term of its own. Terms are combined with OR
+    and ranked by BM25, so chunks matching more and rarer terms come first. Everything is quoted, so no user
+    input is interpreted as FTS5 syntax.
+    """
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    phrases = [" ".join(_WORD_PATTERN.findall(phrase)) for phrase in _PHRASE_PATTERN.findall(query)]
+    words = _WORD_PATTERN.findall(_PHRASE_PATTERN.sub(" ", query))
+    content_words = [word for word in words if word.lower() not in ENGLISH_STOP_WORDS]
+    if content_words or phrases:
+        words = content_words
+    terms = [f'"{term}"' for term in phrases + words if term]
+    return " OR ".join(terms)
+
+
+def add_chunks(document_id: str, chunks: dict):
+    """
+    Store the chunks of an index in the full-text search database.
+
+    Args:
+        document_id (str): The unique identifier of the index.
+        chunks (dict): The chunks keyed by chunk id.
+    """
+    created_at = time.time()
+    db = _connect()
+    with db:
+        db.executemany(
+            "INSERT INTO chunks (text, document_id, chunk_id, created_at) VALUES (?, ?, ?, ?)",
+            [(text, document_id, chunk_id, created_at) for chunk_id, text in chunks.items()],
+        )
+
+
+def delete_chunks(document_id: str) -> int:
+    """
+    Remove the chunks of an index from the full-text search database.
+
+    Returns:
+        int: The number of removed chunks.
+    """
+    db = _connect()
+    with db:
+        return db.execute(
+            "DELETE FROM chunks WHERE rowid IN (SELECT rowid FROM chunks WHERE chunks MATCH ?)",
+            (_document_filter(document_id),),
+        ).rowcount
+
+
+def touch_chunks(document_id: str):
+    """
+    Restart the age of the chunks of an index, which `collect_garbage` measures from now on.
+    """
+    db = _connect()
+    with db:
+        db.execute(
+            "UPDATE chunks SET created_at = ? WHERE rowid IN (SELECT rowid FROM chunks WHERE chunks MATCH ?)",
+            (time.time(), _document_filter(document_id)),
+        )
+
+
+def has_chunks(document_id: str) -> bool:
+    return _connect().execute(
+        "SELECT 1 FROM chunks WHERE chunks MATCH ? LIMIT 1", (_document_filter(document_id),)
+    ).fetchone() is not None
+
+
+def collect_garbage(referenced_document_ids: set, min_age: float) -> int:
+    """
+    Remove the chunks of index IDs that are not referenced and older than `min_age` seconds.
+
+    Returns:
+        int: The number of removed chunks.
+    """
+    cutoff = time.time() - min_age
+    rows = _connect().execute("SELECT document_id, MAX(created_at) FROM chunks GROUP BY document_id").fetchall()
+    return sum(
+        delete_chunks(document_id) for document_id, created_at in rows
+        if document_id not in referenced_document_ids and created_at <= cutoff
+    )
+
+
+def search(query: str, document_id: str, k: int) -> list:
+    """
+    Find the chunks of an index that best match a query, ranked by BM25.
+
+    The search is restricted to the index with an FTS5 column filter, so it only visits the postings of
+    that index.
+
+    Args:
+        query (str): The search query entered by the user.
+        document_id (str): The unique identifier of the index to search.
+        k (int): The maximum number of chunks to return.
+
+    Returns:
+        list: Dicts with the chunk id, text, score (negated BM25, higher is better) and a snippet with the
+              matching terms marked, best match first.
+    """
+    expression = to_match_expression(query)
+    if not expression:
+        return []
+
+    rows = _connect().execute(
+        "SELECT chunk_id, text, -bm25(chunks, 1.0, 0.0), snippet(chunks, 0, '<b>', '</b>', '...', 16) "
+        "FROM chunks WHERE chunks MATCH ? ORDER BY bm25(chunks, 1.0, 0.0) LIMIT ?",
+        (f"{_document_filter(document_id)} AND text : ({expression})", k),
+    ).fetchall()
+    return [
+        {"chunk_id": chunk_id, "text": text, "score": score, "snippet": snippet}
+        for chunk_id, text, score, snippet in rows
+    ]
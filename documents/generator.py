@@ -1,35 +1,94 @@
-from openai import OpenAI
+import asyncio
+from functools import lru_cache
+
 from config import settings
+from documents.batching import CompletionBatcher
+from documents.context import build_context
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+COMPLETION_PARAMS = {"model": "gpt-3.5-turbo-instruct", "max_tokens": 150, "temperature": 0.7}
 
 
-def generate_response(relevant_chunks: list, query: str) -> str:
+@lru_cache(maxsize=None)
+def get_client():
+    """
+    Return the OpenAI client, creating it on first use so that importing this module stays fast.
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=settings.OPENAI_API_KEY)
+
+
+def generate_response(relevant_chunks: list, query: str, token_budget: int = None) -> tuple:
     """
     Generate a contextually relevant response to a user query based on the provided document content using GPT-3.
 
-    This function takes a list of relevant document chunks and a user query, constructs a prompt that includes
-    the document content and query, and uses the OpenAI API to generate an answer. The response is based on
-    the context provided by the document chunks.
+    This function takes a list of scored document chunks and a user query, packs the best chunks into a
+    context that fits the token budget, constructs a prompt that includes the context and query, and uses
+    the OpenAI API to generate an answer. The response is based on the context provided by the document chunks.
 
     Args:
-        relevant_chunks (list): A list of text chunks that are most relevant to the user's query, typically
-                                 retrieved from the document's FAISS index.
+        relevant_chunks (list): A list of `(chunk, score)` pairs that are most relevant to the user's query,
+                                 typically retrieved from the document's FAISS index.
         query (str): The user's question or query based on which the response is to be generated.
+        token_budget (int, optional): The maximum number of context tokens. Defaults to
+                                      `settings.CONTEXT_TOKEN_BUDGET`.
+
+    Returns:
+        tuple: The generated response from the AI model and the number of context tokens used for it.
+    """
+    prompt, context_tokens = build_prompt(relevant_chunks, query, token_budget)
+    return complete_prompts([prompt], **COMPLETION_PARAMS)[0], context_tokens
+
+
+def build_prompt(relevant_chunks: list, query: str, token_budget: int = None) -> tuple:
+    """
+    Pack the best chunks into a context that fits the token budget and build the prompt for a query.
 
     Returns:
-        str: The generated response from the AI model, based on the provided context and query.
+        tuple: The prompt and the number of context tokens in it.
     """
-    context = "\n".join(relevant_chunks)
+    context, context_tokens = build_context(relevant_chunks, token_budget)
     prompt = f"Answer the following question based on the document content:\n\n{context}\n\nQuestion: {query}\nAnswer:"
+    return prompt, context_tokens
+
 
-    response = client.completions.create(
-        model="gpt-3.5-turbo-instruct",
-        prompt=prompt,
-        max_tokens=150,
-        n=1,
-        stop=None,
-        temperature=0.7
-    )
+def complete_prompts(prompts: list, **params) -> list:
+    """
+    Complete a list of prompts in a single completions API call.
+
+    Returns:
+        list: The completion text of each prompt, in prompt order.
+    """
+    response = get_client().completions.create(prompt=prompts, n=1, stop=None, **params)
+    # With n=1 the index of a choice is the position of its prompt, but choices may arrive in any order
+    choices = sorted(response.choices, key=lambda choice: choice.index)
+    return [choice.text.strip() for choice in choices]
+
+
+completion_batcher = CompletionBatcher(
+    complete_prompts, settings.GENERATION_BATCH_WINDOW_MS / 1000, settings.GENERATION_BATCH_MAX_SIZE
+)
+
+
+async def generate_response_batched(relevant_chunks: list, query: str, token_budget: int = None) -> tuple:
+    """
+    Generate the answer to a query like `generate_response`, batching the completion call with concurrent
+    queries through `completion_batcher`.
+
+    With `settings.GENERATION_BATCH_WINDOW_MS` set to 0 every query gets its own completion call.
+
+    Returns:
+        tuple: The generated response and the number of context tokens used for it.
+
+    Raises:
+        asyncio.TimeoutError: If no answer arrived within `settings.GENERATION_TIMEOUT_SECONDS`.
+    """
+    if settings.GENERATION_BATCH_WINDOW_MS <= 0:
+        return await asyncio.wait_for(
+            asyncio.to_thread(generate_response, relevant_chunks, query, token_budget),
+            settings.GENERATION_TIMEOUT_SECONDS,
+        )
 
-    return response.choices[0].text.strip()
+    prompt, context_tokens = build_prompt(relevant_chunks, query, token_budget)
+    answer = await completion_batcher.submit(prompt, timeout=settings.GENERATION_TIMEOUT_SECONDS, **COMPLETION_PARAMS)
+    return answer, context_tokens
@@ -1,70 +1,457 @@
+import hashlib
 import os
 import pickle
+import sys
 import uuid
+from collections import Counter
 
-import faiss
 import numpy as np
-from typing import List
-
-from sklearn.feature_extraction.text import TfidfVectorizer
+from typing import TYPE_CHECKING, Callable, Dict, List
 
 from config import settings
+from documents import fts
+from documents.artifacts import get_artifact_store
+from documents.chunk_store import ChunkRefs, encode_chunks
+from documents.retriever import read_faiss_index_and_chunks
+from documents.summary import build_summary, encode_summary
+
+if TYPE_CHECKING:
+    import faiss
 
 
 if not os.path.exists(settings.FAISS_INDEX_DIR):
     os.makedirs(settings.FAISS_INDEX_DIR)
 
 
-def index_document(content: str):
+class IndexTooLargeError(Exception):
+    """
+    Raised when a document cannot be indexed within `settings.INDEX_BUILD_MAX_MEMORY_MB`.
+    """
+
+
+# Bytes an index build holds per byte of the indexed file while its text is extracted and split: the
+# file itself, the extracted text and the chunks
+FILE_MEMORY_FACTOR = 3
+
+
+def max_file_bytes():
+    """
+    Return the size of the largest file that can be indexed under `settings.INDEX_BUILD_MAX_MEMORY_MB`,
+    or None if there is no ceiling.
+    """
+    if settings.INDEX_BUILD_MAX_MEMORY_MB <= 0:
+        return None
+    return settings.INDEX_BUILD_MAX_MEMORY_MB * 1024 ** 2 // FILE_MEMORY_FACTOR
+
+
+# Bytes an index build holds per chunk besides its text: the chunk id and its entries in the chunks dict
+# and the list of texts
+CHUNK_OVERHEAD_BYTES = 100
+
+# Bytes an index build holds per vocabulary term besides its text: the vocabulary entry and the IDF weight
+TERM_OVERHEAD_BYTES = 100
+
+
+def _chunks_bytes(chunks) -> int:
+    """
+    Estimate the memory held by loaded chunks: their texts, or only their ids if they are references into
+    the chunk store, whose texts are not read for this.
+    """
+    if isinstance(chunks, ChunkRefs):
+        # The ids, and the sort order and sorted copy of them used for lookups
+        return 3 * chunks.ids.nbytes
+    texts = chunks.values() if isinstance(chunks, dict) else chunks
+    return sum(sys.getsizeof(text) + CHUNK_OVERHEAD_BYTES for text in texts)
+
+
+def held_memory_bytes(content: str, chunks: Dict[int, str], vectorizer) -> int:
+    """
+    Estimate the memory an index build holds besides the index and the vectors of a batch: the document
+    text, its chunks and the vectorizer. The chunks and the vectorizer are counted twice, since they are
+    serialized once more when the index is saved.
+    """
+    vocabulary = sum(sys.getsizeof(term) + TERM_OVERHEAD_BYTES for term in vectorizer.vocabulary_)
+    return sys.getsizeof(content) + 2 * (_chunks_bytes(chunks) + vocabulary)
+
+
+def chunk_id(chunk: str) -> int:
+    """
+    Compute the stable FAISS id of a chunk from the SHA-1 hash of its text.
+
+    The id is truncated to 63 bits so it fits into the signed 64-bit ids FAISS uses.
+    """
+    return int.from_bytes(hashlib.sha1(chunk.encode("utf-8")).digest()[:8], "big") >> 1
+
+
+def split_into_chunks(content: str) -> Dict[int, str]:
+    """
+    Split document content into chunks based on newlines, keyed by chunk id.
+
+    Whitespace within a line is normalized, so lines that only differ in spacing are the same chunk. Blank
+    lines are dropped and repeated lines are stored only once, since they would produce identical vectors.
+
+    Args:
+        content (str): The text content of the document.
+
+    Returns:
+        Dict[int, str]: The chunks of the document keyed by their chunk id, in document order.
+    """
+    chunks = {}
+    for line in content.split("\n"):
+        chunk = " ".join(line.split())
+        if chunk:
+            chunks.setdefault(chunk_id(chunk), chunk)
+    return chunks
+
+
+def vectorize_chunks(vectorizer, chunks: List[str]) -> np.ndarray:
+    """
+    Transform chunks into the dense float32 vectors stored in the FAISS index.
+    """
+    # Converting the sparse matrix first avoids a float64 dense copy
+    return vectorizer.transform(chunks).astype(np.float32).toarray()
+
+
+def fit_vectorizer(chunks: List[str]):
+    """
+    Fit a TF-IDF vectorizer on the chunks in a single streaming pass.
+
+    Instead of building the full chunks x vocabulary count matrix like `TfidfVectorizer.fit`, only the
+    document frequency of each term is counted. The result is a vectorizer with a fixed vocabulary and
+    the IDF weights `fit` would have computed, so it produces the same vectors.
+
+    Raises:
+        ValueError: If the chunks contain no terms besides stop words.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    analyzer = TfidfVectorizer(stop_words="english").build_analyzer()
+    document_frequency = Counter()
+    for chunk in chunks:
+        document_frequency.update(set(analyzer(chunk)))
+    if not document_frequency:
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+
+    vocabulary = {term: i for i, term in enumerate(sorted(document_frequency))}
+    frequencies = np.array([document_frequency[term] for term in vocabulary], dtype=np.float64)
+
+    vectorizer = TfidfVectorizer(stop_words="english", vocabulary=vocabulary)
+    # Smoothed IDF, as computed by TfidfTransformer with its default smooth_idf=True
+    vectorizer.idf_ = np.log((1 + len(chunks)) / (1 + frequencies)) + 1
+    return vectorizer
+
+
+# k-means, which trains the product quantizer, wants at least 39 training vectors per centroid
+PQ_TRAINING_CHUNKS = 39 * 256
+
+# Fewest training vectors a product quantizer with 256 centroids per subquantizer can be trained on
+PQ_MIN_TRAINING_CHUNKS = 256
+
+
+def pq_training_size(dimension: int, padded: int, held_bytes: int = 0) -> int:
+    """
+    Return how many chunks a product quantizer is trained on while staying under
+    `settings.INDEX_BUILD_MAX_MEMORY_MB`, of which `held_bytes` are already taken by the build.
+
+    The sample is held as dense float32 vectors and copied once more when they are zero-padded to
+    `padded` dimensions, so large vocabularies get fewer than `PQ_TRAINING_CHUNKS` training vectors.
+
+    Raises:
+        IndexTooLargeError: If not even `PQ_MIN_TRAINING_CHUNKS` vectors fit under the ceiling.
+    """
+    if settings.INDEX_BUILD_MAX_MEMORY_MB <= 0:
+        return PQ_TRAINING_CHUNKS
+    available = settings.INDEX_BUILD_MAX_MEMORY_MB * 1024 ** 2 - held_bytes
+    size = min(PQ_TRAINING_CHUNKS, available // ((dimension + padded) * 4))
+    if size < PQ_MIN_TRAINING_CHUNKS:
+        raise IndexTooLargeError(
+            f"Training a product quantizer for {dimension} terms needs more than "
+            f"{settings.INDEX_BUILD_MAX_MEMORY_MB} MB"
+        )
+    return size
+
+
+def target_index_type(total: int) -> str:
+    """
+    Return the index type a document with `total` chunks gets under `settings.INDEX_TYPE`.
+    """
+    if settings.INDEX_TYPE == "pq" and total < settings.PQ_MIN_CHUNKS:
+        return "sq8"
+    return settings.INDEX_TYPE
+
+
+def create_index(dimension: int, total: int, sample: Callable, held_bytes: int = 0) -> "faiss.Index":
+    """
+    Create an empty index of the type selected by `settings.INDEX_TYPE`, trained if the type needs it.
+
+    - "flat" stores full float32 vectors.
+    - "fp16" stores each component as a half-precision float, half the size.
+    - "sq8" stores each component as one byte, a quarter of the size. The components of L2-normalized
+      TF-IDF vectors lie in [0, 1], so the quantizer is trained on that range rather than on the data.
+    - "pq" stores `settings.PQ_SUBQUANTIZERS` bytes per vector with product quantization. Its codebooks
+      add a fixed overhead of about 1 KB per vocabulary term, so documents with fewer than
+      `settings.PQ_MIN_CHUNKS` chunks get an "sq8" index instead. The vectors are zero-padded to a
+      multiple of the number of subquantizers. The training sample is sized to fit under
+      `settings.INDEX_BUILD_MAX_MEMORY_MB` (see `pq_training_size`).
+
+    The vectors are wrapped in an `IndexIDMap2`, so chunks are stored under their chunk ids.
+
+    Args:
+        dimension (int): Size of the vectorizer's vocabulary.
+        total (int): Number of chunks the index is built for.
+        sample (Callable): Returns the vectors of up to the given number of chunks, to train on.
+        held_bytes (int): Memory the build already holds, which the training sample must leave room for.
+
+    Returns:
+        faiss.Index: The empty, trained index.
+    """
+    import faiss
+
+    index_type = target_index_type(total)
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+    if index_type == "fp16":
+        return faiss.IndexIDMap2(faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16))
+    if index_type == "sq8":
+        index = faiss.IndexIDMap2(faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit_uniform))
+        index.train(np.array([np.zeros(dimension), np.ones(dimension)], dtype=np.float32))
+        return index
+    if index_type == "pq":
+        subquantizers = settings.PQ_SUBQUANTIZERS
+        padded = -(-dimension // subquantizers) * subquantizers
+        index = faiss.IndexIDMap2(faiss.IndexPreTransform(
+            faiss.RemapDimensionsTransform(dimension, padded, True), faiss.IndexPQ(padded, subquantizers, 8)
+        ))
+        index.train(sample(pq_training_size(dimension, padded, held_bytes)))
+        return index
+    raise ValueError(f"Unknown index type {settings.INDEX_TYPE!r}")
+
+
+def index_batch_size(total: int, dimension: int, code_size: int, held_bytes: int = 0) -> int:
+    """
+    Return how many chunks can be vectorized at once while staying under `settings.INDEX_BUILD_MAX_MEMORY_MB`.
+
+    The build holds `held_bytes` besides the index, such as the document text, its chunks and the
+    vectorizer (see `held_memory_bytes`). The index holds `code_size` bytes per chunk and is serialized
+    into a second copy when it is saved; the rest of the ceiling is left for the dense vectors of a batch,
+    which are copied into the index. The batch size is capped at `settings.INDEX_BUILD_BATCH_SIZE`.
+
+    Args:
+        total (int): Number of chunks the finished index holds.
+        dimension (int): Size of the vectorizer's vocabulary.
+        code_size (int): Bytes the index stores per chunk.
+        held_bytes (int): Memory the build holds besides the index and the batch vectors.
+
+    Raises:
+        IndexTooLargeError: If the index itself would not fit under the ceiling.
+    """
+    batch_size = settings.INDEX_BUILD_BATCH_SIZE
+    if settings.INDEX_BUILD_MAX_MEMORY_MB > 0:
+        vector_bytes = dimension * 4
+        available = settings.INDEX_BUILD_MAX_MEMORY_MB * 1024 ** 2 - held_bytes - 2 * total * code_size
+        batch_size = min(batch_size, available // (2 * vector_bytes))
+        if batch_size < 1:
+            raise IndexTooLargeError(
+                f"Indexing {total} chunks with {dimension} terms needs more than "
+                f"{settings.INDEX_BUILD_MAX_MEMORY_MB} MB"
+            )
+    return batch_size
+
+
+def index_type(index: "faiss.Index") -> str:
+    """
+    Return the `settings.INDEX_TYPE` an index was built with, "legacy" for indexes without chunk ids.
+    """
+    import faiss
+
+    if not isinstance(index, faiss.IndexIDMap2):
+        return "legacy"
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(inner, faiss.IndexPreTransform):
+        return "pq"
+    return "flat"
+
+
+def convert_index(index: "faiss.Index") -> "faiss.Index":
+    """
+    Copy the vectors of an index into a new index of `settings.INDEX_TYPE`, batch by batch.
+
+    Vectors are decoded from the old index, so converting from a quantized type keeps its quantization
+    error. Indexes without chunk ids keep using positions as ids.
+    """
+    import faiss
+
+    if isinstance(index, faiss.IndexIDMap2):
+        ids, vectors = faiss.vector_to_array(index.id_map).astype(np.int64), index.index
+    else:
+        ids, vectors = np.arange(index.ntotal, dtype=np.int64), index
+
+    total = index.ntotal
+    held_bytes = total * vectors.sa_code_size()
+    converted = create_index(index.d, total, lambda n: vectors.reconstruct_n(0, min(n, total)), held_bytes)
+    batch_size = index_batch_size(total, index.d, converted.sa_code_size(), held_bytes)
+    for start in range(0, total, batch_size):
+        count = min(batch_size, total - start)
+        converted.add_with_ids(vectors.reconstruct_n(start, count), ids[start:start + count])
+    return converted
+
+
+def add_chunks_in_batches(
+    index: "faiss.Index", vectorizer, chunks: Dict[int, str], total: int, progress: Callable = None,
+    held_bytes: int = 0,
+):
+    """
+    Vectorize chunks and add them to an index under their chunk ids, one batch at a time.
+
+    Args:
+        index (faiss.Index): The index the chunks are added to.
+        vectorizer: The fitted TF-IDF vectorizer.
+        chunks (Dict[int, str]): The chunks to add, keyed by chunk id.
+        total (int): Number of chunks the finished index holds, used for the memory ceiling.
+        progress (Callable, optional): Called with the number of added chunks and the number of chunks
+                                       to add after each batch.
+        held_bytes (int): Memory the build holds besides the index, used for the memory ceiling.
+    """
+    batch_size = index_batch_size(total, len(vectorizer.vocabulary_), index.sa_code_size(), held_bytes)
+    ids, texts = list(chunks.keys()), list(chunks.values())
+    for start in range(0, len(texts), batch_size):
+        end = start + batch_size
+        index.add_with_ids(vectorize_chunks(vectorizer, texts[start:end]), np.array(ids[start:end], dtype=np.int64))
+        if progress is not None:
+            progress(min(end, len(texts)), len(texts))
+
+
+def index_document(content: str, progress: Callable = None):
     """
     Index a document by breaking it into chunks and creating a FAISS index for fast similarity search.
 
-    The document content is split into chunks based on newlines. Each chunk is then transformed into
-    a vector representation using the TF-IDF vectorizer. These vectors are added to a FAISS index
-    to enable efficient similarity search. The FAISS index and document chunks are then saved, and a
-    unique document ID is returned.
+    The document content is split into chunks based on newlines. The TF-IDF vectorizer is fitted in a
+    streaming pass over the chunks, then the chunks are vectorized and added to a FAISS index of
+    `settings.INDEX_TYPE` under their chunk ids in batches, so peak memory, including the text, chunks
+    and vectorizer held meanwhile, stays under `settings.INDEX_BUILD_MAX_MEMORY_MB`. The FAISS index and
+    document chunks are then saved, and a unique document ID is returned.
 
     Args:
         content (str): The text content of the document to be indexed. This content is split into
                        chunks based on newline characters.
+        progress (Callable, optional): Called with the number of indexed chunks and the total number of
+                                       chunks after each batch.
 
     Returns:
         str: A unique identifier for the indexed document, which can be used to load and query the
              indexed data later.
-    """
-    chunks = content.split("\n")
 
-    vectorizer = TfidfVectorizer(stop_words="english")
-    embeddings = vectorizer.fit_transform(chunks).toarray()
+    Raises:
+        IndexTooLargeError: If the document cannot be indexed within the memory ceiling.
+    """
+    chunks = split_into_chunks(content)
+    texts = list(chunks.values())
+    vectorizer = fit_vectorizer(texts)
+    held_bytes = held_memory_bytes(content, chunks, vectorizer)
 
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(np.array(embeddings, dtype=np.float32))
+    index = create_index(
+        len(vectorizer.vocabulary_), len(chunks), lambda n: vectorize_chunks(vectorizer, texts[:n]), held_bytes
+    )
+    add_chunks_in_batches(index, vectorizer, chunks, len(chunks), progress, held_bytes)
 
     document_id = save_faiss_index(index, chunks, vectorizer)
     return document_id
 
 
-def save_faiss_index(index: faiss.Index, chunks: List[str], vectorizer) -> str:
+def update_document_index(document_id: str, content: str) -> dict:
     """
-    Save the FAISS index to a file on disk.
+    Re-index a replaced document, re-vectorizing only the chunks that changed.
+
+    The stored chunks are diffed against the new content by chunk id. Chunks that disappeared are
+    removed from the index and new chunks are vectorized with the document's existing vectorizer and
+    added under their ids. The result is saved under a new document ID, so the artifacts of the old
+    ID stay intact until the caller has switched over to the new one.
+
+    Because the vectorizer is reused, terms that only occur in new chunks are not part of its
+    vocabulary. When more than `settings.REINDEX_FULL_REBUILD_RATIO` of the chunks changed, or the
+    stored index predates chunk ids, the document is indexed from scratch instead.
 
     Args:
-        index (faiss.Index): The FAISS index object to save.
-        chunks (List[str]): The document chunks that the index corresponds to.
+        document_id (str): The unique identifier of the currently indexed version of the document.
+        content (str): The new text content of the document.
 
     Returns:
-        document_id (str): A unique identifier for the saved document/index.
+        dict: The new document ID and the number of added, removed and unchanged chunks.
     """
-    document_id = str(uuid.uuid4())
-    if not os.path.exists(settings.FAISS_INDEX_DIR):
-        os.makedirs(settings.FAISS_INDEX_DIR)
+    import faiss
+
+    index, old_chunks, vectorizer = read_faiss_index_and_chunks(document_id)
+    new_chunks = split_into_chunks(content)
+
+    if not isinstance(old_chunks, list) and isinstance(index, faiss.IndexIDMap2):
+        added = [i for i in new_chunks if i not in old_chunks]
+        removed = [i for i in old_chunks if i not in new_chunks]
+        changed_ratio = (len(added) + len(removed)) / max(len(new_chunks), 1)
+    else:
+        added, removed, changed_ratio = list(new_chunks), list(old_chunks), 1.0
+
+    if changed_ratio > settings.REINDEX_FULL_REBUILD_RATIO:
+        return {
+            "document_id": index_document(content),
+            "added": len(new_chunks),
+            "removed": len(old_chunks),
+            "unchanged": 0,
+        }
 
-    faiss.write_index(index, os.path.join(settings.FAISS_INDEX_DIR, f"{document_id}.index"))
+    if removed:
+        index.remove_ids(np.array(removed, dtype=np.int64))
+    if added:
+        # The old chunks are held until the new ones are saved
+        held_bytes = held_memory_bytes(content, new_chunks, vectorizer) + _chunks_bytes(old_chunks)
+        add_chunks_in_batches(
+            index, vectorizer, {i: new_chunks[i] for i in added}, len(new_chunks), held_bytes=held_bytes
+        )
 
-    with open(os.path.join(settings.FAISS_INDEX_DIR, f"{document_id}_chunks.pkl"), "wb") as f:
-        pickle.dump(chunks, f)
+    return {
+        "document_id": save_faiss_index(index, new_chunks, vectorizer),
+        "added": len(added),
+        "removed": len(removed),
+        "unchanged": len(new_chunks) - len(added),
+    }
 
-    with open(os.path.join(settings.FAISS_INDEX_DIR, f"{document_id}_vectorizer.pkl"), "wb") as f:
-        pickle.dump(vectorizer, f)
+
+def save_faiss_index(index: "faiss.Index", chunks: Dict[int, str], vectorizer) -> str:
+    """
+    Save the FAISS index, chunks and vectorizer to the artifact store.
+
+    With `settings.CHUNK_STORE` enabled, the chunk texts go to the node-wide chunk store and the chunks
+    artifact only references them by chunk id (see `documents.chunk_store`).
+
+    With `settings.DOCUMENT_SUMMARIES` enabled, the extractive summary and outline of the document are
+    computed and stored along with the index (see `documents.summary`).
+
+    With `settings.RETRIEVAL_BACKEND` set to "fts5", the chunks are also added to the full-text search
+    database. The FAISS artifacts are still written, since incremental re-indexing and the semantic cache
+    build on them.
+
+    Args:
+        index (faiss.Index): The FAISS index object to save.
+        chunks (Dict[int, str]): The document chunks that the index corresponds to, keyed by chunk id.
+
+    Returns:
+        document_id (str): A unique identifier for the saved document/index.
+    """
+    import faiss
+
+    document_id = str(uuid.uuid4())
+    artifacts = {
+        # The serialized index is passed on as a buffer rather than copied once more into bytes
+        "index": faiss.serialize_index(index),
+        "chunks": encode_chunks(chunks),
+        "vectorizer": pickle.dumps(vectorizer),
+    }
+    if settings.DOCUMENT_SUMMARIES:
+        artifacts["summary"] = encode_summary(build_summary(chunks, vectorizer))
+    get_artifact_store().write(document_id, artifacts)
+    if settings.RETRIEVAL_BACKEND == "fts5":
+        fts.add_chunks(document_id, chunks)
 
     return document_id
+
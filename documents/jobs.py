@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from config import settings
+
+JOBS_DIR = os.path.join(settings.FAISS_INDEX_DIR, "jobs")
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def valid_job_id(job_id: str) -> bool:
+    try:
+        return str(uuid.UUID(job_id)) == job_id
+    except ValueError:
+        return False
+
+
+def write_job(job_id: str, job: dict):
+    """
+    Record the status of an upload job, shared by all workers on the node.
+
+    The status is written under a temporary name that is renamed into place, so readers never see a
+    half-written file.
+    """
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = _job_path(job_id)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({**job, "job_id": job_id, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def read_job(job_id: str) -> dict:
+    """
+    Read the status of an upload job.
+
+    Raises:
+        FileNotFoundError: If there is no job with this ID.
+    """
+    with open(_job_path(job_id)) as f:
+        return json.load(f)
+
+
+class UploadJob:
+    """
+    Reports the progress of indexing an upload to its job status, if the client passed a job ID.
+
+    Calling the job with the number of indexed and total chunks records the progress, so it can be used
+    as the `progress` callback of `index_document`.
+    """
+
+    def __init__(self, job_id: str, user_id: int, filename: str):
+        self.job_id = job_id
+        self.job = {"user_id": user_id, "filename": filename, "status": "indexing",
+                    "chunks_indexed": 0, "chunks_total": None}
+        self._write()
+
+    def _write(self):
+        if self.job_id is not None:
+            write_job(self.job_id, self.job)
+
+    def __call__(self, chunks_indexed: int, chunks_total: int):
+        self.job.update(chunks_indexed=chunks_indexed, chunks_total=chunks_total)
+        self._write()
+
+    def finish(self, **fields):
+        self.job.update(status="completed", **fields)
+        self._write()
+
+    def fail(self, error: str):
+        self.job.update(status="failed", error=error)
+        self._write()
+
+
+def remove_stale_jobs(min_age: float) -> int:
+    """
+    Remove job statuses that were last updated more than `min_age` seconds ago.
+
+    Returns:
+        int: The number of removed job statuses.
+    """
+    cutoff = time.time() - min_age
+    removed = 0
+    try:
+        entries = list(os.scandir(JOBS_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime <= cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
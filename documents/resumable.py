@@ -0,0 +1,262 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from config import settings
+from documents.indexer import max_file_bytes
+from documents.utils import CONTENT_TYPES_BY_EXTENSION
+
+UPLOADS_DIR = os.path.join(settings.FAISS_INDEX_DIR, "uploads")
+
+# Size of the blocks the assembled file is hashed in
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadSessionError(Exception):
+    """
+    Raised when a resumable upload request does not fit the state of its session.
+    """
+
+
+def _session_path(upload_id: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{upload_id}.json")
+
+
+def staging_path(upload_id: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{upload_id}.part")
+
+
+def _write_session(session: dict):
+    # Written under a temporary name and renamed into place, so readers never see a half-written file
+    path = _session_path(session["upload_id"])
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({**session, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def read_session(upload_id: str) -> dict:
+    """
+    Read the state of a resumable upload.
+
+    Raises:
+        FileNotFoundError: If there is no upload with this ID.
+    """
+    try:
+        if str(uuid.UUID(upload_id)) != upload_id:
+            raise FileNotFoundError(upload_id)
+    except ValueError:
+        raise FileNotFoundError(upload_id)
+    with open(_session_path(upload_id)) as f:
+        return json.load(f)
+
+
+def create_session(user_id: int, filename: str, size: int, sha256: str) -> dict:
+    """
+    Start a resumable upload and allocate its staging file.
+
+    Args:
+        user_id (int): ID of the uploading user.
+        filename (str): Name of the uploaded file; its extension decides the content type.
+        size (int): Size of the file in bytes.
+        sha256 (str): Hex SHA-256 digest of the file, verified when the upload is completed.
+
+    Returns:
+        dict: The state of the new upload.
+
+    Raises:
+        UploadSessionError: If the file type is not supported or the size is out of range, which is capped
+                            by what can be indexed under `settings.INDEX_BUILD_MAX_MEMORY_MB`.
+    """
+    content_type = CONTENT_TYPES_BY_EXTENSION.get(os.path.splitext(filename)[1].lower())
+    if content_type is None:
+        raise UploadSessionError("Unsupported file type")
+    # Files that could not be indexed once assembled are rejected before any part is sent
+    limit = min(settings.RESUMABLE_UPLOAD_MAX_BYTES, max_file_bytes() or settings.RESUMABLE_UPLOAD_MAX_BYTES)
+    if not 0 < size <= limit:
+        raise UploadSessionError(f"The file size must be between 1 and {limit} bytes")
+
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    session = {
+        "upload_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "sha256": sha256.lower(),
+        "received": [],
+    }
+    with open(staging_path(session["upload_id"]), "wb") as f:
+        f.truncate(size)
+    _write_session(session)
+    return session
+
+
+def _add_range(ranges: list, start: int, end: int) -> list:
+    """
+    Merge the byte range [start, end) into a sorted list of disjoint ranges.
+    """
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def received_bytes(session: dict) -> int:
+    return sum(end - start for start, end in session["received"])
+
+
+def write_part(upload_id: str, start: int, data: bytes) -> dict:
+    """
+    Write bytes of a resumable upload into the staging file at their offset and record them as received.
+
+    Parts may be sent concurrently, to any worker on the node, and in any order; their blocks are written
+    one at a time under a lock on the staging file, so no block is written once the upload is being
+    completed. Since every written block is recorded, a part whose transfer broke off only needs its
+    missing bytes sent again.
+
+    Args:
+        upload_id (str): The ID of the upload.
+        start (int): Offset of the first byte.
+        data (bytes): The bytes to write.
+
+    Returns:
+        dict: The state of the upload after the bytes were recorded.
+
+    Raises:
+        UploadSessionError: If the bytes do not fit into the file or the upload is being completed.
+        FileNotFoundError: If there is no upload with this ID.
+    """
+    session = read_session(upload_id)
+    if start < 0 or start + len(data) > session["size"]:
+        raise UploadSessionError("The part extends past the end of the file")
+
+    fd = os.open(staging_path(upload_id), os.O_WRONLY)
+    try:
+        # Serialize the writes and the updates of the received ranges with concurrent parts and with
+        # `complete_upload`, which hashes and moves the staging file once it marked the upload as completing
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        session = read_session(upload_id)
+        if session.get("status") == "completing":
+            raise UploadSessionError("The upload is already being completed")
+        if data:
+            os.pwrite(fd, data, start)
+            session["received"] = _add_range(session["received"], start, start + len(data))
+            _write_session(session)
+        return session
+    finally:
+        os.close(fd)
+
+
+def upload_status(session: dict) -> dict:
+    """
+    Describe the progress of an upload, including the byte ranges that are still missing.
+    """
+    missing = []
+    position = 0
+    for start, end in session["received"] + [[session["size"], session["size"]]]:
+        if start > position:
+            missing.append([position, start])
+        position = end
+    return {
+        "upload_id": session["upload_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "received_bytes": received_bytes(session),
+        "received": session["received"],
+        "missing": missing,
+        "status": session.get("status", "uploading"),
+    }
+
+
+def complete_upload(upload_id: str, file_path: str) -> dict:
+    """
+    Verify that every byte of an upload was received and that it has the announced hash, then move the
+    assembled file to `file_path`.
+
+    The upload is marked as completing first, so of concurrent completions only one proceeds. An upload
+    whose hash does not match is removed, since there is no telling which part was corrupted.
+
+    Returns:
+        dict: The state of the upload.
+
+    Raises:
+        UploadSessionError: If parts are missing, the upload is already being completed or the hash does
+                            not match.
+        FileNotFoundError: If there is no upload with this ID.
+    """
+    read_session(upload_id)
+    fd = os.open(staging_path(upload_id), os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        session = read_session(upload_id)
+        if session.get("status") == "completing":
+            raise UploadSessionError("The upload is already being completed")
+        if session["received"] != [[0, session["size"]]]:
+            raise UploadSessionError(f"Only {received_bytes(session)} of {session['size']} bytes were received")
+        session["status"] = "completing"
+        _write_session(session)
+    finally:
+        os.close(fd)
+
+    digest = hashlib.sha256()
+    with open(staging_path(session["upload_id"]), "rb") as f:
+        for block in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
+            digest.update(block)
+    if digest.hexdigest() != session["sha256"]:
+        delete_session(upload_id)
+        raise UploadSessionError("The SHA-256 digest of the received file does not match")
+
+    shutil.move(staging_path(upload_id), file_path)
+    delete_session(upload_id)
+    return session
+
+
+def delete_session(upload_id: str):
+    """
+    Remove the state and the staging file of an upload.
+    """
+    for path in (_session_path(upload_id), staging_path(upload_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_uploads(max_age: float) -> int:
+    """
+    Remove uploads that received no part for more than `max_age` seconds.
+
+    Returns:
+        int: The number of removed uploads.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(UPLOADS_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not entry.name.endswith(".part"):
+            continue
+        upload_id = entry.name[:-len(".part")]
+        try:
+            updated = os.stat(_session_path(upload_id)).st_mtime
+        except FileNotFoundError:
+            # Orphaned by a crash while the upload was created or completed
+            try:
+                updated = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+        if updated <= cutoff:
+            delete_session(upload_id)
+            removed += 1
+    return removed
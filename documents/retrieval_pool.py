@@ -0,0 +1,152 @@
+import bisect
+import hashlib
+import json
+import os
+import socket
+import threading
+from functools import lru_cache
+
+from config import settings
+
+# Points per worker on the hash ring; more points spread the documents more evenly
+VIRTUAL_NODES = 64
+
+_local = threading.local()
+
+
+class RetrievalWorkerUnavailable(Exception):
+    """
+    Raised when a retrieval worker cannot be reached or does not answer in time.
+    """
+
+
+class RetrievalWorkerError(Exception):
+    """
+    Raised when a retrieval worker failed to handle a request.
+    """
+
+
+def socket_dir() -> str:
+    return settings.RETRIEVAL_SOCKET_DIR or os.path.join(settings.FAISS_INDEX_DIR, "retrieval")
+
+
+def socket_path(worker: int) -> str:
+    return os.path.join(socket_dir(), f"worker-{worker}.sock")
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of index IDs onto retrieval workers.
+
+    Every worker owns `VIRTUAL_NODES` points on a ring of 64-bit hashes, and an index ID belongs to the
+    worker owning the first point at or after the hash of the ID. Changing the number of workers only
+    moves the index IDs of the added or removed worker's points, so the other workers keep their caches.
+    """
+
+    def __init__(self, workers: int, virtual_nodes: int = VIRTUAL_NODES):
+        points = sorted(
+            (_hash(f"{worker}:{node}"), worker) for worker in range(workers) for node in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def worker_for(self, document_id: str) -> int:
+        position = bisect.bisect_left(self._hashes, _hash(document_id)) % len(self._hashes)
+        return self._workers[position]
+
+
+@lru_cache(maxsize=None)
+def get_hash_ring() -> HashRing:
+    return HashRing(settings.RETRIEVAL_WORKERS)
+
+
+def _connection(worker: int):
+    """
+    Return this thread's connection to a retrieval worker, connecting on first use.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    connection = connections.get(worker)
+    if connection is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(settings.RETRIEVAL_WORKER_TIMEOUT_SECONDS)
+        try:
+            sock.connect(socket_path(worker))
+        except OSError:
+            sock.close()
+            raise
+        connection = connections[worker] = (sock, sock.makefile("rb"))
+    return connection
+
+
+def _disconnect(worker: int):
+    sock, reader = _local.connections.pop(worker)
+    reader.close()
+    sock.close()
+
+
+def call_worker(worker: int, request: dict) -> dict:
+    """
+    Send a request to a retrieval worker and return its response.
+
+    Requests and responses are single lines of JSON on a Unix socket. A broken connection, e.g. after
+    the worker was restarted, is re-established once.
+
+    Raises:
+        RetrievalWorkerUnavailable: If the worker cannot be reached or does not answer within
+                                    `settings.RETRIEVAL_WORKER_TIMEOUT_SECONDS`.
+        RetrievalWorkerError: If the worker failed to handle the request.
+        FileNotFoundError: If the requested index does not exist.
+    """
+    message = (json.dumps(request) + "\n").encode("utf-8")
+    for attempt in range(2):
+        try:
+            sock, reader = _connection(worker)
+        except OSError as e:
+            raise RetrievalWorkerUnavailable(f"Retrieval worker {worker} is not running: {e}") from e
+        try:
+            sock.sendall(message)
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("Connection closed by the worker")
+        except OSError as e:
+            _disconnect(worker)
+            if attempt or isinstance(e, socket.timeout):
+                raise RetrievalWorkerUnavailable(f"Retrieval worker {worker} did not answer: {e}") from e
+            continue
+        break
+
+    response = json.loads(line)
+    if "error" in response:
+        if response.get("type") == "FileNotFoundError":
+            raise FileNotFoundError(response["error"])
+        raise RetrievalWorkerError(response["error"])
+    return response
+
+
+def call_owner(document_id: str, request: dict) -> dict:
+    """
+    Send a request about an index ID to the retrieval worker that owns it.
+    """
+    return call_worker(get_hash_ring().worker_for(document_id), {**request, "document_id": document_id})
+
+
+def worker_stats() -> list:
+    """
+    Collect the load metrics of every retrieval worker on the node.
+
+    Returns:
+        list: The metrics of each worker, or the error for workers that cannot be reached.
+    """
+    stats = []
+    for worker in range(settings.RETRIEVAL_WORKERS):
+        try:
+            stats.append({"worker": worker, **call_worker(worker, {"op": "stats"})})
+        except (RetrievalWorkerUnavailable, RetrievalWorkerError) as e:
+            stats.append({"worker": worker, "error": str(e)})
+    return stats
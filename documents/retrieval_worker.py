@@ -0,0 +1,147 @@
+"""
+Retrieval worker processes that own the document indexes of a node.
+
+Each worker serves searches over a Unix socket for the index IDs the consistent hash ring of
+`documents.retrieval_pool` assigns to it, so every index is loaded by one process per node and the
+searches of different indexes run on different cores. The web workers send their searches to the owning
+worker when RETRIEVAL_WORKERS is set.
+
+Run it next to the web server, with the same settings:
+    python -m documents.retrieval_worker
+
+Workers that exit are restarted.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import socketserver
+import threading
+import time
+
+from config import settings
+from documents.retrieval_pool import get_hash_ring, socket_dir, socket_path
+from documents.retriever import cache_stats, load_faiss_index_and_chunks, search_chunks_locally
+from documents.tiers import refresh_worker_tiers
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalWorker:
+    """
+    Handles the requests of one retrieval worker process and keeps its load metrics.
+    """
+
+    def __init__(self, worker: int):
+        self.worker = worker
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "busy_seconds": 0.0, "in_flight": 0}
+
+    def handle(self, request: dict) -> dict:
+        if request["op"] == "stats":
+            return self.stats()
+
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters["in_flight"] += 1
+        started = time.monotonic()
+        try:
+            if request["op"] == "search":
+                return {"hits": search_chunks_locally(
+                    request["query"], request["document_id"], request["k"], request["highlight"]
+                )}
+            if request["op"] == "vectorize":
+                _, _, vectorizer = load_faiss_index_and_chunks(request["document_id"])
+                vector = vectorizer.transform([request["query"]]).tocsr()
+                return {"indices": vector.indices.tolist(), "data": vector.data.tolist(), "dimension": vector.shape[1]}
+            raise ValueError(f"Unknown operation: {request['op']}")
+        except Exception as e:
+            with self.lock:
+                self.counters["errors"] += 1
+            return {"error": str(e), "type": type(e).__name__}
+        finally:
+            with self.lock:
+                self.counters["in_flight"] -= 1
+                self.counters["busy_seconds"] += time.monotonic() - started
+
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self.started
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                **self.counters,
+                # Average number of requests being handled at once since the worker started
+                "load": self.counters["busy_seconds"] / uptime if uptime else 0.0,
+                "uptime_seconds": uptime,
+                "index_cache": cache_stats(),
+            }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            response = self.server.retrieval_worker.handle(json.loads(line))
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _refresh_tiers_loop(worker: int):
+    """
+    Keep this worker's view of the storage tiers current and its hot indexes loaded.
+    """
+    ring = get_hash_ring()
+    while True:
+        try:
+            refresh_worker_tiers(lambda document_id: ring.worker_for(document_id) == worker)
+        except Exception:
+            logger.exception("Refreshing the storage tiers failed")
+        time.sleep(settings.TIER_INTERVAL_SECONDS)
+
+
+def serve(worker: int):
+    """
+    Serve the requests of one retrieval worker on its Unix socket until the process is stopped.
+    """
+    path = socket_path(worker)
+    if os.path.exists(path):
+        os.remove(path)
+
+    server = _Server(path, _RequestHandler)
+    os.chmod(path, 0o600)
+    server.retrieval_worker = RetrievalWorker(worker)
+    if settings.TIERED_STORAGE:
+        threading.Thread(target=_refresh_tiers_loop, args=(worker,), daemon=True).start()
+    server.serve_forever()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if settings.RETRIEVAL_WORKERS <= 0:
+        raise SystemExit("Set RETRIEVAL_WORKERS to the number of retrieval workers to start")
+
+    os.makedirs(socket_dir(), exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    try:
+        while True:
+            for worker in range(settings.RETRIEVAL_WORKERS):
+                process = processes.get(worker)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logger.warning("Retrieval worker %d exited with %s, restarting it", worker, process.exitcode)
+                process = processes[worker] = context.Process(target=serve, args=(worker,), daemon=True)
+                process.start()
+            time.sleep(1)
+    finally:
+        for process in processes.values():
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,40 @@
+import logging
 import os
 import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
 
-import faiss
 import numpy as np
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-
 from config import settings
+from documents import fts
+from documents.artifacts import get_artifact_store
+from documents.chunk_store import ChunkRefs, decode_chunks
+from documents.context import highlight_snippet
+from documents.retrieval_pool import RetrievalWorkerUnavailable, call_owner
+from documents.shared import open_shared_index, write_shared_artifact
+
+logger = logging.getLogger(__name__)
+
+# Loaded indexes of recently queried documents, least recently used first
+_index_cache = OrderedDict()
+
+# Fingerprint of the index artifact each cached index was loaded from
+_index_fingerprints = {}
+_index_cache_lock = threading.Lock()
+
+# Storage tier of each index ID ("hot", "warm" or "cold"), refreshed by the tiering task
+_index_tiers = {}
+
+# Queries per index ID since the tiering task last collected them
+_access_counts = Counter()
+_access_counts_lock = threading.Lock()
+
+# Bumped by any worker that replaces or deletes index artifacts, so the others drop stale cache entries
+GENERATION_FILE = "generation"
+_seen_generation = None
+_generation_checked_at = 0.0
 
 
 def retrieve_relevant_chunks(query: str, document_id: str):
@@ -24,26 +52,342 @@ def retrieve_relevant_chunks(query: str, document_id: str):
     Returns:
         List[str]: A list of the most relevant chunks (text segments) from the document, based on the query.
     """
+    return [chunk for chunk, _ in retrieve_scored_chunks(query, document_id, k=5)]
+
+
+def retrieve_scored_chunks(query: str, document_id: str, k: int):
+    """
+    Retrieve the top-k chunks of a document together with their similarity to the query.
+
+    FAISS ranks the chunks by L2 distance, and the score of each hit is the dot product of the query and
+    chunk vectors, which is their cosine similarity because TF-IDF vectors are L2-normalized.
+
+    With `settings.RETRIEVAL_BACKEND` set to "fts5", the chunks are instead ranked by BM25 in the SQLite
+    full-text search database and the score is the negated BM25 rank, so nothing has to be loaded.
+
+    Args:
+        query (str): The search query entered by the user.
+        document_id (str): The unique identifier of the document whose chunks are to be searched.
+        k (int): The maximum number of chunks to return.
+
+    Returns:
+        List[Tuple[str, float]]: Pairs of chunk text and similarity score, best match first.
+    """
+    _count_access(document_id)
+
+    if settings.RETRIEVAL_BACKEND == "fts5":
+        return [(hit["text"], hit["score"]) for hit in fts.search(query, document_id, k)]
+
+    if _use_retrieval_workers():
+        hits = _call_retrieval_worker(document_id, {"op": "search", "query": query, "k": k, "highlight": False})
+        if hits is not None:
+            return [(hit["text"], hit["score"]) for hit in hits["hits"]]
+
+    chunks, hits = _search_index(query, document_id, k)
+    return [(chunks[chunk_id], score) for chunk_id, score in hits]
+
+
+def _count_access(document_id: str):
+    """
+    Count a query of an index ID towards its popularity for tiered storage.
+    """
+    if settings.TIERED_STORAGE:
+        with _access_counts_lock:
+            _access_counts[document_id] += 1
+
+
+def _use_retrieval_workers() -> bool:
+    return settings.RETRIEVAL_WORKERS > 0 and settings.RETRIEVAL_BACKEND != "fts5"
+
+
+def _call_retrieval_worker(document_id: str, request: dict):
+    """
+    Send a request to the retrieval worker that owns an index ID.
+
+    Returns:
+        dict or None: The response, or None if the worker is unavailable and the request has to be handled
+                      in this process.
+    """
+    try:
+        return call_owner(document_id, request)
+    except RetrievalWorkerUnavailable as e:
+        logger.warning("Handling %s of index %s in the web worker: %s", request["op"], document_id, e)
+        return None
+
+
+def vectorize_query(query: str, document_id: str):
+    """
+    Transform a query into a TF-IDF vector with the vectorizer of a document's index.
+
+    With retrieval workers, the worker that owns the index does the transformation, so the index does
+    not have to be loaded in this process.
+
+    Returns:
+        scipy.sparse.csr_matrix: The 1 x vocabulary query vector.
+    """
+    if _use_retrieval_workers():
+        response = _call_retrieval_worker(document_id, {"op": "vectorize", "query": query})
+        if response is not None:
+            from scipy.sparse import csr_matrix
+
+            return csr_matrix(
+                (response["data"], response["indices"], [0, len(response["indices"])]),
+                shape=(1, response["dimension"]),
+                dtype=np.float64,
+            )
+
+    _, _, vectorizer = load_faiss_index_and_chunks(document_id)
+    return vectorizer.transform([query])
+
+
+def _search_index(query: str, document_id: str, k: int):
+    """
+    Search the FAISS index of a document for the top-k chunks.
+
+    Returns:
+        tuple: The loaded chunks and pairs of chunk id and similarity score, best match first.
+    """
     index, chunks, vectorizer = load_faiss_index_and_chunks(document_id)
+    if index.ntotal == 0:
+        return chunks, []
+
     query_vector = vectorizer.transform([query]).toarray().astype(np.float32)
 
-    _, indices = index.search(query_vector, k=5)
-    relevant_chunks = [chunks[i] for i in indices[0]]
+    _, indices = index.search(query_vector, k=min(k, index.ntotal))
+
+    # FAISS pads the result with -1 when the index holds fewer than k vectors
+    return chunks, [
+        (int(i), float(np.dot(query_vector[0], index.reconstruct(int(i)))))
+        for i in indices[0]
+        if i >= 0
+    ]
+
+
+def search_chunks(query: str, document_id: str, k: int, highlight: bool = False) -> list:
+    """
+    Find the top-k chunks of a document for a query, without generating an answer.
+
+    Scores are the same as those of `retrieve_scored_chunks`. The offset of a chunk is its position among
+    the chunks of the document (blank and repeated lines do not count). With retrieval workers, the worker
+    that owns the index runs the search.
+
+    Args:
+        query (str): The search query.
+        document_id (str): The unique identifier of the document's index.
+        k (int): The maximum number of chunks to return.
+        highlight (bool): Whether to add a snippet of each chunk with the query terms marked.
+
+    Returns:
+        list: Dicts with the chunk id, offset, score and text of each hit (and its snippet), best match first.
+    """
+    _count_access(document_id)
+
+    if _use_retrieval_workers():
+        response = _call_retrieval_worker(
+            document_id, {"op": "search", "query": query, "k": k, "highlight": highlight}
+        )
+        if response is not None:
+            return response["hits"]
+    return search_chunks_locally(query, document_id, k, highlight)
+
+
+def search_chunks_locally(query: str, document_id: str, k: int, highlight: bool = False) -> list:
+    """
+    Run `search_chunks` in this process.
+    """
+    if settings.RETRIEVAL_BACKEND == "fts5":
+        hits = fts.search(query, document_id, k)
+        chunks = None
+    else:
+        chunks, scored = _search_index(query, document_id, k)
+        hits = [{"chunk_id": chunk_id, "text": chunks[chunk_id], "score": score} for chunk_id, score in scored]
+
+    offsets = _chunk_offsets(chunks, document_id, [hit["chunk_id"] for hit in hits])
+    results = []
+    for hit in hits:
+        result = {key: hit[key] for key in ("chunk_id", "text", "score")}
+        result["offset"] = offsets.get(hit["chunk_id"])
+        if highlight:
+            result["snippet"] = hit.get("snippet") or highlight_snippet(hit["text"], query)
+        results.append(result)
+    return results
+
+
+def _chunk_offsets(chunks, document_id: str, chunk_ids: list) -> dict:
+    """
+    Return the position in the document of each chunk id.
+
+    The chunks artifact is read when the loaded chunks do not keep the document order (memory-mapped
+    chunks are sorted by id) or nothing was loaded.
+    """
+    if not isinstance(chunks, (ChunkRefs, dict, list)):
+        chunks = decode_chunks(get_artifact_store().read(document_id, "chunks"))
 
-    return relevant_chunks
+    if isinstance(chunks, ChunkRefs):
+        return {chunk_id: chunks.offset(chunk_id) for chunk_id in chunk_ids if chunk_id in chunks}
+    if isinstance(chunks, list):
+        # Indexes created before chunk ids use the positions as ids
+        return {chunk_id: chunk_id for chunk_id in chunk_ids}
+    wanted = set(chunk_ids)
+    return {chunk_id: offset for offset, chunk_id in enumerate(chunks) if chunk_id in wanted}
 
 
 def load_faiss_index_and_chunks(document_id: str):
     """
-    Load the FAISS index, document chunks, and the trained TF-IDF vectorizer.
+    Load the FAISS index, document chunks, and the trained TF-IDF vectorizer, using the in-process cache.
+
+    Up to `settings.INDEX_CACHE_SIZE` documents are kept loaded; the least recently used one is evicted
+    first. The returned objects are shared between requests and must not be modified.
+
+    With `settings.SHARED_INDEX_STORE` enabled, the vectors and chunk texts are memory-mapped from a
+    shared artifact instead of being loaded into private memory, so all workers on a node share the same
+    physical pages. The first worker that needs the artifact writes it.
+
+    With tiered storage, the tier of the index decides instead: "warm" indexes are memory-mapped, "hot"
+    and "cold" ones are loaded into private memory (cold artifacts are decompressed first). Hot indexes
+    are pinned in the cache and do not count towards `settings.INDEX_CACHE_SIZE`.
+    """
+    _drop_stale_cache_entries()
+
+    with _index_cache_lock:
+        if document_id in _index_cache:
+            _index_cache.move_to_end(document_id)
+            return _index_cache[document_id]
+
+    try:
+        fingerprint = get_artifact_store().fingerprint(document_id, "index")
+    except FileNotFoundError:
+        fingerprint = None
+    tier = _index_tiers.get(document_id)
+    if tier == "warm" or (tier is None and settings.SHARED_INDEX_STORE):
+        loaded = _load_shared_index(document_id)
+    else:
+        loaded = read_faiss_index_and_chunks(document_id)
+
+    with _index_cache_lock:
+        _index_cache[document_id] = loaded
+        _index_fingerprints[document_id] = fingerprint
+        _index_cache.move_to_end(document_id)
+        unpinned = [cached_id for cached_id in _index_cache if _index_tiers.get(cached_id) != "hot"]
+        for cached_id in unpinned[:max(0, len(unpinned) - settings.INDEX_CACHE_SIZE)]:
+            del _index_cache[cached_id]
+            _index_fingerprints.pop(cached_id, None)
+
+    return loaded
+
+
+def _load_shared_index(document_id: str):
+    """
+    Map the shared artifact of an index ID, writing it from the regular artifacts if it does not exist yet.
+    """
+    store = get_artifact_store()
+    try:
+        index, chunks = open_shared_index(document_id)
+    except FileNotFoundError:
+        index, chunks, _ = read_faiss_index_and_chunks(document_id)
+        write_shared_artifact(document_id, index, chunks)
+        index, chunks = open_shared_index(document_id)
+
+    # The shared artifact of an index that references the chunk store holds no chunk texts
+    stored_chunks = decode_chunks(store.read(document_id, "chunks"))
+    if isinstance(stored_chunks, ChunkRefs):
+        chunks = stored_chunks
+    vectorizer = pickle.loads(store.read(document_id, "vectorizer"))
+
+    return index, chunks, vectorizer
+
+
+def take_access_counts() -> Counter:
+    """
+    Return the number of queries per index ID since the last call, and reset the counts.
+    """
+    global _access_counts
+    with _access_counts_lock:
+        counts, _access_counts = _access_counts, Counter()
+    return counts
+
+
+def set_index_tiers(tiers: dict):
+    """
+    Set the storage tier of each index ID, as decided by the tiering task.
+    """
+    global _index_tiers
+    _index_tiers = tiers
+
+
+def cache_stats() -> dict:
+    with _index_cache_lock:
+        return {
+            "cached": len(_index_cache),
+            "pinned": sum(_index_tiers.get(document_id) == "hot" for document_id in _index_cache),
+        }
+
+
+def invalidate_cached_index(document_id: str):
+    """
+    Drop a document from the in-process index cache, e.g. after it was replaced or deleted.
     """
+    with _index_cache_lock:
+        _index_cache.pop(document_id, None)
+        _index_fingerprints.pop(document_id, None)
 
-    with open(os.path.join(settings.FAISS_INDEX_DIR, f"{document_id}_chunks.pkl"), "rb") as f:
-        chunks = pickle.load(f)
 
-    with open(os.path.join(settings.FAISS_INDEX_DIR, f"{document_id}_vectorizer.pkl"), "rb") as f:
-        vectorizer = pickle.load(f)
+def bump_index_generation():
+    """
+    Signal all workers on the node that index artifacts were replaced or deleted.
+    """
+    path = os.path.join(settings.FAISS_INDEX_DIR, GENERATION_FILE)
+    with open(path, "a"):
+        os.utime(path)
+
+
+def _drop_stale_cache_entries():
+    """
+    Drop cached indexes whose artifacts were removed or rewritten in place (e.g. converted to another
+    index type) by another process.
+
+    The generation file is checked at most every `settings.INDEX_GENERATION_CHECK_SECONDS`; only when it
+    changed are the index artifacts of the cached index IDs compared with the ones they were loaded from.
+    """
+    global _seen_generation, _generation_checked_at
+
+    now = time.monotonic()
+    if now - _generation_checked_at < settings.INDEX_GENERATION_CHECK_SECONDS:
+        return
+    _generation_checked_at = now
+
+    try:
+        generation = os.stat(os.path.join(settings.FAISS_INDEX_DIR, GENERATION_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        generation = None
+    if generation == _seen_generation:
+        return
+    _seen_generation = generation
+
+    store = get_artifact_store()
+    with _index_cache_lock:
+        stale = []
+        for document_id in _index_cache:
+            try:
+                fingerprint = store.fingerprint(document_id, "index")
+            except FileNotFoundError:
+                fingerprint = None
+            if fingerprint is None or fingerprint != _index_fingerprints.get(document_id):
+                stale.append(document_id)
+        for document_id in stale:
+            del _index_cache[document_id]
+            _index_fingerprints.pop(document_id, None)
+
+
+def read_faiss_index_and_chunks(document_id: str):
+    """
+    Load the FAISS index, document chunks, and the trained TF-IDF vectorizer from the artifact store.
+    """
+    import faiss
 
-    index = faiss.read_index(f"{settings.FAISS_INDEX_DIR}/{document_id}.index")
+    store = get_artifact_store()
+    chunks = decode_chunks(store.read(document_id, "chunks"))
+    vectorizer = pickle.loads(store.read(document_id, "vectorizer"))
+    index = faiss.deserialize_index(np.frombuffer(store.read(document_id, "index"), dtype=np.uint8))
 
     return index, chunks, vectorizer
@@ -1,58 +1,119 @@
+import asyncio
 import os
+import re
+from typing import List, Optional
 from uuid import uuid4
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from fastapi import APIRouter, UploadFile, File, Depends, Header, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from config import settings
 from database import get_db
+from profiling import list_profiles, profile_path, to_thread
 from users.auth import get_current_user
 from users.models import User
 from documents.models import Document
-from documents.retriever import retrieve_relevant_chunks
-from documents.generator import generate_response
-from documents.schemas import DocumentQuery
-from documents.indexer import index_document
-from documents.permissions import oso
+from documents.retriever import (
+    cache_stats, load_faiss_index_and_chunks, retrieve_scored_chunks, search_chunks, vectorize_query
+)
+from documents.retrieval_pool import worker_stats
+from documents.tiers import tier_stats
+from documents.chunk_store import dedup_stats
+from documents.coalesce import answers, index_loads
+from documents.admission import admission, query_admission, upload_admission
+from documents.semantic_cache import semantic_cache
+from documents.generator import completion_batcher, generate_response_batched
+from documents.summary import format_summary, is_overview_question, load_summary
+from documents.schemas import DocumentQuery, DocumentSearch, ResumableUploadCreate
+from documents.indexer import IndexTooLargeError, index_document, update_document_index
+from documents.jobs import UploadJob, read_job, valid_job_id
+from documents.batch import COPY_BUFFER_SIZE, index_file, index_staged_files, stage_upload
+from documents.bundles import BundleError, bundle_blocks, import_bundle, stage_bundle
+from documents.resumable import (
+    UploadSessionError, complete_upload, create_session, delete_session, read_session, upload_status, write_part
+)
+from documents.storage import (
+    UPLOAD_DIR, delete_document_files, delete_index_artifacts, read_gc_stats, retire_index_artifacts,
+    run_garbage_collection
+)
+from documents.utils import extract_text_from_file
+from documents.permissions import get_oso
 
 router = APIRouter()
 
-UPLOAD_DIR = "uploaded_documents/"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+SUPPORTED_CONTENT_TYPES = [
+    "text/plain", "application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+]
+
+
+async def save_uploaded_file(file: UploadFile):
+    """
+    Store an uploaded file under a unique name and extract its text content.
+
+    Args:
+        file (UploadFile): The uploaded file.
+
+    Returns:
+        tuple: The path the file was stored at and its extracted text content.
+    """
+    if file.content_type not in SUPPORTED_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+
+    # Generate a unique filename
+    file_ext = file.filename.split('.')[-1]
+    unique_filename = f"{uuid4()}.{file_ext}"
+    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+
+    # Save file
+    with open(file_path, "wb") as f:
+        f.write(await file.read())
+
+    await file.seek(0)
+    content = await extract_text_from_file(file)
+    return file_path, content
 
 
 @router.post("/upload")
 async def upload_document(
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    _admission: None = Depends(admission(upload_admission)),
+    job_id: Optional[str] = None
 ):
     """
     Uploads a document, stores it, and indexes it for retrieval.
 
+    Large documents are indexed in batches under the indexing memory ceiling. When the client passes a
+    `job_id` (a UUID it generated), the indexing progress can be followed with `GET /jobs/{job_id}`
+    while the upload is running.
+
     Args:
         file (UploadFile): The file to upload.
         db (AsyncSession): Database session.
         current_user (User): Authenticated user.
+        job_id (str, optional): ID under which the progress of the upload is reported.
 
     Returns:
         dict: Document ID and filename.
     """
-    if file.content_type not in [
-        "text/plain", "application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    ]:
-        raise HTTPException(status_code=400, detail="Unsupported file type")
-
-    # Generate a unique filename
-    file_ext = file.filename.split('.')[-1]
-    unique_filename = f"{uuid4()}.{file_ext}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    if job_id is not None and not valid_job_id(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job ID")
 
-    # Save file
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    file_path, content = await save_uploaded_file(file)
+    job = UploadJob(job_id, current_user.id, file.filename)
 
     # Index document
-    document_id = index_document(file_path)
+    try:
+        document_id = await to_thread(index_document, content, job)
+    except Exception as e:
+        job.fail(str(e))
+        os.remove(file_path)
+        if isinstance(e, IndexTooLargeError):
+            raise HTTPException(status_code=413, detail=str(e))
+        raise
 
     # Save metadata in DB
     new_document = Document(
@@ -60,15 +121,698 @@ async def upload_document(
     )
     db.add(new_document)
     await db.commit()
+    job.finish(id=new_document.id, document_id=document_id)
 
     return {"document_id": document_id, "filename": file.filename}
 
 
+@router.get("/jobs/{job_id}")
+async def upload_job_status(job_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Reports the status and indexing progress of an upload started with a job ID.
+
+    Args:
+        job_id (str): The job ID passed to the upload.
+        current_user (User): Authenticated user, must be the uploader.
+
+    Returns:
+        dict: The job status ("indexing", "completed" or "failed"), the number of indexed and total
+              chunks and, once completed, the IDs of the document.
+    """
+    try:
+        job = read_job(job_id) if valid_job_id(job_id) else None
+    except FileNotFoundError:
+        job = None
+    if job is None or job["user_id"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job
+
+
+def _read_own_upload(upload_id: str, user: User) -> dict:
+    """
+    Read the state of a resumable upload of a user, raising 404 for unknown uploads and those of others.
+    """
+    try:
+        session = read_session(upload_id)
+    except FileNotFoundError:
+        session = None
+    if session is None or session["user_id"] != user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+@router.post("/uploads", status_code=201)
+async def create_resumable_upload(
+    upload: ResumableUploadCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Starts a resumable upload of a large file, which is then sent in parts with `PUT /uploads/{upload_id}`.
+
+    Args:
+        upload (ResumableUploadCreate): Name, size and SHA-256 digest of the file.
+        current_user (User): Authenticated user.
+
+    Returns:
+        dict: The upload ID and the progress of the upload.
+    """
+    try:
+        session = await to_thread(create_session, current_user.id, upload.filename, upload.size, upload.sha256)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return upload_status(session)
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_part(
+    upload_id: str,
+    request: Request,
+    content_range: str = Header(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Receives a part of a resumable upload, given by a `Content-Range: bytes <first>-<last>/<size>` header.
+
+    The part is written to the staging file at its offset as it arrives, so parts can be sent in any order
+    and concurrently, and a part that broke off only needs its missing bytes sent again.
+
+    Args:
+        upload_id (str): The ID of the upload.
+        request (Request): The request, whose body holds the bytes of the part.
+        content_range (str): The byte range of the part.
+        current_user (User): Authenticated user, must be the uploader.
+
+    Returns:
+        dict: The progress of the upload, including the byte ranges that are still missing.
+    """
+    session = _read_own_upload(upload_id, current_user)
+
+    match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", content_range.strip())
+    if not match or int(match[3]) != session["size"] or not int(match[1]) <= int(match[2]) < session["size"]:
+        raise HTTPException(status_code=416, detail="Invalid Content-Range")
+    start, end = int(match[1]), int(match[2]) + 1
+
+    offset = start
+    block = bytearray()
+    try:
+        async for data in request.stream():
+            block += data
+            if offset + len(block) > end:
+                raise HTTPException(status_code=400, detail="The body is longer than the Content-Range")
+            if len(block) >= COPY_BUFFER_SIZE:
+                session = await to_thread(write_part, upload_id, offset, bytes(block))
+                offset += len(block)
+                block.clear()
+        session = await to_thread(write_part, upload_id, offset, bytes(block))
+    except UploadSessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    return upload_status(session)
+
+
+@router.get("/uploads/{upload_id}")
+async def resumable_upload_status(upload_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Reports the progress of a resumable upload.
+
+    Args:
+        upload_id (str): The ID of the upload.
+        current_user (User): Authenticated user, must be the uploader.
+
+    Returns:
+        dict: The size of the file, the received and missing byte ranges and the status of the upload.
+    """
+    return upload_status(_read_own_upload(upload_id, current_user))
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_resumable_upload(
+    upload_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    _admission: None = Depends(admission(upload_admission))
+):
+    """
+    Completes a resumable upload: verifies the assembled file against its SHA-256 digest, stores it and
+    indexes it like `/upload`.
+
+    The indexing progress can be followed with `GET /jobs/{upload_id}`. An upload whose digest does not
+    match is discarded and has to be started again.
+
+    Args:
+        upload_id (str): The ID of the upload.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user, must be the uploader.
+
+    Returns:
+        dict: Document ID and filename.
+    """
+    session = _read_own_upload(upload_id, current_user)
+    file_path = os.path.join(UPLOAD_DIR, f"{uuid4()}{os.path.splitext(session['filename'])[1].lower()}")
+    try:
+        await to_thread(complete_upload, upload_id, file_path)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    job = UploadJob(upload_id, current_user.id, session["filename"])
+    try:
+        document_id = await to_thread(index_file, file_path, session["content_type"], job)
+    except Exception as e:
+        job.fail(str(e))
+        os.remove(file_path)
+        if isinstance(e, IndexTooLargeError):
+            raise HTTPException(status_code=413, detail=str(e))
+        raise
+
+    new_document = Document(
+        filename=session["filename"], file_path=file_path, uploaded_by=current_user, document_id=document_id
+    )
+    db.add(new_document)
+    await db.commit()
+    job.finish(id=new_document.id, document_id=document_id)
+
+    return {"document_id": document_id, "filename": session["filename"]}
+
+
+@router.delete("/uploads/{upload_id}")
+async def cancel_resumable_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Cancels a resumable upload and removes the parts received so far.
+
+    Args:
+        upload_id (str): The ID of the upload.
+        current_user (User): Authenticated user, must be the uploader.
+
+    Returns:
+        dict: Confirmation message.
+    """
+    _read_own_upload(upload_id, current_user)
+    await to_thread(delete_session, upload_id)
+    return {"message": "Upload cancelled"}
+
+
+@router.post("/upload/batch")
+async def upload_documents_batch(
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    _admission: None = Depends(admission(upload_admission))
+):
+    """
+    Uploads many documents at once, indexes them in parallel and stores their metadata in one statement.
+
+    Each uploaded file can be a document or a zip/tar archive of documents. Files are indexed across a
+    pool of worker processes, and all successfully indexed documents are inserted with a single bulk
+    INSERT. Files that cannot be indexed are reported individually and do not fail the batch.
+
+    Args:
+        files (List[UploadFile]): The documents and archives to upload.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        dict: The number of indexed and failed files and a result per file.
+    """
+    staged = []
+    for file in files:
+        staged.extend(await to_thread(stage_upload, file))
+
+    await index_staged_files(staged)
+
+    indexed = [entry for entry in staged if "document_id" in entry]
+    if indexed:
+        try:
+            result = await db.execute(
+                insert(Document).values([
+                    {
+                        "filename": entry["filename"],
+                        "file_path": entry["file_path"],
+                        "uploaded_by_id": current_user.id,
+                        "document_id": entry["document_id"],
+                    }
+                    for entry in indexed
+                ]).returning(Document.id, Document.document_id)
+            )
+            ids = {row.document_id: row.id for row in result}
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            for entry in indexed:
+                delete_index_artifacts(entry["document_id"])
+                os.remove(entry["file_path"])
+            raise
+        for entry in indexed:
+            entry["id"] = ids[entry["document_id"]]
+
+    return {
+        "indexed": len(indexed),
+        "failed": len(staged) - len(indexed),
+        "results": [
+            {key: entry[key] for key in ("filename", "id", "document_id", "error") if key in entry}
+            for entry in staged
+        ],
+    }
+
+
+async def _export_bundle(documents: list, current_user: User, filename: str) -> StreamingResponse:
+    """
+    Stage a bundle of documents the user may export and stream it as a tar file.
+    """
+    for document in documents:
+        if not get_oso().is_allowed(current_user, "export", document):
+            raise HTTPException(status_code=403, detail="Access denied")
+
+    try:
+        directory = await to_thread(stage_bundle, documents)
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="The file or index of a document is missing")
+
+    return StreamingResponse(
+        bundle_blocks(directory),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/export")
+async def export_user_documents(
+    user_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Exports all documents of a user as one bundle (see `GET /{document_id}/export`).
+
+    Args:
+        user_id (int, optional): ID of the user whose documents are exported; defaults to the current user.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user, must be the owner of the documents or an admin.
+
+    Returns:
+        StreamingResponse: The bundle as a tar file.
+    """
+    user_id = current_user.id if user_id is None else user_id
+    result = await db.execute(select(Document).filter(Document.uploaded_by_id == user_id).order_by(Document.id))
+    return await _export_bundle(result.scalars().all(), current_user, f"documents-user-{user_id}.tar")
+
+
+@router.get("/{document_id}/export")
+async def export_document(
+    document_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Exports a document as a self-describing bundle that `POST /import` can load on another deployment.
+
+    The bundle is a tar file of a `manifest.json` with the document's metadata and the size and SHA-256
+    digest of every member, followed by the source file and the prebuilt index artifacts. It is staged on
+    disk and streamed block by block, so neither side holds it in memory.
+
+    Args:
+        document_id (int): ID of the document to export.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user, must be the owner of the document or an admin.
+
+    Returns:
+        StreamingResponse: The bundle as a tar file.
+    """
+    result = await db.execute(select(Document).filter(Document.id == document_id))
+    document = result.scalar_one_or_none()
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    return await _export_bundle([document], current_user, f"document-{document_id}.tar")
+
+
+@router.post("/import")
+async def import_documents(
+    file: UploadFile = File(...),
+    user_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    _admission: None = Depends(admission(upload_admission))
+):
+    """
+    Imports the documents of a bundle created by an export and attaches them to a user, without
+    re-indexing them.
+
+    The bundle is read from the spooled upload as a stream and every member is verified against the
+    checksums of its manifest before anything is stored. Since bundles contain pickled vectorizers, only
+    admins may import them.
+
+    Args:
+        file (UploadFile): The bundle.
+        user_id (int, optional): ID of the user the documents are attached to; defaults to the current user.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: The number of imported documents and their IDs, index IDs and filenames.
+    """
+    if not get_oso().is_allowed(current_user, "import_documents", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    user_id = current_user.id if user_id is None else user_id
+    if user_id != current_user.id and await db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        imported = await to_thread(import_bundle, file.file)
+    except BundleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if imported:
+        try:
+            result = await db.execute(
+                insert(Document).values([
+                    {**entry, "uploaded_by_id": user_id} for entry in imported
+                ]).returning(Document.id, Document.document_id)
+            )
+            ids = {row.document_id: row.id for row in result}
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            for entry in imported:
+                delete_index_artifacts(entry["document_id"])
+                os.remove(entry["file_path"])
+            raise
+        for entry in imported:
+            entry["id"] = ids[entry["document_id"]]
+
+    return {
+        "imported": len(imported),
+        "results": [
+            {key: entry[key] for key in ("filename", "id", "document_id")} for entry in imported
+        ],
+    }
+
+
+@router.get("/admin/gc")
+async def garbage_collection_stats(current_user: User = Depends(get_current_user)):
+    """
+    Reports how many orphaned files the storage garbage collection has removed and how many bytes it reclaimed.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Statistics of the last run and totals over all runs.
+    """
+    if not get_oso().is_allowed(current_user, "manage_storage", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return read_gc_stats()
+
+
+@router.post("/admin/gc")
+async def trigger_garbage_collection(current_user: User = Depends(get_current_user)):
+    """
+    Runs the storage garbage collection now and reports the reclaimed bytes.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Statistics of this run and totals over all runs.
+    """
+    if not get_oso().is_allowed(current_user, "manage_storage", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if await run_garbage_collection() is None:
+        raise HTTPException(status_code=409, detail="Garbage collection already running")
+
+    return read_gc_stats()
+
+
+@router.get("/admin/coalescing")
+async def coalescing_stats(current_user: User = Depends(get_current_user)):
+    """
+    Reports how many index loads and answers were computed and how many concurrent requests joined them,
+    and how many completion calls the batched prompts needed.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Counters of this worker for index loads, answers and completion batches.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return {
+        "index_loads": index_loads.stats(), "answers": answers.stats(), "completion_batches": completion_batcher.stats()
+    }
+
+
+@router.get("/admin/admission")
+async def admission_stats(current_user: User = Depends(get_current_user)):
+    """
+    Reports the active requests, queue depth and rejection counters of the upload and query admission control.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Admission statistics of this worker per endpoint group.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return {"upload": upload_admission.stats(), "query": query_admission.stats()}
+
+
+@router.get("/admin/semantic-cache")
+async def semantic_cache_stats(current_user: User = Depends(get_current_user)):
+    """
+    Reports the lookups, hits and hit rate of the semantic query cache.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Semantic cache statistics of this worker.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return semantic_cache.stats()
+
+
+@router.get("/admin/tiers")
+async def storage_tier_stats(current_user: User = Depends(get_current_user)):
+    """
+    Reports how many indexes are in the hot, warm and cold storage tiers and how much compression saves.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Tier statistics of the node and the index cache of this worker.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return {**await to_thread(tier_stats), "worker_cache": cache_stats()}
+
+
+@router.get("/admin/retrieval-workers")
+async def retrieval_worker_stats(current_user: User = Depends(get_current_user)):
+    """
+    Reports the load of every retrieval worker on the node.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Requests, errors, busy time, average load and cached indexes of each retrieval worker.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return {"workers": await to_thread(worker_stats)}
+
+
+@router.get("/admin/dedup")
+async def chunk_dedup_stats(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Reports how many chunk references the chunk store deduplicates, per user and over all users.
+
+    Args:
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        dict: Chunk references, unique chunks and dedup ratio per user ID and in total.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    result = await db.execute(select(Document.uploaded_by_id, Document.document_id))
+    index_ids_by_user = {}
+    for row in result.all():
+        index_ids_by_user.setdefault(row.uploaded_by_id, []).append(row.document_id)
+
+    return await to_thread(dedup_stats, index_ids_by_user)
+
+
+@router.get("/admin/profiles")
+async def request_profiles(current_user: User = Depends(get_current_user)):
+    """
+    Lists the saved request profiles with the metadata of the profiled requests, newest first.
+
+    Args:
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        list: Metadata of each profile, including its ID, path, status code, duration and trigger.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return list_profiles()
+
+
+@router.get("/admin/profiles/{profile_id}")
+async def download_request_profile(profile_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Downloads a saved request profile in the `pstats` format.
+
+    Args:
+        profile_id (str): ID of the profile, as listed by `/admin/profiles`.
+        current_user (User): Authenticated user, must be an admin.
+
+    Returns:
+        FileResponse: The profile file.
+    """
+    if not get_oso().is_allowed(current_user, "view_metrics", None):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    try:
+        path = profile_path(profile_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
+
+
+@router.get("/{document_id}/summary")
+async def document_summary(
+    document_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Returns the extractive summary and section outline of a document, precomputed when it was indexed.
+
+    Args:
+        document_id (int): ID of the document.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        dict: The summary sentences, the outline headings with the position of their chunk and the number
+              of sentences and chunks of the document.
+    """
+    result = await db.execute(select(Document).filter(Document.id == document_id))
+    document = result.scalar_one_or_none()
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    if not get_oso().is_allowed(current_user, "query", document):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    try:
+        summary = await to_thread(load_summary, document.document_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="The index of the document is missing")
+
+    return {"document_id": document.id, "filename": document.filename, **summary}
+
+
+def _reindex_document(old_index_id: str, content: str) -> dict:
+    """
+    Re-index the new content of a document against its current index, or from scratch if that is gone.
+    """
+    try:
+        return update_document_index(old_index_id, content)
+    except FileNotFoundError:
+        # The previous artifacts are gone, so there is nothing to diff against
+        return {"document_id": index_document(content), "added": None, "removed": None, "unchanged": None}
+
+
+@router.put("/{document_id}")
+async def replace_document(
+    document_id: int,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    _admission: None = Depends(admission(upload_admission))
+):
+    """
+    Replaces the content of a document and incrementally re-indexes it.
+
+    Only the chunks that changed are re-vectorized. The new index is written under a new index ID and the
+    document row is switched to it in a single commit, so readers see either the old or the new index.
+    The old file is removed afterwards; the old index artifacts are left to garbage collection, so
+    requests that already read the old index ID can still load it.
+
+    Args:
+        document_id (int): ID of the document to replace.
+        file (UploadFile): The new version of the file.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        dict: Document ID, filename and the number of added, removed and unchanged chunks.
+    """
+    result = await db.execute(select(Document).filter(Document.id == document_id))
+    document = result.scalar_one_or_none()
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    if not get_oso().is_allowed(current_user, "update", document):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    file_path, content = await save_uploaded_file(file)
+    old_file_path, old_index_id = document.file_path, document.document_id
+
+    try:
+        stats = await to_thread(_reindex_document, old_index_id, content)
+    except Exception as e:
+        os.remove(file_path)
+        if isinstance(e, IndexTooLargeError):
+            raise HTTPException(status_code=413, detail=str(e))
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=400, detail=f"Cannot index the document: {e}")
+        raise
+
+    document.filename = file.filename
+    document.file_path = file_path
+    document.document_id = stats["document_id"]
+    await db.commit()
+
+    retire_index_artifacts(old_index_id)
+    if os.path.exists(old_file_path):
+        os.remove(old_file_path)
+
+    return {"document_id": stats.pop("document_id"), "filename": file.filename, **stats}
+
+
 @router.post("/query")
 async def query_document(
     document_query: DocumentQuery,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    _admission: None = Depends(admission(query_admission))
 ):
     """
     Queries a document for relevant chunks and generates a response.
@@ -79,7 +823,8 @@ async def query_document(
         current_user (User): Authenticated user.
 
     Returns:
-        dict: The AI-generated response.
+        dict: The AI-generated response, the number of context tokens sent to the model, whether the
+              answer was served from the semantic cache and whether it is the document's summary.
     """
     # Fetch document
     result = await db.execute(select(Document).filter(Document.id == document_query.document_id))
@@ -89,11 +834,134 @@ async def query_document(
         raise HTTPException(status_code=404, detail="Document not found")
 
     # OSO authorization check using policy.polar
-    if not oso.is_allowed(current_user, "query", document):
+    if not get_oso().is_allowed(current_user, "query", document):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Retrieve and generate response
-    relevant_chunks = retrieve_relevant_chunks(document_query.query, document.document_id)
-    answer = generate_response(relevant_chunks, document_query.query)
+    # Retrieve and generate response, sharing the work with identical concurrent questions
+    return await answers.do(
+        (document.document_id, document_query.query.strip()), answer_query, document.document_id, document_query.query
+    )
+
+
+async def answer_query(index_id: str, query: str):
+    """
+    Retrieves the relevant chunks of an index and generates the answer to a query.
+
+    Overview questions like "What is this document about?" are answered with the document's precomputed
+    summary and outline, without retrieval or a completion call. Concurrent requests that need the same
+    index share a single load of it. An answer to a paraphrase of
+    an earlier question is served from the semantic cache, and the completion call is batched with those of
+    concurrent queries. With retrieval workers, the query is vectorized and searched by the worker that
+    owns the index, so the web worker loads nothing. With the "fts5" retrieval backend no index is
+    loaded and the semantic cache, which compares queries with the index's vectorizer, is skipped. The
+    blocking retrieval and generation run in worker threads so they do not stall the event loop.
+
+    Args:
+        index_id (str): The unique identifier of the document's index.
+        query (str): The user's question.
+
+    Returns:
+        dict: The generated answer, the number of context tokens used for it, whether it was cached and
+              whether it is the document's summary.
+    """
+    if settings.SUMMARY_ROUTING and is_overview_question(query):
+        summary = await to_thread(load_summary, index_id)
+        return {"answer": format_summary(summary), "context_tokens": 0, "cached": False, "summary": True}
+
+    query_vector = None
+    if settings.RETRIEVAL_BACKEND != "fts5" and settings.RETRIEVAL_WORKERS > 0:
+        query_vector = await to_thread(vectorize_query, query, index_id)
+    elif settings.RETRIEVAL_BACKEND != "fts5":
+        _, _, vectorizer = await index_loads.do(index_id, to_thread, load_faiss_index_and_chunks, index_id)
+        query_vector = vectorizer.transform([query])
+    if query_vector is not None:
+        cached = semantic_cache.lookup(index_id, query_vector)
+        if cached is not None:
+            answer, context_tokens = cached
+            return {"answer": answer, "context_tokens": context_tokens, "cached": True, "summary": False}
+
+    relevant_chunks = await to_thread(retrieve_scored_chunks, query, index_id, settings.CONTEXT_CANDIDATES)
+    try:
+        answer, context_tokens = await generate_response_batched(relevant_chunks, query)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Answer generation timed out")
+    if query_vector is not None:
+        semantic_cache.store(index_id, query_vector, (answer, context_tokens))
+
+    return {"answer": answer, "context_tokens": context_tokens, "cached": False, "summary": False}
+
+
+@router.post("/search")
+async def search_documents(
+    document_search: DocumentSearch,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    _admission: None = Depends(admission(query_admission))
+):
+    """
+    Searches documents for the chunks that best match a query, without generating an answer.
+
+    Every document must pass the same authorization check as `/documents/query`. The hits of all documents
+    are merged by score; hits without any similarity to the query or scoring below `min_score` are left out.
+
+    Args:
+        document_search (DocumentSearch): The query, the documents to search and the result options.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        dict: The hits, each with its document ID, chunk ID, offset, score, text and optional snippet.
+    """
+    result = await db.execute(select(Document).filter(Document.id.in_(document_search.document_ids)))
+    documents = {document.id: document for document in result.scalars().all()}
+
+    for document_id in document_search.document_ids:
+        document = documents.get(document_id)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+        if not get_oso().is_allowed(current_user, "query", document):
+            raise HTTPException(status_code=403, detail="Access denied")
+
+    hits = []
+    for document in documents.values():
+        for hit in await to_thread(
+            search_chunks, document_search.query, document.document_id, document_search.k, document_search.highlight
+        ):
+            if hit["score"] > 0 and hit["score"] >= document_search.min_score:
+                hits.append({"document_id": document.id, **hit})
+
+    hits.sort(key=lambda hit: hit["score"], reverse=True)
+    return {"results": hits[:document_search.k]}
+
+
+@router.delete("/{document_id}")
+async def delete_document(
+    document_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Deletes a document together with its stored file and index artifacts.
+
+    Args:
+        document_id (int): ID of the document to delete.
+        db (AsyncSession): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        dict: A success message and the number of bytes reclaimed.
+    """
+    result = await db.execute(select(Document).filter(Document.id == document_id))
+    document = result.scalar_one_or_none()
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    if not get_oso().is_allowed(current_user, "delete", document):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    await db.delete(document)
+    await db.commit()
+    bytes_reclaimed = delete_document_files(document)
 
-    return {"answer": answer}
+    return {"message": f"Document {document_id} deleted", "bytes_reclaimed": bytes_reclaimed}
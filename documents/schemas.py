@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import List
+
+from pydantic import BaseModel, Field
 
 
 class DocumentQuery(BaseModel):
@@ -11,3 +13,35 @@ class DocumentQuery(BaseModel):
     """
     query: str
     document_id: int
+
+
+class DocumentSearch(BaseModel):
+    """
+    Schema for searching documents for matching chunks without generating an answer.
+
+    Attributes:
+    query (str): The search query.
+    document_ids (List[int]): IDs of the documents to search.
+    k (int): The maximum number of chunks to return.
+    min_score (float): Chunks scoring below this are left out.
+    highlight (bool): Whether to return a snippet of each chunk with the query terms marked.
+    """
+    query: str
+    document_ids: List[int] = Field(min_length=1, max_length=20)
+    k: int = Field(default=5, ge=1, le=100)
+    min_score: float = 0.0
+    highlight: bool = False
+
+
+class ResumableUploadCreate(BaseModel):
+    """
+    Schema for starting a resumable upload.
+
+    Attributes:
+    filename (str): Name of the file; its extension decides the file type.
+    size (int): Size of the file in bytes.
+    sha256 (str): Hex SHA-256 digest of the file, verified when the upload is completed.
+    """
+    filename: str
+    size: int
+    sha256: str = Field(pattern="^[0-9a-fA-F]{64}$")
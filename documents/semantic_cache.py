@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+from config import settings
+
+
+class SemanticCache:
+    """
+    Caches answers per index and serves them for queries that are near-duplicates of answered ones.
+
+    Queries are compared by the cosine similarity of their TF-IDF vectors, computed with the document's
+    own vectorizer, so paraphrases that only differ in stop words, word order or punctuation map to the
+    same vector. For each index the `entries_per_index` most recent answered queries are kept as a
+    sparse matrix, and a lookup is a single sparse matrix-vector product. At most `max_indexes` indexes
+    are cached, least recently used first out.
+    """
+
+    def __init__(self, entries_per_index: int, max_indexes: int, threshold: float):
+        self.entries_per_index = entries_per_index
+        self.max_indexes = max_indexes
+        self.threshold = threshold
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def lookup(self, index_id: str, query_vector):
+        """
+        Return the cached answer of the most similar earlier query, if it is similar enough.
+
+        Args:
+            index_id (str): The unique identifier of the document's index.
+            query_vector: The query's TF-IDF vector, a 1 x vocabulary sparse matrix.
+
+        Returns:
+            The cached answer, or None on a miss.
+        """
+        with self._lock:
+            self.lookups += 1
+            entry = self._indexes.get(index_id)
+            if entry is None or not query_vector.nnz:
+                return None
+            self._indexes.move_to_end(index_id)
+            matrix, answers = entry["matrix"], entry["answers"]
+
+        similarities = (matrix @ query_vector.T).toarray().ravel()
+        best = int(similarities.argmax())
+        if similarities[best] < self.threshold:
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return answers[best]
+
+    def store(self, index_id: str, query_vector, answer):
+        """
+        Remember the answer of a query, evicting the oldest query of the index when it is full.
+        """
+        if not query_vector.nnz or self.entries_per_index <= 0:
+            return
+
+        from scipy.sparse import vstack
+
+        with self._lock:
+            entry = self._indexes.get(index_id)
+            if entry is None:
+                matrix, answers = query_vector, [answer]
+            else:
+                matrix = vstack([entry["matrix"], query_vector]).tocsr()
+                answers = entry["answers"] + [answer]
+                if len(answers) > self.entries_per_index:
+                    matrix, answers = matrix[1:], answers[1:]
+            self._indexes[index_id] = {"matrix": matrix, "answers": answers}
+            self._indexes.move_to_end(index_id)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+
+    def invalidate(self, index_id: str):
+        with self._lock:
+            self._indexes.pop(index_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "indexes": len(self._indexes),
+                "entries": sum(len(entry["answers"]) for entry in self._indexes.values()),
+                "threshold": self.threshold,
+            }
+
+
+semantic_cache = SemanticCache(
+    settings.SEMANTIC_CACHE_ENTRIES, settings.SEMANTIC_CACHE_INDEXES, settings.SEMANTIC_CACHE_THRESHOLD
+)
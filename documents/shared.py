@@ -0,0 +1,160 @@
+import struct
+
+import numpy as np
+
+from documents.artifacts import get_artifact_store
+from documents.chunk_store import ChunkRefs
+
+# File layout: magic, chunk count, dimension, text size, then the chunk ids (sorted), the text offsets,
+# the chunk vectors and the UTF-8 chunk texts. Every section starts at a multiple of 4 bytes.
+SHARED_MAGIC = b"FAISSHM1"
+_HEADER = struct.Struct("<8sqqq")
+
+
+class MappedChunks:
+    """
+    Read-only mapping from chunk id to chunk text, backed by a memory-mapped shared artifact.
+
+    It supports the subset of the dict interface the retriever uses on loaded chunks.
+    """
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, text: memoryview):
+        self.ids = ids
+        self.offsets = offsets
+        self.text = text
+
+    def position(self, chunk_id: int) -> int:
+        """
+        Return the row of a chunk id in the artifact, raising KeyError for unknown ids.
+        """
+        position = int(np.searchsorted(self.ids, chunk_id))
+        if position >= len(self.ids) or self.ids[position] != chunk_id:
+            raise KeyError(chunk_id)
+        return position
+
+    def text_at(self, position: int) -> str:
+        return bytes(self.text[self.offsets[position]:self.offsets[position + 1]]).decode("utf-8")
+
+    def __getitem__(self, chunk_id: int) -> str:
+        return self.text_at(self.position(chunk_id))
+
+    def __contains__(self, chunk_id: int) -> bool:
+        try:
+            self.position(chunk_id)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def items(self):
+        for position, chunk_id in enumerate(self.ids.tolist()):
+            yield chunk_id, self.text_at(position)
+
+
+class MappedIndex:
+    """
+    Exact L2 search over memory-mapped chunk vectors, with the same `search`/`reconstruct` interface as a
+    FAISS `IndexIDMap2`.
+
+    All worker processes that map the same artifact share its physical pages through the page cache,
+    instead of each holding a private copy of the vectors.
+    """
+
+    def __init__(self, vectors: np.ndarray, chunks: MappedChunks):
+        self.vectors = vectors
+        self.chunks = chunks
+        self.ntotal = len(vectors)
+        self.d = vectors.shape[1]
+
+    def search(self, query_vectors: np.ndarray, k: int):
+        import faiss
+
+        distances, positions = faiss.knn(query_vectors, self.vectors, k)
+        ids = np.where(positions >= 0, self.chunks.ids[positions], -1)
+        return distances, ids
+
+    def reconstruct(self, chunk_id: int) -> np.ndarray:
+        return np.array(self.vectors[self.chunks.position(chunk_id)])
+
+
+def _index_vectors(index):
+    """
+    Return the chunk ids and vectors stored in a FAISS index.
+
+    Indexes written before chunk ids were introduced use positions as ids.
+    """
+    import faiss
+
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.vector_to_array(index.id_map).astype(np.int64), index.index.reconstruct_n(0, index.ntotal)
+    return np.arange(index.ntotal, dtype=np.int64), index.reconstruct_n(0, index.ntotal)
+
+
+def write_shared_artifact(document_id: str, index, chunks):
+    """
+    Write the memory-mappable artifact of a loaded index to the artifact store.
+
+    The store never exposes a partially written artifact, so concurrent workers that build it at the same
+    time never map a partial file.
+
+    Args:
+        document_id (str): The unique identifier of the index.
+        index (faiss.Index): The loaded FAISS index.
+        chunks: The loaded chunks, keyed by chunk id (or a list for indexes without chunk ids). The texts
+                of chunks that reference the chunk store are not copied into the artifact.
+    """
+    ids, vectors = _index_vectors(index)
+    order = np.argsort(ids)
+    ids, vectors = ids[order], np.ascontiguousarray(vectors[order], dtype=np.float32)
+
+    if isinstance(chunks, ChunkRefs):
+        encoded = [b""] * len(ids)
+    else:
+        encoded = [chunks[int(chunk_id)].encode("utf-8") for chunk_id in ids]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in encoded])
+
+    get_artifact_store().write(document_id, {"shared": b"".join([
+        _HEADER.pack(SHARED_MAGIC, len(ids), vectors.shape[1], int(offsets[-1])),
+        ids.tobytes(),
+        offsets.tobytes(),
+        vectors.tobytes(),
+        *encoded,
+    ])})
+
+
+def open_shared_index(document_id: str):
+    """
+    Memory-map the shared artifact of an index ID from the artifact store.
+
+    Args:
+        document_id (str): The unique identifier of the index.
+
+    Returns:
+        Tuple[MappedIndex, MappedChunks]: The mapped index and chunks.
+
+    Raises:
+        FileNotFoundError: If the artifact has not been written yet.
+    """
+    mapped = get_artifact_store().map(document_id, "shared")
+
+    magic, count, dimension, _ = _HEADER.unpack_from(mapped, 0)
+    if magic != SHARED_MAGIC:
+        raise ValueError(f"The shared artifact of index {document_id} is corrupt")
+
+    offset = _HEADER.size
+    ids = np.frombuffer(mapped, dtype=np.int64, count=count, offset=offset)
+    offset += ids.nbytes
+    offsets = np.frombuffer(mapped, dtype=np.int64, count=count + 1, offset=offset)
+    offset += offsets.nbytes
+    vectors = np.frombuffer(mapped, dtype=np.float32, count=count * dimension, offset=offset)
+    vectors = vectors.reshape(count, dimension)
+    offset += vectors.nbytes
+
+    chunks = MappedChunks(ids, offsets, mapped[offset:])
+    return MappedIndex(vectors, chunks), chunks
@@ -0,0 +1,238 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import settings
+from database import SessionLocal
+from documents import chunk_store, fts
+from documents.artifacts import get_artifact_store
+from documents.jobs import remove_stale_jobs
+from documents.resumable import remove_stale_uploads
+from documents.models import Document
+from documents.retriever import bump_index_generation, invalidate_cached_index
+from documents.semantic_cache import semantic_cache
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploaded_documents/"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+GC_LOCK_FILE = "gc.lock"
+GC_STATS_FILE = "gc_stats.json"
+
+
+def _remove_file(path: str) -> int:
+    """
+    Remove a file if it exists and return the number of bytes it occupied.
+    """
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return size
+
+
+def delete_index_artifacts(document_id: str) -> int:
+    """
+    Remove the artifacts of an index ID, drop it from the index cache and signal the other workers to do
+    the same.
+
+    Args:
+        document_id (str): The unique identifier of the index whose artifacts are removed.
+
+    Returns:
+        int: The number of bytes reclaimed. With the segment store, the space is only reclaimed on disk
+             once the segment is compacted.
+    """
+    invalidate_cached_index(document_id)
+    semantic_cache.invalidate(document_id)
+    bytes_reclaimed = get_artifact_store().delete(document_id)
+    if settings.RETRIEVAL_BACKEND == "fts5":
+        fts.delete_chunks(document_id)
+    bump_index_generation()
+    return bytes_reclaimed
+
+
+def retire_index_artifacts(document_id: str):
+    """
+    Leave the artifacts of an index ID that a document row no longer references to garbage collection.
+
+    Requests that read the old index ID before the row was switched can still load its artifacts, so they
+    are not removed right away. Their age is restarted instead, and `collect_garbage` removes them once they
+    are `settings.GC_MIN_AGE_SECONDS` old.
+
+    Args:
+        document_id (str): The unique identifier of the index that was replaced.
+    """
+    invalidate_cached_index(document_id)
+    semantic_cache.invalidate(document_id)
+    get_artifact_store().touch(document_id)
+    if settings.RETRIEVAL_BACKEND == "fts5":
+        fts.touch_chunks(document_id)
+
+
+def delete_document_files(document: Document) -> int:
+    """
+    Remove the uploaded file and the index artifacts of a document.
+
+    This is called after the document row has been deleted (or switched to a new file) and committed,
+    so a failed transaction never leaves a row pointing at missing files.
+
+    Args:
+        document (Document): The document whose files are removed.
+
+    Returns:
+        int: The number of bytes reclaimed.
+    """
+    return delete_index_artifacts(document.document_id) + _remove_file(document.file_path)
+
+
+async def delete_user_documents(db: AsyncSession, user_id: int) -> list:
+    """
+    Delete the document rows of a user within the current transaction.
+
+    The files of the returned documents should be removed with `delete_document_files` once the
+    transaction is committed.
+
+    Args:
+        db (AsyncSession): Database session.
+        user_id (int): ID of the user whose documents are deleted.
+
+    Returns:
+        list: The deleted documents.
+    """
+    result = await db.execute(select(Document).filter(Document.uploaded_by_id == user_id))
+    documents = result.scalars().all()
+    await db.execute(delete(Document).where(Document.uploaded_by_id == user_id))
+    return documents
+
+
+def _referenced_chunk_ids() -> np.ndarray:
+    """
+    Return the chunk ids that the stored indexes reference in the chunk store.
+    """
+    ids = []
+    for document_id in get_artifact_store().document_ids():
+        try:
+            chunk_ids = chunk_store.read_chunk_ids(document_id)
+        except FileNotFoundError:
+            continue
+        if chunk_ids is not None:
+            ids.append(chunk_ids)
+    return np.unique(np.concatenate(ids)) if ids else np.array([], dtype=np.int64)
+
+
+def collect_garbage(referenced_index_ids: set, referenced_file_paths: set, min_age: float) -> dict:
+    """
+    Remove index artifacts and uploaded files that no document row references.
+
+    The artifact store removes the unreferenced artifacts in its own way; the segment store also compacts
+    its segments, and with the "fts5" retrieval backend the chunks of unreferenced indexes are removed from
+    the full-text search database. Files younger than `min_age` seconds are kept, since an upload writes its
+    files before the document row is committed. Upload job statuses are removed once they are `min_age`
+    seconds old, and resumable uploads once they received no part for
+    `settings.RESUMABLE_UPLOAD_EXPIRY_SECONDS`. Chunk texts in the chunk store that no remaining index
+    references are removed once they were last referenced `min_age` seconds ago.
+
+    Args:
+        referenced_index_ids (set): Index IDs referenced by `Document.document_id`.
+        referenced_file_paths (set): Normalized paths referenced by `Document.file_path`.
+        min_age (float): Minimum age in seconds of a file before it can be removed.
+
+    Returns:
+        dict: The number of removed files and reclaimed bytes.
+    """
+    cutoff = time.time() - min_age
+    stats = get_artifact_store().collect_garbage(referenced_index_ids, min_age)
+    stats["jobs_removed"] = remove_stale_jobs(min_age)
+    stats["resumable_uploads_removed"] = remove_stale_uploads(settings.RESUMABLE_UPLOAD_EXPIRY_SECONDS)
+    stats["stored_chunks_removed"] = chunk_store.collect_garbage(_referenced_chunk_ids(), min_age)
+    if settings.RETRIEVAL_BACKEND == "fts5":
+        stats["chunks_removed"] = fts.collect_garbage(referenced_index_ids, min_age)
+
+    for entry in os.scandir(UPLOAD_DIR):
+        if not entry.is_file() or os.path.normpath(entry.path) in referenced_file_paths:
+            continue
+        if entry.stat().st_mtime > cutoff:
+            continue
+        stats["bytes_reclaimed"] += _remove_file(entry.path)
+        stats["files_removed"] += 1
+
+    return stats
+
+
+def read_gc_stats() -> dict:
+    """
+    Read the statistics of the garbage collection runs, shared by all workers on the node.
+    """
+    try:
+        with open(os.path.join(settings.FAISS_INDEX_DIR, GC_STATS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {
+            "runs": 0, "last_run_at": None, "last_run": None, "total_files_removed": 0, "total_bytes_reclaimed": 0
+        }
+
+
+async def run_garbage_collection(min_age: float = None):
+    """
+    Remove orphaned index artifacts and uploaded files and record the reclaimed space.
+
+    Only one worker per node collects at a time; the others return None immediately.
+
+    Args:
+        min_age (float, optional): Minimum age in seconds of a removed file. Defaults to
+                                   `settings.GC_MIN_AGE_SECONDS`.
+
+    Returns:
+        dict or None: The statistics of this run, or None if another worker is collecting.
+    """
+    if min_age is None:
+        min_age = settings.GC_MIN_AGE_SECONDS
+
+    with open(os.path.join(settings.FAISS_INDEX_DIR, GC_LOCK_FILE), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        async with SessionLocal() as db:
+            result = await db.execute(select(Document.document_id, Document.file_path))
+            rows = result.all()
+
+        referenced_index_ids = {row.document_id for row in rows}
+        referenced_file_paths = {os.path.normpath(row.file_path) for row in rows}
+        run = await asyncio.to_thread(collect_garbage, referenced_index_ids, referenced_file_paths, min_age)
+
+        stats = read_gc_stats()
+        stats["runs"] += 1
+        stats["last_run_at"] = time.time()
+        stats["last_run"] = run
+        stats["total_files_removed"] += run["files_removed"]
+        stats["total_bytes_reclaimed"] += run["bytes_reclaimed"]
+        with open(os.path.join(settings.FAISS_INDEX_DIR, GC_STATS_FILE), "w") as f:
+            json.dump(stats, f)
+
+    logger.info("Garbage collection removed %(files_removed)d files, %(bytes_reclaimed)d bytes", run)
+    return run
+
+
+async def garbage_collection_loop():
+    """
+    Background task that periodically removes orphaned files, every `settings.GC_INTERVAL_SECONDS`.
+    """
+    while True:
+        await asyncio.sleep(settings.GC_INTERVAL_SECONDS)
+        try:
+            await run_garbage_collection()
+        except Exception:
+            logger.exception("Garbage collection failed")
@@ -0,0 +1,165 @@
+import json
+import pickle
+import re
+
+import numpy as np
+
+from config import settings
+from documents.artifacts import get_artifact_store
+from documents.chunk_store import decode_chunks
+
+# Longest line, in words, that is taken for a heading of the outline
+HEADING_MAX_WORDS = 12
+
+# Maximum number of headings in an outline
+OUTLINE_MAX_ENTRIES = 100
+
+# Sentences shorter than this, in words, are only picked for the summary if there are no longer ones
+SUMMARY_MIN_WORDS = 5
+
+# Summary sentences at least this similar to an already picked one are skipped as redundant
+SUMMARY_REDUNDANCY = 0.8
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+_NUMBERED_HEADING = re.compile(r"^(\d{1,2}(?:\.\d{1,2})*)\.?\s+[A-Z]")
+_MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.+)")
+_NAMED_HEADING = re.compile(r"^(chapter|section|part|appendix)\b", re.IGNORECASE)
+_WORD = re.compile(r"[a-z']+")
+
+# Words an overview question may consist of besides its trigger words; any other word makes it a question
+# about something specific in the document
+_OVERVIEW_TRIGGERS = {
+    "about", "summary", "summarize", "summarise", "summarization", "overview", "tldr", "tl", "dr", "gist",
+    "outline", "synopsis", "abstract", "recap",
+}
+_OVERVIEW_WORDS = _OVERVIEW_TRIGGERS | {
+    "what", "what's", "whats", "is", "are", "this", "that", "the", "a", "an", "of", "it", "its", "it's",
+    "document", "doc", "file", "text", "paper", "report", "pdf", "give", "me", "us", "please", "can", "could",
+    "would", "you", "provide", "brief", "briefly", "short", "quick", "overall", "general", "main", "key",
+    "points", "topics", "ideas", "does", "do", "cover", "covers", "say", "says", "discuss", "discusses",
+    "describe", "describes", "tell", "in", "few", "sentences", "words", "sum", "up", "all", "high", "level",
+}
+
+
+def is_overview_question(query: str) -> bool:
+    """
+    Tell whether a query asks what a document is about as a whole, like "What is this document about?"
+    or "Summarize this file", rather than about something in it.
+
+    The check is deliberately narrow: the query must contain a trigger word such as "about" or "summary"
+    and nothing but the generic words of such questions, so "What is the refund policy about?" is not
+    taken for an overview question.
+    """
+    words = _WORD.findall(query.lower())
+    return bool(words) and bool(_OVERVIEW_TRIGGERS & set(words)) and set(words) <= _OVERVIEW_WORDS
+
+
+def _heading_level(line: str):
+    """
+    Return the outline level of a line that looks like a heading, or None.
+
+    Markdown headings, numbered headings ("2.1 Refunds"), named ones ("Chapter 3") and short lines in
+    capitals or title case are recognized. Lines ending like a sentence are not headings.
+    """
+    words = line.split()
+    if not words or len(words) > HEADING_MAX_WORDS or line[-1] in ".,;:!?":
+        return None
+    markdown = _MARKDOWN_HEADING.match(line)
+    if markdown:
+        return len(markdown.group(1))
+    numbered = _NUMBERED_HEADING.match(line)
+    if numbered:
+        return numbered.group(1).count(".") + 1
+    if _NAMED_HEADING.match(line):
+        return 1
+    letters = [c for c in line if c.isalpha()]
+    if letters and line.upper() == line:
+        return 1
+    significant = [word for word in words if len(word) > 3 and word[0].isalpha()]
+    if significant and all(word[0].isupper() for word in significant):
+        return 1
+    return None
+
+
+def build_summary(chunks, vectorizer) -> dict:
+    """
+    Compute the extractive summary and the section outline of a document.
+
+    The summary is made of the sentences closest to the TF-IDF centroid of all sentences of the document,
+    which are the ones that share the most terms with the document as a whole. Sentences that repeat an
+    already picked one are skipped, and the picked ones are returned in document order. The outline lists
+    the chunks that look like headings, with the position of the chunk in the document.
+
+    Args:
+        chunks (dict): The chunks of the document, keyed by chunk id in document order, or a list of them.
+        vectorizer (TfidfVectorizer): The fitted vectorizer of the document's index.
+
+    Returns:
+        dict: The summary sentences, the outline and the number of sentences and chunks of the document.
+    """
+    texts = list(chunks.values()) if hasattr(chunks, "values") else list(chunks)
+    outline = []
+    sentences = []
+    for offset, text in enumerate(texts):
+        level = _heading_level(text)
+        if level is not None:
+            if len(outline) < OUTLINE_MAX_ENTRIES:
+                outline.append({"title": text.lstrip("#").strip(), "level": level, "offset": offset})
+            continue
+        sentences.extend(sentence for sentence in _SENTENCE_BOUNDARY.split(text) if sentence)
+
+    candidates = [sentence for sentence in sentences if len(sentence.split()) >= SUMMARY_MIN_WORDS] or sentences
+    summary = []
+    if candidates:
+        vectors = vectorizer.transform(candidates)
+        centroid = np.asarray(vectors.mean(axis=0)).ravel()
+        scores = vectors @ centroid
+        picked = []
+        # Stable sort, so equally central sentences are picked in document order
+        for position in np.argsort(-scores, kind="stable"):
+            if len(picked) == settings.SUMMARY_SENTENCES or (picked and scores[position] <= 0):
+                break
+            if picked and (vectors[picked] @ vectors[position].T).max() >= SUMMARY_REDUNDANCY:
+                continue
+            picked.append(position)
+        summary = [candidates[position] for position in sorted(picked)]
+
+    return {"summary": summary, "outline": outline, "sentences": len(sentences), "chunks": len(texts)}
+
+
+def encode_summary(summary: dict) -> bytes:
+    return json.dumps(summary).encode("utf-8")
+
+
+def load_summary(document_id: str) -> dict:
+    """
+    Read the precomputed summary and outline of an index.
+
+    Indexes built before summaries were precomputed, with `settings.DOCUMENT_SUMMARIES` disabled, or
+    imported from a bundle get theirs computed from their chunks and vectorizer on first use and stored.
+
+    Raises:
+        FileNotFoundError: If the index does not exist.
+    """
+    store = get_artifact_store()
+    try:
+        return json.loads(store.read(document_id, "summary"))
+    except FileNotFoundError:
+        pass
+
+    chunks = decode_chunks(store.read(document_id, "chunks"))
+    summary = build_summary(chunks, pickle.loads(store.read(document_id, "vectorizer")))
+    store.write(document_id, {"summary": encode_summary(summary)})
+    return summary
+
+
+def format_summary(summary: dict) -> str:
+    """
+    Render a summary and outline as the answer to an overview question.
+    """
+    parts = [" ".join(summary["summary"])] if summary["summary"] else []
+    if summary["outline"]:
+        parts.append("Outline:\n" + "\n".join(
+            f"{'  ' * (entry['level'] - 1)}- {entry['title']}" for entry in summary["outline"]
+        ))
+    return "\n\n".join(parts) or "The document has no text to summarize."
@@ -0,0 +1,837 @@
+import asyncio
+import os
+
+import pytest
+
+from config import settings
+from documents import admission, batch, bundles, chunk_store, fts, resumable, storage, summary, tiers
+from documents.artifacts import SegmentArtifactStore, compress_artifact, get_artifact_store
+from documents.batching import CompletionBatcher
+from documents.coalesce import SingleFlight
+from documents.context import build_context, estimate_tokens, highlight_snippet
+from documents.indexer import (
+    IndexTooLargeError, convert_index, fit_vectorizer, held_memory_bytes, index_batch_size, index_document, index_type,
+    pq_training_size, split_into_chunks, update_document_index
+)
+from documents import retrieval_pool, retrieval_worker
+from documents.retrieval_pool import HashRing
+from documents.retriever import (
+    read_faiss_index_and_chunks, retrieve_relevant_chunks, search_chunks, search_chunks_locally, vectorize_query
+)
+from documents.semantic_cache import SemanticCache
+from documents.shared import open_shared_index, write_shared_artifact
+
+
+def test_build_context_orders_by_score():
+    scored_chunks = [("refunds are issued within 30 days", 0.4), ("the refund window is 14 days", 0.9)]
+    context, tokens = build_context(scored_chunks, token_budget=100)
+    lines = context.splitlines()
+    assert lines == ["the refund window is 14 days", "refunds are issued within 30 days"]
+    assert tokens == sum(estimate_tokens(line) for line in lines) + len(lines) - 1
+
+
+def test_build_context_skips_duplicates_and_empty_chunks():
+    scored_chunks = [
+        ("The refund window is 14 days.", 0.9),
+        ("the refund window is 14 days", 0.8),
+        ("", 0.7),
+        ("Shipping takes a week.", 0.1),
+    ]
+    context, _ = build_context(scored_chunks, token_budget=100)
+    assert context.splitlines() == ["The refund window is 14 days.", "Shipping takes a week."]
+
+
+def test_build_context_respects_token_budget():
+    scored_chunks = [("word " * 50, 0.9), ("short answer", 0.5), ("irrelevant", 0.0)]
+    context, tokens = build_context(scored_chunks, token_budget=10)
+    assert context == "short answer"
+    assert tokens <= 10
+
+
+def test_build_context_falls_back_to_top_chunks_without_overlap():
+    scored_chunks = [("Shipping takes a week.", 0.0), ("The refund window is 14 days.", 0.0)]
+    context, _ = build_context(scored_chunks, token_budget=100)
+    assert context.splitlines() == ["Shipping takes a week.", "The refund window is 14 days."]
+
+
+def test_search_chunks_returns_offsets_and_snippets():
+    document_id = index_document("Shipping takes a week\n\nThe refund window is 14 days\nShipping takes a week")
+    hits = search_chunks("how long is the refund window?", document_id, k=1, highlight=True)
+    assert [(hit["text"], hit["offset"]) for hit in hits] == [("The refund window is 14 days", 1)]
+    assert hits[0]["snippet"] == "The <b>refund</b> <b>window</b> is 14 days"
+    text = " ".join("Refund" if i == 20 else f"w{i}" for i in range(40))
+    assert highlight_snippet(text, "refund", window=4) == "...w19 <b>Refund</b> w21 w22..."
+
+
+def test_search_chunks_counts_accesses_for_tiering(monkeypatch):
+    from documents.retriever import take_access_counts
+
+    document_id = index_document("The refund window is 14 days")
+    monkeypatch.setattr(settings, "TIERED_STORAGE", True)
+    take_access_counts()
+    search_chunks("refund", document_id, k=1)
+    assert take_access_counts()[document_id] == 1
+
+
+def test_split_into_chunks_drops_blank_and_repeated_lines():
+    chunks = split_into_chunks("Header\n\nBody text\n   \nHeader")
+    assert list(chunks.values()) == ["Header", "Body text"]
+
+
+def test_update_document_index_only_touches_changed_chunks():
+    content = "\n".join(f"paragraph {i} about refunds" for i in range(10))
+    document_id = index_document(content)
+    stats = update_document_index(document_id, content.replace("paragraph 3", "section 3"))
+    assert (stats["added"], stats["removed"], stats["unchanged"]) == (1, 1, 9)
+    assert stats["document_id"] != document_id
+
+
+def test_shared_artifact_matches_faiss_index(monkeypatch):
+    # Chunk texts are only copied into the shared artifact for indexes that store their own chunks
+    monkeypatch.setattr(settings, "CHUNK_STORE", False)
+    document_id = index_document("\n".join(f"paragraph {i} about refunds" for i in range(10)))
+    index, chunks, vectorizer = read_faiss_index_and_chunks(document_id)
+    write_shared_artifact(document_id, index, chunks)
+    mapped_index, mapped_chunks = open_shared_index(document_id)
+
+    query_vector = vectorizer.transform(["paragraph 4"]).toarray().astype("float32")
+    expected_distances, expected_ids = index.search(query_vector, 3)
+    distances, ids = mapped_index.search(query_vector, 3)
+    assert ids[0][0] == expected_ids[0][0]
+    assert distances.tolist() == expected_distances.tolist()
+    assert dict(mapped_chunks.items()) == chunks
+
+
+def test_single_flight_shares_result_and_errors():
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "bad":
+            raise ValueError(value)
+        return value * 2
+
+    async def run():
+        single_flight = SingleFlight("test")
+        results = await asyncio.gather(*[single_flight.do("key", work, "a") for _ in range(5)])
+        errors = await asyncio.gather(*[single_flight.do("key", work, "bad") for _ in range(3)], return_exceptions=True)
+        return single_flight, results, errors
+
+    single_flight, results, errors = asyncio.run(run())
+    assert results == ["aa"] * 5
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert calls == ["a", "bad"]
+    assert single_flight.stats() == {"executions": 2, "coalesced": 6, "failures": 1, "in_flight": 0}
+
+
+def test_completion_batcher_batches_and_falls_back():
+    calls = []
+
+    def complete(prompts, model):
+        calls.append(list(prompts))
+        if len(prompts) > 1 and "bad" in prompts:
+            raise ValueError("batch rejected")
+        if prompts == ["bad"]:
+            raise ValueError("bad prompt")
+        return [f"{model}:{prompt}" for prompt in prompts]
+
+    async def run(prompts):
+        batcher = CompletionBatcher(complete, window=0.01, max_batch=2)
+        results = await asyncio.gather(*[batcher.submit(p, model="m") for p in prompts], return_exceptions=True)
+        return batcher, results
+
+    batcher, results = asyncio.run(run(["a", "b", "c"]))
+    assert results == ["m:a", "m:b", "m:c"] and calls == [["a", "b"], ["c"]]
+    assert batcher.stats()["average_batch_size"] == 1.5
+
+    calls.clear()
+    _, results = asyncio.run(run(["a", "bad"]))
+    assert results[0] == "m:a" and isinstance(results[1], ValueError)
+    assert calls[0] == ["a", "bad"] and sorted(calls[1:]) == [["a"], ["bad"]]
+
+
+def test_completion_batcher_fails_prompts_without_completion():
+    async def run():
+        batcher = CompletionBatcher(lambda prompts: [f"done:{prompts[0]}"], window=0.01, max_batch=2)
+        results = await asyncio.gather(
+            *[batcher.submit(prompt, timeout=5) for prompt in ["a", "b"]], return_exceptions=True
+        )
+        return batcher, results
+
+    batcher, results = asyncio.run(run())
+    assert results[0] == "done:a" and isinstance(results[1], RuntimeError)
+    assert "1 completions for 2 prompts" in str(results[1])
+    assert batcher.counters["timeouts"] == 0 and not batcher._tasks
+
+
+def test_hash_ring_only_moves_keys_of_added_worker():
+    keys = [f"index-{i}" for i in range(1000)]
+    before = {key: HashRing(3).worker_for(key) for key in keys}
+    after = {key: HashRing(4).worker_for(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert moved and all(after[key] == 3 for key in moved)
+    assert all(100 < list(before.values()).count(worker) < 500 for worker in range(3))
+
+
+def test_retrieval_worker_serves_searches_over_its_socket(monkeypatch):
+    import shutil
+    import tempfile
+    import threading
+
+    # Unix socket paths are limited to about 100 characters, which pytest's tmp_path may exceed
+    directory = tempfile.mkdtemp(prefix="retrieval-")
+    monkeypatch.setattr(settings, "RETRIEVAL_WORKERS", 1)
+    monkeypatch.setattr(settings, "RETRIEVAL_SOCKET_DIR", directory)
+    monkeypatch.setattr(retrieval_pool, "_local", type(retrieval_pool._local)())
+    retrieval_pool.get_hash_ring.cache_clear()
+    try:
+        server = retrieval_worker._Server(retrieval_pool.socket_path(0), retrieval_worker._RequestHandler)
+        server.retrieval_worker = retrieval_worker.RetrievalWorker(0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            index_id = index_document("The refund window is 14 days\nShipping takes a week")
+            request = {"op": "search", "query": "refund", "document_id": index_id, "k": 2, "highlight": True}
+            hits = retrieval_pool.call_worker(0, request)["hits"]
+            assert hits == search_chunks_locally("refund", index_id, 2, True)
+            assert search_chunks("refund", index_id, 2, True) == hits
+            _, _, vectorizer = read_faiss_index_and_chunks(index_id)
+            assert (vectorize_query("refund", index_id) != vectorizer.transform(["refund"])).nnz == 0
+
+            with pytest.raises(FileNotFoundError):
+                retrieval_pool.call_worker(0, {**request, "document_id": "missing"})
+            with pytest.raises(retrieval_pool.RetrievalWorkerError):
+                retrieval_pool.call_worker(0, {"op": "unknown"})
+            [stats] = retrieval_pool.worker_stats()
+            assert stats["worker"] == 0 and stats["requests"] == 5 and stats["errors"] == 2
+            assert stats["in_flight"] == 0
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Without a running worker, searches fall back to this process
+        retrieval_pool._disconnect(0)
+        os.remove(retrieval_pool.socket_path(0))
+        with pytest.raises(retrieval_pool.RetrievalWorkerUnavailable):
+            retrieval_pool.call_worker(0, {"op": "stats"})
+        assert search_chunks("refund", index_id, 2, True) == hits
+        assert "not running" in retrieval_pool.worker_stats()[0]["error"]
+    finally:
+        retrieval_pool.get_hash_ring.cache_clear()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_semantic_cache_matches_paraphrases():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(stop_words="english").fit(["the refund window is 14 days", "shipping takes a week"])
+    cache = SemanticCache(entries_per_index=2, max_indexes=1, threshold=0.9)
+    cache.store("index", vectorizer.transform(["What is the refund window?"]), "14 days")
+
+    assert cache.lookup("index", vectorizer.transform(["refund window"])) == "14 days"
+    assert cache.lookup("index", vectorizer.transform(["how long does shipping take"])) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_fts_search_ranks_within_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FTS_DATABASE_PATH", str(tmp_path / "fts.db"))
+    monkeypatch.setattr(fts, "_local", type(fts._local)())
+    fts.add_chunks("a", split_into_chunks("Refunds are issued within 30 days\nShipping takes a week"))
+    fts.add_chunks("b", split_into_chunks("Refunds are never issued"))
+
+    hits = fts.search('how do I get a "refund"? (AND NOT', "a", k=5)
+    assert [hit["text"] for hit in hits] == ["Refunds are issued within 30 days"]
+    assert hits[0]["score"] > 0 and "<b>Refunds</b>" in hits[0]["snippet"]
+
+    assert fts.delete_chunks("a") == 2
+    assert fts.search("refund", "a", k=5) == [] and fts.has_chunks("b")
+
+
+def test_streaming_vectorizer_matches_fit():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    chunks = ["The refund window is 14 days", "Shipping takes a week", "refund shipping costs refund"]
+    fitted = TfidfVectorizer(stop_words="english").fit(chunks)
+    streamed = fit_vectorizer(chunks)
+    assert streamed.vocabulary_ == fitted.vocabulary_
+    assert abs(streamed.transform(chunks) - fitted.transform(chunks)).max() < 1e-12
+
+
+def test_index_document_reports_batches_and_memory_ceiling(monkeypatch):
+    monkeypatch.setattr(settings, "INDEX_BUILD_BATCH_SIZE", 4)
+    progress = []
+    document_id = index_document("\n".join(f"line number {i} term{i}" for i in range(10)),
+                                 lambda done, total: progress.append((done, total)))
+    index, chunks, _ = read_faiss_index_and_chunks(document_id)
+    assert progress == [(4, 10), (8, 10), (10, 10)] and index.ntotal == len(chunks) == 10
+
+    monkeypatch.setattr(settings, "INDEX_BUILD_MAX_MEMORY_MB", 1)
+    with pytest.raises(IndexTooLargeError):
+        index_document("\n".join(f"term{i}" for i in range(1000)))
+
+    # The text, chunks and vectorizer held during the build count towards the ceiling
+    content = "\n".join(f"term{i} " + "filler " * 100 for i in range(1500))
+    chunks = split_into_chunks(content)
+    held_bytes = held_memory_bytes(content, chunks, fit_vectorizer(list(chunks.values())))
+    assert held_bytes > 3 * len(content)
+    monkeypatch.setattr(settings, "INDEX_BUILD_BATCH_SIZE", 1000)
+    monkeypatch.setattr(settings, "INDEX_BUILD_MAX_MEMORY_MB", 8)
+    assert index_batch_size(1500, 1501, 4, held_bytes) < index_batch_size(1500, 1501, 4)
+    monkeypatch.setattr(settings, "INDEX_BUILD_MAX_MEMORY_MB", 2)
+    with pytest.raises(IndexTooLargeError):
+        index_document(content)
+
+
+def test_quantized_indexes_keep_ranking(monkeypatch):
+    content = "The refund window is 14 days\nShipping takes a week\nSupport answers within a day"
+    monkeypatch.setattr(settings, "INDEX_TYPE", "sq8")
+    document_id = index_document(content)
+    assert retrieve_relevant_chunks("refund window", document_id)[0] == "The refund window is 14 days"
+
+    index, _, _ = read_faiss_index_and_chunks(document_id)
+    monkeypatch.setattr(settings, "INDEX_TYPE", "fp16")
+    converted = convert_index(index)
+    assert (index_type(index), index_type(converted)) == ("sq8", "fp16") and converted.ntotal == 3
+
+    # Workers drop their cached copy once an index was rewritten in place and the generation was bumped
+    import faiss
+    from documents.retriever import bump_index_generation, load_faiss_index_and_chunks
+
+    monkeypatch.setattr(settings, "INDEX_GENERATION_CHECK_SECONDS", 0)
+    assert index_type(load_faiss_index_and_chunks(document_id)[0]) == "sq8"
+    get_artifact_store().write(document_id, {"index": faiss.serialize_index(converted)})
+    bump_index_generation()
+    assert index_type(load_faiss_index_and_chunks(document_id)[0]) == "fp16"
+
+    # Product quantizers are trained on as many chunks as fit under the memory ceiling
+    monkeypatch.setattr(settings, "INDEX_BUILD_MAX_MEMORY_MB", 4)
+    assert pq_training_size(1000, 1024) == 4 * 1024 ** 2 // (2024 * 4)
+    with pytest.raises(IndexTooLargeError):
+        pq_training_size(1000 * 1000, 1000 * 1000)
+
+
+def test_tiering_promotes_queried_and_compresses_idle_indexes(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FAISS_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "TIERED_STORAGE", True)
+    monkeypatch.setattr(settings, "TIER_HOT_INDEXES", 1)
+    monkeypatch.setattr(tiers, "_local", type(tiers._local)())
+    get_artifact_store.cache_clear()
+    try:
+        popular = index_document("The refund window is 14 days\nShipping takes a week")
+        idle = index_document("Support answers within a day")
+        retrieve_relevant_chunks("refund", popular)
+        tiers.run_tiering()
+        assert tiers.tier_stats()["tiers"]["hot"]["indexes"] == 1
+
+        with tiers._connect() as db:
+            db.execute("UPDATE access SET last_access = 0 WHERE document_id = ?", (idle,))
+        tiers.run_tiering()
+        stats = tiers.tier_stats()["tiers"]["cold"]
+        assert stats["indexes"] == 1 and stats["stored_bytes"] < stats["raw_bytes"]
+        assert retrieve_relevant_chunks("support", idle) == ["Support answers within a day"]
+    finally:
+        get_artifact_store.cache_clear()
+
+
+def test_chunk_store_stores_shared_chunks_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FAISS_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(chunk_store, "_local", type(chunk_store._local)())
+    get_artifact_store.cache_clear()
+    try:
+        first = index_document("The refund window is 14 days\nShipping takes a week")
+        second = index_document("The  refund window is 14 days \nSupport answers within a day")
+        _, chunks, _ = read_faiss_index_and_chunks(second)
+        assert isinstance(chunks, chunk_store.ChunkRefs)
+        assert list(chunks.values()) == ["The refund window is 14 days", "Support answers within a day"]
+        assert chunk_store._connect().execute("SELECT COUNT(*) FROM chunks").fetchone()[0] == 3
+
+        stats = chunk_store.dedup_stats({1: [first, second]})
+        assert stats["tenants"][1] == {"chunk_references": 4, "unique_chunks": 3, "dedup_ratio": 0.25}
+        monkeypatch.setattr(settings, "SHARED_INDEX_STORE", True)
+        assert retrieve_relevant_chunks("support", second)[0] == "Support answers within a day"
+
+        # Estimating the memory of an update only counts the ids of chunks in the store, without reading them
+        from documents import indexer
+
+        monkeypatch.setattr(chunk_store, "get_texts", lambda chunk_ids: pytest.fail("chunk texts were read"))
+        assert indexer._chunks_bytes(chunks) == 3 * chunks.ids.nbytes
+        monkeypatch.setattr(settings, "REINDEX_FULL_REBUILD_RATIO", 1.0)
+        assert update_document_index(second, "Support answers within a day\nReturns are free")["added"] == 1
+    finally:
+        get_artifact_store.cache_clear()
+
+
+def test_resumable_upload_assembles_parts_and_verifies_hash(tmp_path, monkeypatch):
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(resumable, "UPLOADS_DIR", str(tmp_path))
+    data = b"".join(f"line {i}\n".encode() for i in range(1000))
+    session = resumable.create_session(1, "notes.txt", len(data), hashlib.sha256(data).hexdigest())
+    upload_id = session["upload_id"]
+
+    parts = [(start, data[start:start + 1000]) for start in range(0, len(data), 1000)]
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda part: resumable.write_part(upload_id, *part), parts[1:]))
+    status = resumable.upload_status(resumable.read_session(upload_id))
+    assert status["missing"] == [[0, 1000]] and status["received_bytes"] == len(data) - 1000
+    with pytest.raises(resumable.UploadSessionError):
+        resumable.complete_upload(upload_id, str(tmp_path / "notes.txt"))
+
+    resumable.write_part(upload_id, *parts[0])
+    resumable.complete_upload(upload_id, str(tmp_path / "notes.txt"))
+    assert (tmp_path / "notes.txt").read_bytes() == data
+    with pytest.raises(FileNotFoundError):
+        resumable.read_session(upload_id)
+
+    # A part that arrives while the upload is being completed is rejected before any byte is written
+    session = resumable.create_session(1, "notes.txt", len(data), hashlib.sha256(data).hexdigest())
+    resumable._write_session({**session, "status": "completing"})
+    with pytest.raises(resumable.UploadSessionError):
+        resumable.write_part(session["upload_id"], 0, data[:1000])
+    with open(resumable.staging_path(session["upload_id"]), "rb") as f:
+        assert f.read(1000) == bytes(1000)
+
+    # Files too large to be indexed under the memory ceiling are refused up front
+    monkeypatch.setattr(settings, "INDEX_BUILD_MAX_MEMORY_MB", 3)
+    with pytest.raises(resumable.UploadSessionError):
+        resumable.create_session(1, "notes.txt", 1024 ** 2 + 1, hashlib.sha256(data).hexdigest())
+
+
+def test_bundle_round_trip_verifies_checksums(tmp_path, monkeypatch):
+    import io
+    from types import SimpleNamespace
+
+    monkeypatch.setattr(bundles, "UPLOAD_DIR", str(tmp_path))
+    source = tmp_path / "policy.txt"
+    source.write_text("The refund window is 14 days\nShipping takes a week")
+    index_id = index_document(source.read_text())
+    store = get_artifact_store()
+    # Artifacts of the cold tier are exported decompressed
+    store.write(index_id, {"index": compress_artifact(store.read(index_id, "index"))})
+    document = SimpleNamespace(filename="policy.txt", file_path=str(source), document_id=index_id, created_at=None)
+
+    bundle = b"".join(bundles.bundle_blocks(bundles.stage_bundle([document])))
+    [imported] = bundles.import_bundle(io.BytesIO(bundle))
+    assert imported["filename"] == "policy.txt" and imported["document_id"] != index_id
+    with open(imported["file_path"]) as f:
+        assert f.read() == source.read_text()
+    assert retrieve_relevant_chunks("refund", imported["document_id"])[0] == "The refund window is 14 days"
+
+    tampered = bundle.replace(b"Shipping takes a week", b"Shipping takes a year")
+    uploads = set(tmp_path.iterdir())
+    with pytest.raises(bundles.BundleError):
+        bundles.import_bundle(io.BytesIO(tampered))
+    assert set(tmp_path.iterdir()) == uploads
+
+
+def test_summary_and_outline_are_precomputed_and_overview_questions_routed(monkeypatch):
+    content = "\n".join([
+        "1 Refunds",
+        "Refunds are issued within 14 days of the return. Refunds go to the original payment method.",
+        "1.1 Exceptions",
+        "Gift cards are not refunded. Refunds of sale items are issued as store credit.",
+        "2 Shipping",
+        "Orders ship within two business days. Refunds do not cover shipping costs.",
+    ])
+    document_id = index_document(content)
+    precomputed = summary.load_summary(document_id)
+    assert [(entry["title"], entry["level"], entry["offset"]) for entry in precomputed["outline"]] == [
+        ("1 Refunds", 1, 0), ("1.1 Exceptions", 2, 2), ("2 Shipping", 1, 4)
+    ]
+    assert precomputed["sentences"] == 6 and len(precomputed["summary"]) == settings.SUMMARY_SENTENCES
+    assert "Refunds are issued within 14 days of the return." in precomputed["summary"]
+
+    # Indexes without a precomputed summary get theirs on first use
+    monkeypatch.setattr(settings, "DOCUMENT_SUMMARIES", False)
+    legacy_id = index_document(content)
+    assert not get_artifact_store().exists(legacy_id, "summary")
+    assert summary.load_summary(legacy_id) == precomputed
+    assert get_artifact_store().exists(legacy_id, "summary")
+
+    assert summary.is_overview_question("What is this document about?")
+    assert summary.is_overview_question("Can you give me a brief summary of the file")
+    assert not summary.is_overview_question("What is the refund policy about?")
+    assert not summary.is_overview_question("How long does shipping take?")
+
+
+def _zip_upload(files: dict):
+    import io
+    import zipfile
+    from types import SimpleNamespace
+
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    data.seek(0)
+    return SimpleNamespace(filename="batch.zip", content_type="application/zip", file=data)
+
+
+def test_stage_upload_extracts_archives_within_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "UPLOAD_DIR", str(tmp_path))
+    files = {"a.txt": "refunds take 14 days", "b.txt": "shipping takes a week", "c.exe": "MZ"}
+    staged = batch.stage_upload(_zip_upload(files))
+    assert [(entry["filename"], entry.get("error")) for entry in staged] == [
+        ("a.txt", None), ("b.txt", None), ("c.exe", "Unsupported file type")
+    ]
+    assert sorted(path.read_text() for path in tmp_path.iterdir()) == ["refunds take 14 days", "shipping takes a week"]
+
+    for path in tmp_path.iterdir():
+        path.unlink()
+    for setting, value in (("BATCH_ARCHIVE_MAX_FILES", 2), ("BATCH_ARCHIVE_MAX_BYTES", 30)):
+        with monkeypatch.context() as patch:
+            patch.setattr(settings, setting, value)
+            [rejected] = batch.stage_upload(_zip_upload(files))
+        assert rejected["filename"] == "batch.zip" and "more than" in rejected["error"]
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_index_staged_files_and_pool_restart(tmp_path):
+    from concurrent.futures.process import BrokenProcessPool
+
+    good, bad = tmp_path / "good.txt", tmp_path / "bad.txt"
+    good.write_text("The refund window is 14 days")
+    bad.write_bytes(b"\xff\xfe not utf-8")
+    staged = [
+        {"filename": "good.txt", "content_type": "text/plain", "file_path": str(good)},
+        {"filename": "bad.txt", "content_type": "text/plain", "file_path": str(bad)},
+        {"filename": "c.exe", "error": "Unsupported file type"},
+    ]
+    asyncio.run(batch.index_staged_files(staged))
+    assert retrieve_relevant_chunks("refund", staged[0]["document_id"]) == ["The refund window is 14 days"]
+    assert staged[1]["error"].startswith("Indexing failed") and not bad.exists()
+    assert staged[2] == {"filename": "c.exe", "error": "Unsupported file type"}
+
+    # A call that kills its worker fails after one retry, and the pool is restarted for later calls
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(batch.index_pool.run(os._exit, 1))
+    assert asyncio.run(batch.index_pool.run(abs, -3)) == 3
+
+
+def test_segment_store_round_trip_and_checksums(tmp_path, monkeypatch):
+    import io
+    import zlib
+
+    from documents import artifacts
+
+    store = SegmentArtifactStore(str(tmp_path))
+    store.write("a", {"index": b"index bytes", "chunks": b"chunk bytes"})
+    assert store.read("a", "index") == b"index bytes"
+    assert bytes(store.map("a", "chunks")) == b"chunk bytes"
+    assert store.exists("a", "index") and not store.exists("a", "vectorizer")
+    with pytest.raises(FileNotFoundError):
+        store.read("b", "index")
+
+    _, offset, _, _ = store._lookup("a", "index")
+    with open(store.segment_path(1), "r+b") as f:
+        f.seek(offset)
+        f.write(b"X")
+    with pytest.raises(IOError, match="Checksum mismatch"):
+        store.read("a", "index")
+
+    # Artifacts given as file objects are copied block by block
+    monkeypatch.setattr(artifacts, "WRITE_BLOCK_SIZE", 4)
+    store.write("c", {"vectorizer": io.BytesIO(b"vectorizer bytes")})
+    assert store.read("c", "vectorizer") == b"vectorizer bytes"
+    assert store.fingerprint("c", "vectorizer") == (16, zlib.crc32(b"vectorizer bytes"))
+
+
+def test_segment_store_compaction_keeps_live_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SEGMENT_MAX_BYTES", 1)
+    monkeypatch.setattr(settings, "SEGMENT_COMPACT_RATIO", 0.5)
+    store = SegmentArtifactStore(str(tmp_path))
+    store.write("a", {"index": b"x" * 4096, "chunks": b"live chunks"})
+    store.write("b", {"index": b"active segment"})
+    stale = store._lookup("a", "chunks")
+    # Another worker process with its own mappings of the segments
+    other = SegmentArtifactStore(str(tmp_path))
+    assert bytes(other.map("a", "chunks")) == b"live chunks"
+
+    assert store.delete("a", ["index"]) == 4096
+    stats = store.compact()
+    assert stats["segments_compacted"] == 1 and stats["bytes_reclaimed"] == 4096
+    assert not (tmp_path / "00000001.seg").exists()
+    assert store._lookup("a", "chunks")[0] == 3
+    assert store.read("a", "chunks") == b"live chunks" and store.read("b", "index") == b"active segment"
+
+    # A reader that looked the entry up before the compaction finds it again in the new segment
+    lookup = store._lookup
+    lookups = iter([stale])
+    monkeypatch.setattr(store, "_lookup", lambda *key: next(lookups, None) or lookup(*key))
+    assert store.read("a", "chunks") == b"live chunks"
+    lookups = iter([stale])
+    assert bytes(store.map("a", "chunks")) == b"live chunks"
+
+    # Other processes drop their mappings of the removed segment
+    assert bytes(other.map("b", "index")) == b"active segment" and 1 not in other._maps
+
+    # Orphaned indexes are reported apart from the removed segment files
+    store.write("c", {"index": b"new active segment"})
+    stats = store.collect_garbage({"a", "c"}, min_age=0)
+    assert stats == {"files_removed": 1, "bytes_reclaimed": len(b"active segment"), "indexes_removed": 1}
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = admission.TokenBucket(rate=10, capacity=2)
+    assert (bucket.acquire(), bucket.acquire()) == (0.0, 0.0)
+    assert bucket.acquire() == pytest.approx(0.1, abs=0.01)
+    bucket.updated -= 0.1
+    assert bucket.acquire() == 0.0
+    bucket.updated -= 1
+    assert bucket.is_full(bucket.updated + 1)
+
+
+def test_admission_rejects_and_sheds_without_spending_tokens(monkeypatch):
+    from types import SimpleNamespace
+
+    from fastapi import HTTPException
+
+    monkeypatch.setattr(settings, "ADMISSION_USER_RATE", 0.001)
+    monkeypatch.setattr(settings, "ADMISSION_USER_BURST", 3)
+    user, other = SimpleNamespace(id=1, is_admin=False), SimpleNamespace(id=2, is_admin=False)
+
+    async def scenario():
+        controller = admission.AdmissionController("test", global_concurrency=1, max_queue=1, max_wait=0.05)
+        async with controller.admit(user):
+            # The queued request is shed at its deadline, then a full queue rejects at once
+            with pytest.raises(HTTPException) as shed:
+                async with controller.admit(other):
+                    pass
+            assert shed.value.status_code == 429 and shed.value.headers["Retry-After"] == "1"
+            controller._queue_depth = 1
+            with pytest.raises(HTTPException, match="busy"):
+                async with controller.admit(other):
+                    pass
+            controller._queue_depth = 0
+        assert controller._buckets[other.id].tokens == pytest.approx(3, abs=0.01)
+        assert controller.stats()["shed_deadline"] == 1 and controller.stats()["rejected_queue_full"] == 1
+
+        # Buckets that refilled completely are dropped
+        monkeypatch.setattr(admission, "BUCKET_EVICTION_SECONDS", 0)
+        async with controller.admit(user):
+            pass
+        assert set(controller._buckets) == {user.id}
+
+    asyncio.run(scenario())
+
+
+def test_admission_gives_admins_separate_limits(monkeypatch):
+    from types import SimpleNamespace
+
+    from fastapi import HTTPException
+
+    monkeypatch.setattr(settings, "ADMISSION_USER_RATE", 0.001)
+    monkeypatch.setattr(settings, "ADMISSION_USER_BURST", 1)
+    monkeypatch.setattr(settings, "ADMISSION_USER_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "ADMISSION_ADMIN_CONCURRENCY", 2)
+    user, admin = SimpleNamespace(id=1, is_admin=False), SimpleNamespace(id=2, is_admin=True)
+
+    async def scenario():
+        controller = admission.AdmissionController("test", global_concurrency=10, max_queue=10, max_wait=0.05)
+        async with controller.admit(user):
+            pass
+        with pytest.raises(HTTPException, match="Rate limit") as limited:
+            async with controller.admit(user):
+                pass
+        assert int(limited.value.headers["Retry-After"]) > 1
+        async with controller.admit(admin), controller.admit(admin):
+            assert controller.stats()["active"] == 2
+
+    asyncio.run(scenario())
+
+
+class _FakeSession:
+    """
+    Stands in for the database session of the routes, returning the given rows for every query.
+    """
+
+    def __init__(self, rows):
+        from types import SimpleNamespace
+
+        self.result = SimpleNamespace(
+            scalar_one_or_none=lambda: rows[0] if rows else None, scalars=lambda: SimpleNamespace(all=lambda: rows)
+        )
+        self.executed = []
+        self.deleted = []
+
+    async def execute(self, statement):
+        self.executed.append(statement)
+        return self.result
+
+    async def delete(self, row):
+        self.deleted.append(row)
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def tmp_storage(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(settings, "FAISS_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "INDEX_STORAGE_BACKEND", getattr(request, "param", "files"))
+    monkeypatch.setattr(chunk_store, "_local", type(chunk_store._local)())
+    monkeypatch.setattr(storage, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    (tmp_path / "uploads").mkdir()
+    get_artifact_store.cache_clear()
+    yield tmp_path / "uploads"
+    get_artifact_store.cache_clear()
+
+
+def test_delete_document_removes_file_and_artifacts(tmp_storage):
+    from types import SimpleNamespace
+
+    from fastapi import HTTPException
+
+    from documents.routes import delete_document
+
+    source = tmp_storage / "policy.txt"
+    source.write_text("The refund window is 14 days")
+    index_id = index_document(source.read_text())
+    document = SimpleNamespace(id=1, document_id=index_id, file_path=str(source), uploaded_by_id=1)
+    session = _FakeSession([document])
+
+    with pytest.raises(HTTPException) as denied:
+        asyncio.run(delete_document(1, session, SimpleNamespace(id=2, is_admin=False)))
+    assert denied.value.status_code == 403 and source.exists() and index_id in get_artifact_store().document_ids()
+
+    response = asyncio.run(delete_document(1, session, SimpleNamespace(id=1, is_admin=False)))
+    assert session.deleted == [document] and response["bytes_reclaimed"] > len("The refund window is 14 days")
+    assert not source.exists() and index_id not in get_artifact_store().document_ids()
+    with pytest.raises(FileNotFoundError):
+        retrieve_relevant_chunks("refund", index_id)
+
+
+def test_replace_document_retires_old_index_and_cleans_up_failures(tmp_storage, monkeypatch):
+    import io
+    from types import SimpleNamespace
+
+    from fastapi import HTTPException, UploadFile
+    from starlette.datastructures import Headers
+
+    from documents import routes
+
+    def upload(text):
+        headers = Headers({"content-type": "text/plain"})
+        return UploadFile(io.BytesIO(text.encode()), filename="policy.txt", headers=headers)
+
+    monkeypatch.setattr(routes, "UPLOAD_DIR", str(tmp_storage))
+    source = tmp_storage / "policy.txt"
+    source.write_text("The refund window is 14 days")
+    old_index_id = index_document(source.read_text())
+    store = get_artifact_store()
+    # Artifacts written long ago would be collected at once if their age was not restarted
+    for name in ("index", "chunks", "vectorizer"):
+        os.utime(store.path(old_index_id, name), (0, 0))
+    document = SimpleNamespace(id=1, filename="policy.txt", file_path=str(source), document_id=old_index_id,
+                               uploaded_by_id=1)
+    user = SimpleNamespace(id=1, is_admin=False)
+
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(routes.replace_document(1, upload("the and of"), _FakeSession([document]), user))
+    assert rejected.value.status_code == 400 and list(tmp_storage.iterdir()) == [source]
+
+    response = asyncio.run(
+        routes.replace_document(1, upload("The refund window is 30 days"), _FakeSession([document]), user)
+    )
+    assert document.document_id == response["document_id"] != old_index_id and not source.exists()
+    # Requests that read the old index ID before the switch can still load it until it is collected
+    assert retrieve_relevant_chunks("refund", old_index_id) == ["The refund window is 14 days"]
+    storage.collect_garbage({document.document_id}, {os.path.normpath(document.file_path)}, min_age=60)
+    assert get_artifact_store().document_ids() == {old_index_id, document.document_id}
+    storage.collect_garbage({document.document_id}, {os.path.normpath(document.file_path)}, min_age=0)
+    assert get_artifact_store().document_ids() == {document.document_id}
+
+
+def test_delete_user_documents_cascades_to_files(tmp_storage):
+    from types import SimpleNamespace
+
+    documents = []
+    for position, text in enumerate(["The refund window is 14 days", "Support answers within a day"]):
+        source = tmp_storage / f"{position}.txt"
+        source.write_text(text)
+        documents.append(SimpleNamespace(document_id=index_document(text), file_path=str(source), uploaded_by_id=1))
+    session = _FakeSession(documents)
+
+    assert asyncio.run(storage.delete_user_documents(session, 1)) == documents
+    assert len(session.executed) == 2 and "DELETE FROM documents" in str(session.executed[1])
+    for document in documents:
+        storage.delete_document_files(document)
+    assert not get_artifact_store().document_ids() and not list(tmp_storage.iterdir())
+
+
+@pytest.mark.parametrize("tmp_storage", ["files", "segments"], indirect=True)
+def test_collect_garbage_keeps_referenced_and_young_files(tmp_storage):
+    referenced = index_document("The refund window is 14 days")
+    orphaned = index_document("Support answers within a day")
+    kept, orphan = tmp_storage / "kept.txt", tmp_storage / "orphan.txt"
+    kept.write_text("kept")
+    orphan.write_text("orphan")
+    referenced_paths = {os.path.normpath(kept)}
+
+    stats = storage.collect_garbage({referenced}, referenced_paths, min_age=3600)
+    assert stats["files_removed"] == 0 and orphan.exists()
+    assert get_artifact_store().document_ids() == {referenced, orphaned}
+
+    stats = storage.collect_garbage({referenced}, referenced_paths, min_age=0)
+    assert stats["files_removed"] >= 1 and stats["bytes_reclaimed"] > 0
+    assert kept.exists() and not orphan.exists()
+    assert get_artifact_store().document_ids() == {referenced}
+    assert retrieve_relevant_chunks("refund", referenced) == ["The refund window is 14 days"]
+
+
+def test_profiling_is_only_triggered_by_admins_and_sampling(tmp_path, monkeypatch):
+    import contextlib
+    import pstats
+    from types import SimpleNamespace
+
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+
+    import profiling
+    from documents.routes import router
+    from users.auth import get_current_user
+
+    users = {"admin": SimpleNamespace(id=1, is_admin=True), "user": SimpleNamespace(id=2, is_admin=False)}
+
+    async def user_from_token(db, token):
+        return users[token]
+
+    def current_user(request: Request):
+        return users[request.headers["Authorization"].partition(" ")[2]]
+
+    monkeypatch.setattr(profiling, "SessionLocal", contextlib.nullcontext)
+    monkeypatch.setattr(profiling, "get_user_from_token", user_from_token)
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "PROFILE_MAX_FILES", 2)
+    app = FastAPI()
+    app.middleware("http")(profiling.profile_requests)
+    app.include_router(router, prefix="/documents")
+    app.dependency_overrides[get_current_user] = current_user
+    client = TestClient(app)
+
+    def get(path, token, **kwargs):
+        return client.get(path, headers={"Authorization": f"Bearer {token}", **kwargs.pop("headers", {})}, **kwargs)
+
+    response = get("/documents/admin/profiles", "user", headers={"X-Profile": "1"})
+    assert response.status_code == 403 and "X-Profile-Id" not in response.headers
+    assert profiling.list_profiles() == []
+
+    response = get("/documents/admin/profiles", "admin", params={"profile": "1"})
+    profile_id = response.headers["X-Profile-Id"]
+    [saved] = get("/documents/admin/profiles", "admin").json()
+    assert saved["id"] == profile_id and saved["trigger"] == "requested" and saved["status_code"] == 200
+    download = get(f"/documents/admin/profiles/{profile_id}", "admin")
+    assert download.status_code == 200
+    (tmp_path / "download.prof").write_bytes(download.content)
+    assert pstats.Stats(str(tmp_path / "download.prof")).total_calls > 0
+    assert get(f"/documents/admin/profiles/{profile_id}", "user").status_code == 403
+    assert get("/documents/admin/profiles/missing", "admin").status_code == 404
+
+    # Sampled requests are profiled whoever makes them; only the newest profiles are kept
+    monkeypatch.setattr(settings, "PROFILE_SAMPLE_RATE", 1.0)
+    for _ in range(2):
+        assert "X-Profile-Id" in get("/documents/admin/profiles", "user").headers
+    profiles = profiling.list_profiles()
+    assert len(profiles) == 2 and {profile["trigger"] for profile in profiles} == {"sampled"}
+    assert len(list(tmp_path.glob("*.json"))) == 2
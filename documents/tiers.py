@@ -0,0 +1,247 @@
+import asyncio
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+from config import settings
+from documents.artifacts import compress_artifact, get_artifact_store, is_compressed
+from documents.retriever import load_faiss_index_and_chunks, set_index_tiers, take_access_counts
+
+logger = logging.getLogger(__name__)
+
+HOT, WARM, COLD = "hot", "warm", "cold"
+
+# Artifacts that are compressed in the cold tier; the shared artifact is removed instead
+COMPRESSED_ARTIFACTS = ("index", "chunks", "vectorizer")
+
+TIERS_LOCK_FILE = "tiers.lock"
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Return this thread's connection to the access statistics database shared by all workers on the node.
+    """
+    db = getattr(_local, "db", None)
+    if db is None:
+        db = sqlite3.connect(os.path.join(settings.FAISS_INDEX_DIR, "tiers.db"), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS access ("
+            "document_id TEXT PRIMARY KEY, score REAL NOT NULL, scored_at REAL NOT NULL, "
+            "last_access REAL NOT NULL, tier TEXT NOT NULL, raw_bytes INTEGER, stored_bytes INTEGER)"
+        )
+        db.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY CHECK (id = 1), finished_at REAL)")
+        _local.db = db
+    return db
+
+
+def _decayed(score: float, scored_at: float, now: float) -> float:
+    """
+    Decay a popularity score, halving it every `settings.TIER_HALF_LIFE_SECONDS`.
+    """
+    return score * 0.5 ** ((now - scored_at) / settings.TIER_HALF_LIFE_SECONDS)
+
+
+def flush_access_counts():
+    """
+    Add the queries this worker served since the last flush to the shared popularity scores.
+
+    A score is the number of queries of an index with exponential decay, so it reflects both how often
+    and how recently the index was queried.
+    """
+    counts = take_access_counts()
+    if not counts:
+        return
+
+    now = time.time()
+    db = _connect()
+    with db:
+        for document_id, hits in counts.items():
+            row = db.execute(
+                "SELECT score, scored_at FROM access WHERE document_id = ?", (document_id,)
+            ).fetchone()
+            score = hits + (_decayed(*row, now) if row else 0.0)
+            db.execute(
+                "INSERT INTO access (document_id, score, scored_at, last_access, tier) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (document_id) DO UPDATE SET score = excluded.score, "
+                "scored_at = excluded.scored_at, last_access = excluded.last_access",
+                (document_id, score, now, now, WARM),
+            )
+
+
+def _compress(store, document_id: str):
+    """
+    Move an index into the cold tier: compress its artifacts and drop its shared artifact.
+
+    Returns:
+        tuple: The raw and the stored size of the compressed artifacts in bytes.
+    """
+    raw_bytes = stored_bytes = 0
+    for name in COMPRESSED_ARTIFACTS:
+        data = store.read(document_id, name, decompress=False)
+        if not is_compressed(data):
+            raw_bytes += len(data)
+            data = compress_artifact(data)
+            store.write(document_id, {name: data})
+        else:
+            raw_bytes += len(store.read(document_id, name))
+        stored_bytes += len(data)
+    store.delete(document_id, ["shared"])
+    return raw_bytes, stored_bytes
+
+
+def _decompress(store, document_id: str):
+    """
+    Move an index out of the cold tier by writing its artifacts back uncompressed.
+    """
+    for name in COMPRESSED_ARTIFACTS:
+        if is_compressed(store.read(document_id, name, decompress=False)):
+            store.write(document_id, {name: store.read(document_id, name)})
+
+
+def rebalance() -> dict:
+    """
+    Assign every stored index to a tier and move its artifacts accordingly.
+
+    - The `settings.TIER_HOT_INDEXES` indexes with the highest popularity score are hot: every worker
+      keeps them decoded in memory.
+    - Indexes not queried for `settings.TIER_COLD_AFTER_SECONDS` (counted from their first sighting if
+      they were never queried) are cold: their artifacts are compressed on disk and decompressed when
+      they are loaded.
+    - All other indexes are warm: they are memory-mapped from their shared artifact when loaded.
+
+    Returns:
+        dict: The number of promoted and demoted indexes.
+    """
+    store = get_artifact_store()
+    now = time.time()
+    db = _connect()
+
+    stored = store.document_ids()
+    rows = {
+        document_id: (score, scored_at, last_access, tier)
+        for document_id, score, scored_at, last_access, tier in db.execute(
+            "SELECT document_id, score, scored_at, last_access, tier FROM access"
+        )
+    }
+    with db:
+        for document_id in rows.keys() - stored:
+            db.execute("DELETE FROM access WHERE document_id = ?", (document_id,))
+        for document_id in stored - rows.keys():
+            db.execute(
+                "INSERT INTO access (document_id, score, scored_at, last_access, tier) VALUES (?, 0, ?, ?, ?)",
+                (document_id, now, now, WARM),
+            )
+            rows[document_id] = (0.0, now, now, WARM)
+
+    cold_before = now - settings.TIER_COLD_AFTER_SECONDS
+    ranked = sorted(
+        (document_id for document_id in stored if rows[document_id][2] > cold_before),
+        key=lambda document_id: _decayed(*rows[document_id][:2], now),
+        reverse=True,
+    )
+    hot = {document_id for document_id in ranked[:settings.TIER_HOT_INDEXES] if rows[document_id][0] > 0}
+
+    promoted = demoted = 0
+    order = {COLD: 0, WARM: 1, HOT: 2}
+    for document_id in stored:
+        current = rows[document_id][3]
+        target = HOT if document_id in hot else COLD if rows[document_id][2] <= cold_before else WARM
+        if target == current:
+            continue
+
+        try:
+            if target == COLD:
+                raw_bytes, stored_bytes = _compress(store, document_id)
+            else:
+                if current == COLD:
+                    _decompress(store, document_id)
+                raw_bytes = stored_bytes = None
+        except FileNotFoundError:
+            # Deleted while rebalancing
+            continue
+
+        with db:
+            db.execute(
+                "UPDATE access SET tier = ?, raw_bytes = ?, stored_bytes = ? WHERE document_id = ?",
+                (target, raw_bytes, stored_bytes, document_id),
+            )
+        if order[target] > order[current]:
+            promoted += 1
+        else:
+            demoted += 1
+
+    with db:
+        db.execute("INSERT OR REPLACE INTO runs VALUES (1, ?)", (time.time(),))
+    return {"promoted": promoted, "demoted": demoted}
+
+
+def refresh_worker_tiers(owns: Callable = None):
+    """
+    Load the tier of every index into this worker and keep the hot indexes loaded.
+
+    Args:
+        owns (Callable, optional): Tells whether this worker serves an index ID; only those hot indexes are
+                                   loaded. Defaults to all of them.
+    """
+    tiers = dict(_connect().execute("SELECT document_id, tier FROM access"))
+    set_index_tiers(tiers)
+    for document_id, tier in tiers.items():
+        if tier == HOT and (owns is None or owns(document_id)):
+            try:
+                load_faiss_index_and_chunks(document_id)
+            except FileNotFoundError:
+                continue
+
+
+def run_tiering():
+    """
+    Flush this worker's access counts, rebalance the tiers if no other worker is doing so, and refresh
+    this worker's view of the tiers.
+    """
+    flush_access_counts()
+    with open(os.path.join(settings.FAISS_INDEX_DIR, TIERS_LOCK_FILE), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pass
+        else:
+            moved = rebalance()
+            logger.info("Tiering promoted %(promoted)d and demoted %(demoted)d indexes", moved)
+    # With retrieval workers, the hot indexes are kept loaded by the workers that own them instead
+    refresh_worker_tiers((lambda document_id: False) if settings.RETRIEVAL_WORKERS else None)
+
+
+def tier_stats() -> dict:
+    """
+    Report the number of indexes per tier, the space saved by compressing cold indexes and when the
+    tiers were last rebalanced.
+    """
+    db = _connect()
+    tiers = {tier: {"indexes": 0} for tier in (HOT, WARM, COLD)}
+    for tier, count in db.execute("SELECT tier, COUNT(*) FROM access GROUP BY tier"):
+        tiers[tier]["indexes"] = count
+    raw_bytes, stored_bytes = db.execute(
+        "SELECT COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(stored_bytes), 0) FROM access WHERE tier = ?", (COLD,)
+    ).fetchone()
+    tiers[COLD].update(raw_bytes=raw_bytes, stored_bytes=stored_bytes)
+    last_run = db.execute("SELECT finished_at FROM runs").fetchone()
+    return {"tiers": tiers, "last_rebalanced_at": last_run[0] if last_run else None}
+
+
+async def tiering_loop():
+    """
+    Background task that moves indexes between tiers every `settings.TIER_INTERVAL_SECONDS`.
+    """
+    while True:
+        await asyncio.sleep(settings.TIER_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(run_tiering)
+        except Exception:
+            logger.exception("Tiering failed")
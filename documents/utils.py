@@ -1,33 +1,40 @@
 import io
-from pdfminer.high_level import extract_text
-from docx import Document
+
+# Content types of the supported file formats, by file extension
+CONTENT_TYPES_BY_EXTENSION = {
+    ".txt": "text/plain",
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
 
 
 async def extract_text_from_file(file):
     """
     Extracts text from TXT, PDF, or DOCX files.
     """
-    if file.content_type == "text/plain":
-        return await extract_text_from_txt(file)
-    elif file.content_type == "application/pdf":
-        return extract_text_from_pdf(await file.read())  # Read all bytes first
-    elif file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return extract_text_from_docx(await file.read())  # Read all bytes first
-    else:
-        raise ValueError("Unsupported file format")
+    return extract_text_from_bytes(await file.read(), file.content_type)
 
 
-async def extract_text_from_txt(file):
+def extract_text_from_bytes(data, content_type):
     """
-    Extracts text from a plain text file.
+    Extracts text from the raw bytes of a TXT, PDF, or DOCX file.
     """
-    return (await file.read()).decode("utf-8")
+    if content_type == "text/plain":
+        return data.decode("utf-8")
+    elif content_type == "application/pdf":
+        return extract_text_from_pdf(data)
+    elif content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        return extract_text_from_docx(data)
+    else:
+        raise ValueError("Unsupported file format")
 
 
 def extract_text_from_pdf(pdf_bytes):
     """
     Extracts text from a PDF file using pdfminer.six.
     """
+    from pdfminer.high_level import extract_text
+
     pdf_stream = io.BytesIO(pdf_bytes)
     return extract_text(pdf_stream)
 
@@ -36,6 +43,8 @@ def extract_text_from_docx(docx_bytes):
     """
     Extracts text from a DOCX file using python-docx.
     """
+    from docx import Document
+
     doc_stream = io.BytesIO(docx_bytes)
     doc = Document(doc_stream)
     return "\n".join([para.text for para in doc.paragraphs])
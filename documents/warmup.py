@@ -0,0 +1,59 @@
+import asyncio
+import importlib
+import logging
+import time
+
+from sqlalchemy.future import select
+
+from config import settings
+from database import SessionLocal
+from documents.models import Document
+from documents.retriever import load_faiss_index_and_chunks
+
+logger = logging.getLogger(__name__)
+
+# Modules that are imported lazily on first use and can be loaded ahead of the first request
+HEAVY_MODULES = ["faiss", "sklearn.feature_extraction.text", "openai", "pdfminer.high_level", "docx"]
+
+
+def _parse_ids(value: str) -> list:
+    """
+    Parse a comma-separated list of document IDs from a setting.
+    """
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def import_heavy_modules():
+    """
+    Import the modules the document pipeline defers to first use.
+    """
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+
+async def warm_up():
+    """
+    Background startup task that prepares a worker for its first requests.
+
+    When `settings.WARMUP_IMPORTS` is set, the heavy modules are imported. The indexes of the documents
+    listed in `settings.WARMUP_DOCUMENT_IDS` are then loaded into the index cache. Failures are logged
+    and never prevent the worker from serving requests.
+    """
+    started = time.perf_counter()
+    try:
+        if settings.WARMUP_IMPORTS:
+            await asyncio.to_thread(import_heavy_modules)
+
+        document_ids = _parse_ids(settings.WARMUP_DOCUMENT_IDS)
+        if document_ids:
+            async with SessionLocal() as db:
+                result = await db.execute(select(Document.document_id).filter(Document.id.in_(document_ids)))
+                index_ids = result.scalars().all()
+
+            for index_id in index_ids:
+                await asyncio.to_thread(load_faiss_index_and_chunks, index_id)
+    except Exception:
+        logger.exception("Warmup failed")
+        return
+
+    logger.info("Warmup finished in %.2fs", time.perf_counter() - started)
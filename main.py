@@ -1,9 +1,30 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from users.routes import router as user_router
 from documents.routes import router as documents_router
+from documents.storage import garbage_collection_loop
+from documents.tiers import tiering_loop
+from documents.warmup import warm_up
+from profiling import profile_requests
+from config import settings
 
 app = FastAPI()
+app.middleware("http")(profile_requests)
+
+# Keep references to the background tasks so they are not garbage collected while running
+background_tasks = set()
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    if settings.GC_INTERVAL_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(garbage_collection_loop()))
+    if settings.TIERED_STORAGE:
+        background_tasks.add(asyncio.create_task(tiering_loop()))
+    if settings.WARMUP_IMPORTS or settings.WARMUP_DOCUMENT_IDS:
+        background_tasks.add(asyncio.create_task(warm_up()))
 
 
 @app.get("/")
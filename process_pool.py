@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessPool:
+    """
+    A process pool for CPU-bound work of the web workers, started on first use and replaced when it breaks.
+
+    Worker processes are spawned rather than forked, so they do not inherit the event loop and threads
+    of the web worker. When a worker process dies, e.g. killed for running out of memory, the executor
+    fails all of its pending and future calls with BrokenProcessPool; the broken executor is then dropped,
+    and the calls that failed are retried once on a new one.
+    """
+
+    def __init__(self, max_workers: Callable[[], int]):
+        """
+        Args:
+            max_workers (Callable): Returns the number of worker processes, read when a pool is started.
+        """
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers(), mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _reset(self, broken: ProcessPoolExecutor):
+        # Of the calls that failed together, only the first replaces the executor
+        with self._lock:
+            if self._executor is broken:
+                logger.warning("A worker process died, restarting the process pool")
+                self._executor = None
+        broken.shutdown(wait=False)
+
+    async def run(self, fn: Callable, *args):
+        """
+        Run a function in a worker process and return its result.
+
+        Raises:
+            BrokenProcessPool: If a worker process died during the call on a new pool as well.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor()
+            try:
+                return await loop.run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                self._reset(executor)
+                if attempt:
+                    raise
@@ -0,0 +1,193 @@
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from contextvars import ContextVar
+from uuid import uuid4
+
+from fastapi import HTTPException, Request
+
+from config import settings
+from database import SessionLocal
+from users.auth import get_user_from_token
+from users.permissions import get_oso
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY_PARAM = "profile"
+
+# The profile of the request being handled, inherited by the tasks and worker threads it starts
+_current_profile = ContextVar("current_profile", default=None)
+
+# cProfile can only profile one request at a time on the event loop thread
+_profiling_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    cProfile profiles of one request: one of the event loop thread and one per call run in a worker thread.
+    """
+
+    def __init__(self):
+        self.loop_profile = cProfile.Profile()
+        self.thread_profiles = []
+        self._lock = threading.Lock()
+
+    def add_thread_profile(self, profile: cProfile.Profile):
+        with self._lock:
+            self.thread_profiles.append(profile)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.loop_profile)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        return stats
+
+
+async def to_thread(func, *args):
+    """
+    Run `func(*args)` in a worker thread like `asyncio.to_thread`, profiling it if the request is profiled.
+
+    cProfile only sees the thread it was enabled in, so blocking calls (FAISS searches, vectorizing,
+    completions) must go through this function to show up in request profiles.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return await asyncio.to_thread(func, *args)
+
+    def profiled():
+        thread_profile = cProfile.Profile()
+        try:
+            return thread_profile.runcall(func, *args)
+        finally:
+            profile.add_thread_profile(thread_profile)
+
+    return await asyncio.to_thread(profiled)
+
+
+async def _profile_trigger(request: Request):
+    """
+    Return why a request should be profiled ("requested" or "sampled"), or None.
+
+    Profiling on request is only honoured for users with the `profile_requests` permission of
+    `users/policy.polar`; for anyone else the flag is ignored.
+    """
+    flag = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY_PARAM)
+    if flag and flag.lower() in ("1", "true"):
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                async with SessionLocal() as db:
+                    user = await get_user_from_token(db, token)
+            except HTTPException:
+                return None
+            if get_oso().is_allowed(user, "profile_requests", None):
+                return "requested"
+        return None
+
+    if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def _save_profile(profile: RequestProfile, metadata: dict):
+    """
+    Write a request profile and its metadata to `settings.PROFILE_DIR`, removing the oldest profiles
+    beyond `settings.PROFILE_MAX_FILES`.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    base_path = os.path.join(settings.PROFILE_DIR, metadata["id"])
+    profile.stats().dump_stats(f"{base_path}.prof")
+    with open(f"{base_path}.json", "w") as f:
+        json.dump(metadata, f)
+
+    for stale in list_profiles()[settings.PROFILE_MAX_FILES:]:
+        for suffix in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(settings.PROFILE_DIR, stale["id"] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> list:
+    """
+    Return the metadata of the saved request profiles, newest first.
+    """
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in names:
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(settings.PROFILE_DIR, name)) as f:
+                    profiles.append(json.load(f))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+    return sorted(profiles, key=lambda metadata: metadata["started_at"], reverse=True)
+
+
+def profile_path(profile_id: str) -> str:
+    """
+    Return the path of a saved profile, which can be loaded with `pstats` or viewers such as snakeviz.
+
+    Raises:
+        FileNotFoundError: If there is no profile with this ID.
+    """
+    path = os.path.join(settings.PROFILE_DIR, f"{os.path.basename(profile_id)}.prof")
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return path
+
+
+async def profile_requests(request: Request, call_next):
+    """
+    HTTP middleware that profiles a request with cProfile when an admin asks for it or it is sampled.
+
+    Admins enable profiling for a request with the `X-Profile: 1` header or the `profile=1` query
+    parameter; in addition, `settings.PROFILE_SAMPLE_RATE` of all requests are profiled. The profile
+    covers the event loop thread and the worker threads started with `to_thread`, including the time
+    spent in faiss, sklearn and pdfminer. Coroutines of concurrent requests that run on the event loop
+    while the request awaits show up in its profile too. Only one request per worker is profiled at a
+    time; others are served unprofiled meanwhile. The ID of the saved profile is returned in the
+    `X-Profile-Id` response header.
+    """
+    trigger = await _profile_trigger(request)
+    if trigger is None or not _profiling_lock.acquire(blocking=False):
+        return await call_next(request)
+
+    try:
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started_at = time.time()
+        started = time.perf_counter()
+        profile.loop_profile.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            profile.loop_profile.disable()
+            _current_profile.reset(token)
+        duration = time.perf_counter() - started
+    finally:
+        _profiling_lock.release()
+
+    metadata = {
+        "id": f"{int(started_at * 1000)}-{uuid4().hex[:8]}",
+        "method": request.method,
+        "path": request.url.path,
+        "query": request.url.query,
+        "status_code": response.status_code,
+        "trigger": trigger,
+        "started_at": started_at,
+        "duration_seconds": duration,
+        "worker_pid": os.getpid(),
+        "thread_calls": len(profile.thread_profiles),
+    }
+    await asyncio.to_thread(_save_profile, profile, metadata)
+    response.headers["X-Profile-Id"] = metadata["id"]
+    return response
@@ -0,0 +1,76 @@
+"""
+Compare the size, recall and search latency of the index types on a synthetic document.
+
+Indexes one random document of `--lines` lines, with terms drawn from a Zipf-like distribution, as a
+flat index and converts it to each other index type. For `--queries` random queries it reports the
+serialized index size, the recall@k of the top-k chunk ids against the exact flat search, and the median
+search latency.
+
+Usage:
+    python scripts/bench_index_types.py [--lines 20000] [--queries 200] [--k 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=20000, help="Lines (chunks) of the document")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="Number of distinct terms")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=5, help="Number of retrieved chunks per query")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    os.environ["FAISS_INDEX_DIR"] = tempfile.mkdtemp(prefix="bench_index_types_")
+    sys.path.insert(0, PROJECT_ROOT)
+
+    import faiss
+    from config import settings
+    from documents.indexer import convert_index, fit_vectorizer, index_type, split_into_chunks, vectorize_chunks
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"term{i}" for i in range(args.vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(args.vocabulary)]
+
+    def sentence(words: int) -> str:
+        return " ".join(rng.choices(vocabulary, weights, k=words))
+
+    chunks = split_into_chunks("\n".join(sentence(12) for _ in range(args.lines)))
+    vectorizer = fit_vectorizer(list(chunks.values()))
+    flat = faiss.IndexIDMap2(faiss.IndexFlatL2(len(vectorizer.vocabulary_)))
+    flat.add_with_ids(vectorize_chunks(vectorizer, list(chunks.values())), np.array(list(chunks), dtype=np.int64))
+
+    queries = vectorize_chunks(vectorizer, [sentence(4) for _ in range(args.queries)])
+    _, expected = flat.search(queries, args.k)
+    flat_size = len(faiss.serialize_index(flat))
+
+    print(f"{len(chunks)} chunks, {len(vectorizer.vocabulary_)} terms, recall@{args.k} against flat search")
+    for name in ("flat", "fp16", "sq8", "pq"):
+        settings.INDEX_TYPE = name
+        index = flat if name == "flat" else convert_index(flat)
+        size = len(faiss.serialize_index(index))
+
+        latencies = []
+        found = 0
+        for query, relevant in zip(queries, expected):
+            started = time.perf_counter()
+            _, ids = index.search(query[np.newaxis], args.k)
+            latencies.append(time.perf_counter() - started)
+            found += len(set(ids[0]) & set(relevant))
+
+        print(f"{index_type(index):5} {size / 2 ** 20:9.1f} MB ({size / flat_size:6.1%})   "
+              f"recall {found / expected.size:6.3f}   p50 {statistics.median(latencies) * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare the query latency of the FAISS and FTS5 retrieval backends on synthetic documents.
+
+Indexes `--documents` random documents of `--lines` lines each into a temporary FAISS_INDEX_DIR, with
+both the FAISS artifacts and the full-text search database, then runs `--queries` random queries
+against random documents with each backend and prints the median and 95th percentile latency.
+
+"cold" queries start with an empty index cache, so FAISS has to load the pickled artifacts of the
+document first, as for the first query after a worker starts or after the document was evicted from the
+cache; "warm" queries hit the cache. FTS5 has no per-document state to load.
+
+Usage:
+    python scripts/bench_retrieval.py [--documents 50] [--lines 2000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(latencies: list) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return f"p50 {statistics.median(latencies) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=50, help="Number of synthetic documents")
+    parser.add_argument("--lines", type=int, default=2000, help="Lines (chunks) per document")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per backend and mode")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    os.environ["FAISS_INDEX_DIR"] = tempfile.mkdtemp(prefix="bench_retrieval_")
+    os.environ["RETRIEVAL_BACKEND"] = "fts5"
+    sys.path.insert(0, PROJECT_ROOT)
+
+    from config import settings
+    from documents import retriever
+    from documents.indexer import index_document
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"term{i}" for i in range(5000)]
+
+    def sentence(words: int) -> str:
+        return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+    started = time.perf_counter()
+    document_ids = [
+        index_document("\n".join(sentence(12) for _ in range(args.lines))) for _ in range(args.documents)
+    ]
+    print(f"Indexed {args.documents} documents of {args.lines} lines in {time.perf_counter() - started:.1f} s "
+          f"into {settings.FAISS_INDEX_DIR}")
+
+    queries = [(sentence(4), rng.choice(document_ids)) for _ in range(args.queries)]
+
+    for backend in ("faiss", "fts5"):
+        settings.RETRIEVAL_BACKEND = backend
+        for mode in ("cold", "warm"):
+            latencies = []
+            for query, document_id in queries:
+                if mode == "cold":
+                    retriever.invalidate_cached_index(document_id)
+                started = time.perf_counter()
+                retriever.retrieve_scored_chunks(query, document_id, settings.CONTEXT_CANDIDATES)
+                latencies.append(time.perf_counter() - started)
+            print(f"{backend:6} {mode:5} {percentiles(latencies)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Convert the stored FAISS indexes to another index type in place.
+
+Every index in the artifact store selected by INDEX_STORAGE_BACKEND that is not of the target type is
+decoded and re-encoded as `--type` (default: INDEX_TYPE; "pq" falls back to "sq8" below PQ_MIN_CHUNKS)
+and written back under the same index ID, so no document row changes. Chunks and vectorizers are left
+untouched. The shared artifact memory-mapped from the old vectors is removed and the index generation is
+bumped after each write, so running workers drop their cached copy and load the converted index.
+
+Usage:
+    python scripts/convert_indexes.py [--type sq8] [--dry-run]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings  # noqa: E402
+from documents.artifacts import get_artifact_store  # noqa: E402
+from documents.indexer import convert_index, index_type, target_index_type  # noqa: E402
+from documents.retriever import bump_index_generation  # noqa: E402
+
+
+def main():
+    import faiss
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--type", choices=["flat", "fp16", "sq8", "pq"], default=settings.INDEX_TYPE,
+                        help="Index type to convert to")
+    parser.add_argument("--dry-run", action="store_true", help="Report the sizes without writing anything")
+    args = parser.parse_args()
+    settings.INDEX_TYPE = args.type
+
+    store = get_artifact_store()
+    converted = 0
+    bytes_before = bytes_after = 0
+    for document_id in sorted(store.document_ids()):
+        if not store.exists(document_id, "index"):
+            continue
+        data = store.read(document_id, "index")
+        index = faiss.deserialize_index(np.frombuffer(data, dtype=np.uint8))
+        target = target_index_type(index.ntotal)
+        if index_type(index) == target:
+            continue
+
+        serialized = faiss.serialize_index(convert_index(index))
+        bytes_before += len(data)
+        bytes_after += len(serialized)
+        if not args.dry_run:
+            store.write(document_id, {"index": serialized})
+            store.delete(document_id, ["shared"])
+            bump_index_generation()
+        converted += 1
+        print(f"{document_id}: {index_type(index)} {len(data)} -> {target} {len(serialized)} bytes")
+
+    print(f"Converted {converted} indexes to {args.type}: {bytes_before} -> {bytes_after} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Import the chunks of existing indexes into the SQLite full-text search database.
+
+Reads the chunks artifact (`<index id>_chunks.pkl` in the file store) of every index ID in the artifact
+store selected by INDEX_STORAGE_BACKEND and adds it to the FTS5 database under the same index ID. Index
+IDs that already have chunks there are skipped, so the import can be re-run after an interruption. Set
+RETRIEVAL_BACKEND=fts5 once the import has finished.
+
+Usage:
+    python scripts/import_chunks_to_fts.py
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from documents import fts  # noqa: E402
+from documents.artifacts import get_artifact_store  # noqa: E402
+from documents.chunk_store import decode_chunks  # noqa: E402
+from documents.indexer import chunk_id  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    store = get_artifact_store()
+    document_ids = sorted(store.document_ids())
+
+    imported = 0
+    for document_id in document_ids:
+        if fts.has_chunks(document_id) or not store.exists(document_id, "chunks"):
+            continue
+        chunks = decode_chunks(store.read(document_id, "chunks"))
+        # Indexes created before chunk ids stored their chunks as a list
+        if isinstance(chunks, list):
+            chunks = {chunk_id(chunk): chunk for chunk in chunks}
+        fts.add_chunks(document_id, chunks)
+        imported += 1
+
+    print(f"Imported the chunks of {imported} of {len(document_ids)} indexes")
+
+
+if __name__ == "__main__":
+    main()
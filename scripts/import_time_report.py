@@ -0,0 +1,78 @@
+"""
+Report how long importing the application takes, to catch import-time regressions.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter from the project root and prints
+the total import time and the top-level packages (e.g. `faiss`, `sklearn`) that took the longest to import,
+summing the self time of all their submodules.
+
+Usage:
+    python scripts/import_time_report.py [--module main] [--top 15] [--max-ms 1500]
+
+With `--max-ms`, the script exits with status 1 when the total import time exceeds the limit, so it can
+be used as a CI check.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_imports(module: str) -> list:
+    """
+    Import a module in a fresh interpreter and parse the `-X importtime` output.
+
+    Args:
+        module (str): The module to import.
+
+    Returns:
+        list: Tuples of (nesting level, package name, self time in us, cumulative time in us).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"Importing {module} failed")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip())) // 2
+        imports.append((level, name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="Module to import (default: main)")
+    parser.add_argument("--top", type=int, default=15, help="Number of packages to list (default: 15)")
+    parser.add_argument("--max-ms", type=float, help="Fail when the total import time exceeds this many ms")
+    args = parser.parse_args()
+
+    imports = measure_imports(args.module)
+    total_ms = sum(cumulative for level, _, _, cumulative in imports if level == 0) / 1000
+
+    packages = {}
+    for _, name, self_us, _ in imports:
+        package = name.split(".")[0]
+        modules, package_us = packages.get(package, (0, 0))
+        packages[package] = (modules + 1, package_us + self_us)
+
+    print(f"Total import time of {args.module}: {total_ms:.1f} ms ({len(imports)} modules)")
+    print(f"{'ms':>9}  {'modules':>7}  package")
+    slowest = sorted(packages.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    for package, (modules, package_us) in slowest:
+        print(f"{package_us / 1000:>9.1f}  {modules:>7}  {package}")
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"Import time {total_ms:.1f} ms exceeds the limit of {args.max_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
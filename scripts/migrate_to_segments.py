@@ -0,0 +1,48 @@
+"""
+Copy the loose index artifacts in FAISS_INDEX_DIR into the segment store.
+
+Every index ID that has all of its artifact files is appended to the segment store (index IDs already
+present there are skipped). Set INDEX_STORAGE_BACKEND=segments once the copy has finished; the loose
+files can then be removed with --delete or by hand.
+
+Usage:
+    python scripts/migrate_to_segments.py [--delete]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings  # noqa: E402
+from documents.artifacts import ARTIFACT_SUFFIXES, FileArtifactStore, SegmentArtifactStore  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delete", action="store_true", help="Remove the loose files after copying them")
+    args = parser.parse_args()
+
+    files = FileArtifactStore(settings.FAISS_INDEX_DIR)
+    segments = SegmentArtifactStore(os.path.join(settings.FAISS_INDEX_DIR, "segments"))
+
+    suffix = ARTIFACT_SUFFIXES["vectorizer"]
+    document_ids = sorted(name[:-len(suffix)] for name in os.listdir(files.directory) if name.endswith(suffix))
+
+    copied = 0
+    for document_id in document_ids:
+        if not segments.exists(document_id, "vectorizer"):
+            artifacts = {
+                name: files.read(document_id, name) for name in ARTIFACT_SUFFIXES
+                if name != "shared" and files.exists(document_id, name)
+            }
+            segments.write(document_id, artifacts)
+            copied += 1
+        if args.delete:
+            files.delete(document_id)
+
+    print(f"Copied {copied} of {len(document_ids)} indexes into {segments.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Re-extract and re-index every stored document, e.g. after indexing parameters or text extraction changed.
+
+Walks the `Document` rows in batches ordered by ID, extracts the text of each row's stored file and
+indexes it across a process pool. Each row is switched to its new index ID with a compare-and-swap
+UPDATE, so a document that was replaced or deleted while it was being re-indexed keeps its new state
+and the freshly built artifacts are discarded. The old artifacts are left to garbage collection once
+the switch is committed, so requests that already read an old index ID can still load it.
+
+Progress is checkpointed after every batch, so an interrupted run resumes after the last completed
+batch when started again (use --restart to start over). With --cpu-share, the re-indexer sleeps between
+batches so that its workers use at most that share of the node's CPU time on average.
+
+Uses SYNC_DATABASE_URL. Run it from the directory the application runs in, since `Document.file_path`
+is relative to it.
+
+Usage:
+    python scripts/reindex_documents.py [--batch-size 50] [--workers 4] [--cpu-share 0.5] [--restart]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, update  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from config import settings  # noqa: E402
+from documents.batch import index_file  # noqa: E402
+from documents.models import Document  # noqa: E402
+from documents.storage import delete_index_artifacts, retire_index_artifacts  # noqa: E402
+from documents.utils import CONTENT_TYPES_BY_EXTENSION  # noqa: E402
+from users.models import User  # noqa: E402, F401  (resolves the Document.uploaded_by relationship)
+
+
+def reindex_file(file_path: str):
+    """
+    Index a stored file in a worker process.
+
+    Returns:
+        tuple: The new index ID and the CPU seconds it took.
+    """
+    started = time.process_time()
+    content_type = CONTENT_TYPES_BY_EXTENSION.get(os.path.splitext(file_path)[1].lower())
+    if content_type is None:
+        raise ValueError(f"Unsupported file type: {file_path}")
+    return index_file(file_path, content_type), time.process_time() - started
+
+
+def new_checkpoint() -> dict:
+    return {"last_id": 0, "reindexed": 0, "skipped": 0, "failed": {}}
+
+
+def read_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return new_checkpoint()
+
+
+def write_checkpoint(path: str, checkpoint: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CpuThrottle:
+    """
+    Keeps the CPU time used by the workers at `share` of the node's CPU capacity on average.
+    """
+
+    def __init__(self, share: float):
+        self.capacity = share * (os.cpu_count() or 1)
+        self.started = time.monotonic()
+        self.cpu_seconds = 0.0
+
+    def add(self, cpu_seconds: float):
+        self.cpu_seconds += cpu_seconds
+
+    def wait(self):
+        ahead = self.cpu_seconds / self.capacity - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def switch_index(session, document_id: int, old_index_id: str, new_index_id: str) -> bool:
+    """
+    Point a document row at its new index ID, unless the row changed since it was read.
+    """
+    result = session.execute(
+        update(Document)
+        .where(Document.id == document_id, Document.document_id == old_index_id)
+        .values(document_id=new_index_id)
+    )
+    return result.rowcount == 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=50, help="Documents read and committed per batch")
+    parser.add_argument("--workers", type=int, default=settings.BATCH_INDEX_WORKERS, help="Indexing processes")
+    parser.add_argument("--cpu-share", type=float, default=1.0,
+                        help="Share of the node's CPU time the workers may use on average (0-1)")
+    parser.add_argument("--checkpoint", help="File the progress is recorded in",
+                        default=os.path.join(settings.FAISS_INDEX_DIR, "reindex_checkpoint.json"))
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    checkpoint = new_checkpoint() if args.restart else read_checkpoint(args.checkpoint)
+    if checkpoint["last_id"]:
+        print(f"Resuming after document {checkpoint['last_id']}")
+
+    engine = create_engine(settings.SYNC_DATABASE_URL, future=True)
+    session_factory = sessionmaker(bind=engine)
+    throttle = CpuThrottle(args.cpu_share)
+    pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    try:
+        while True:
+            with session_factory() as session:
+                rows = session.execute(
+                    select(Document.id, Document.file_path, Document.document_id)
+                    .where(Document.id > checkpoint["last_id"])
+                    .order_by(Document.id)
+                    .limit(args.batch_size)
+                ).all()
+            if not rows:
+                break
+
+            results = {}
+            futures = [pool.submit(reindex_file, row.file_path) for row in rows]
+            for row, future in zip(rows, futures):
+                try:
+                    results[row.id], cpu_seconds = future.result()
+                except Exception as e:
+                    checkpoint["failed"][str(row.id)] = str(e)
+                    continue
+                throttle.add(cpu_seconds)
+
+            # Index IDs no row points to after the switch: the old ones, which requests may still be reading,
+            # and the new ones of changed rows, which nothing has read
+            retired_index_ids = []
+            stale_index_ids = []
+            with session_factory() as session:
+                for row in rows:
+                    if row.id not in results:
+                        continue
+                    if switch_index(session, row.id, row.document_id, results[row.id]):
+                        retired_index_ids.append(row.document_id)
+                        checkpoint["reindexed"] += 1
+                    else:
+                        stale_index_ids.append(results[row.id])
+                        checkpoint["skipped"] += 1
+                session.commit()
+
+            for index_id in retired_index_ids:
+                retire_index_artifacts(index_id)
+            for index_id in stale_index_ids:
+                delete_index_artifacts(index_id)
+            checkpoint["last_id"] = rows[-1].id
+            write_checkpoint(args.checkpoint, checkpoint)
+            print(f"Re-indexed up to document {checkpoint['last_id']}: {checkpoint['reindexed']} done, "
+                  f"{checkpoint['skipped']} changed meanwhile, {len(checkpoint['failed'])} failed")
+
+            throttle.wait()
+    finally:
+        pool.shutdown()
+
+    for document_id, error in checkpoint["failed"].items():
+        print(f"Document {document_id} failed: {error}")
+    print(f"Finished: {checkpoint['reindexed']} re-indexed, {len(checkpoint['failed'])} failed")
+
+
+if __name__ == "__main__":
+    main()
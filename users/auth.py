@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from users.permissions import oso
+from users.permissions import get_oso
 import jwt
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
@@ -34,7 +34,7 @@ async def check_permission(user: User, action: str, resource):
     Raises:
         HTTPException: If the user is not allowed to perform the action, a 403 Forbidden error is raised.
     """
-    if not oso.is_allowed(user, action, resource):
+    if not get_oso().is_allowed(user, action, resource):
         raise HTTPException(status_code=403, detail="Permission denied")
 
 
@@ -95,16 +95,16 @@ async def create_access_token(data: dict, expires_delta: timedelta = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_user_from_token(db: AsyncSession, token: str) -> User:
     """
-    Retrieves the current user from the database based on the provided JWT token.
+    Retrieves the user a JWT token was issued for from the database.
 
     Args:
         db (AsyncSession): The database session to query the user.
-        token (str): The JWT token provided in the request.
+        token (str): The JWT token.
 
     Returns:
-        User: The authenticated user.
+        User: The user the token was issued for.
 
     Raises:
         HTTPException: If the token is invalid or expired, or if the user cannot be found.
@@ -124,3 +124,20 @@ async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depe
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    """
+    Retrieves the current user from the database based on the provided JWT token.
+
+    Args:
+        db (AsyncSession): The database session to query the user.
+        token (str): The JWT token provided in the request.
+
+    Returns:
+        User: The authenticated user.
+
+    Raises:
+        HTTPException: If the token is invalid or expired, or if the user cannot be found.
+    """
+    return await get_user_from_token(db, token)
@@ -1,6 +1,17 @@
-from oso import Oso
+from functools import lru_cache
 
-oso = Oso()
 
-# Load the policy from the file
-oso.load_files(["users/policy.polar"])
+@lru_cache(maxsize=None)
+def get_oso():
+    """
+    Return the Oso instance for this package, loading the policy on first use.
+
+    The policy is parsed lazily so that importing the application stays fast.
+    """
+    from oso import Oso
+
+    oso = Oso()
+
+    # Load the policy from the file
+    oso.load_files(["users/policy.polar"])
+    return oso
@@ -0,0 +1,197 @@
+import asyncio
+import csv
+import json
+import time
+
+from pydantic import ValidationError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import settings
+from process_pool import ProcessPool
+from users.crud import pwd_context
+from users.models import User
+from users.schemas import UserCreate
+
+
+def hash_password(password: str) -> str:
+    """
+    Hash a password with the scheme of `users.crud`. Runs in a worker process of the hashing pool.
+    """
+    return pwd_context.hash(password)
+
+
+# Process pool passwords of bulk provisioning are hashed in. bcrypt is CPU-bound and holds the GIL, so
+# hashing thousands of passwords in threads would not use more than one core.
+hash_pool = ProcessPool(lambda: settings.BULK_USERS_HASH_WORKERS)
+
+
+async def _lines(stream):
+    """
+    Split a stream of byte blocks into lines of text.
+    """
+    pending = b""
+    async for block in stream:
+        pending += block
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if pending:
+        yield pending.decode("utf-8")
+
+
+async def parse_users(stream, content_type: str):
+    """
+    Parse a stream of users to provision into one dict per row.
+
+    CSV (with a header row naming the fields) and newline-delimited JSON are parsed as they arrive; a JSON
+    array is parsed once it has been received completely.
+
+    Args:
+        stream: Async iterator of the byte blocks of the request body.
+        content_type (str): "text/csv", "application/x-ndjson" or "application/json".
+
+    Yields:
+        dict or str: The fields of each row, or the error for a row that cannot be parsed.
+    """
+    if content_type == "application/json":
+        body = b"".join([block async for block in stream])
+        try:
+            rows = json.loads(body)
+        except ValueError as e:
+            yield f"Invalid JSON: {e}"
+            return
+        if not isinstance(rows, list):
+            yield "Expected a JSON array of users"
+            return
+        for row in rows:
+            yield row
+        return
+
+    header = None
+    async for line in _lines(stream):
+        if not line.strip():
+            continue
+        if content_type == "text/csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            yield dict(zip(header, values))
+        else:
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield f"Invalid JSON: {e}"
+
+
+async def _insert_batch(db: AsyncSession, batch: list, results: list, stats: dict):
+    """
+    Hash the passwords of a batch of validated rows and insert them with one multi-row statement.
+
+    Rows whose email is already registered are skipped before hashing; rows that lose a race for an email
+    against a concurrent insert are skipped by ON CONFLICT DO NOTHING on the unique email index.
+    """
+    emails = [user.email for _, user in batch]
+    existing = set((await db.execute(select(User.email).filter(User.email.in_(emails)))).scalars())
+    for position, user in batch:
+        if user.email in existing:
+            results[position].update(status="exists")
+    batch = [(position, user) for position, user in batch if user.email not in existing]
+    if not batch:
+        return
+
+    started = time.perf_counter()
+    passwords = await asyncio.gather(*[hash_pool.run(hash_password, user.password) for _, user in batch])
+    stats["hash_seconds"] += time.perf_counter() - started
+
+    started = time.perf_counter()
+    inserted = await db.execute(
+        insert(User)
+        .values([
+            {"email": user.email, "first_name": user.first_name, "last_name": user.last_name,
+             "password": password, "is_admin": False}
+            for (_, user), password in zip(batch, passwords)
+        ])
+        .on_conflict_do_nothing(index_elements=["email"])
+        .returning(User.id, User.email)
+    )
+    ids = {email: user_id for user_id, email in inserted.all()}
+    await db.commit()
+    stats["insert_seconds"] += time.perf_counter() - started
+
+    for position, user in batch:
+        if user.email in ids:
+            results[position].update(status="created", id=ids[user.email])
+        else:
+            results[position].update(status="exists")
+
+
+async def provision_users(db: AsyncSession, rows) -> dict:
+    """
+    Create users in bulk from a stream of rows.
+
+    Rows are validated like `POST /users/create` and processed in batches of `settings.BULK_USERS_BATCH_SIZE`:
+    the passwords of a batch are hashed in parallel across the hashing pool and the batch is inserted and
+    committed with a single statement. A row whose email is already registered, or repeats an earlier
+    row's email, is not created; invalid rows are reported and skipped. Committed batches stay committed
+    if a later batch fails.
+
+    Args:
+        db (AsyncSession): Database session.
+        rows: Async iterator of row dicts, or error messages for rows that could not be parsed.
+
+    Returns:
+        dict: The result of every row ("created" with the user ID, "exists", "duplicate" or "invalid" with
+              the error) and the number of rows per result, the elapsed time and the throughput.
+    """
+    started = time.perf_counter()
+    stats = {"hash_seconds": 0.0, "insert_seconds": 0.0}
+    results = []
+    seen = set()
+    batch = []
+
+    async for row in rows:
+        result = {"row": len(results) + 1}
+        results.append(result)
+        if isinstance(row, str):
+            result.update(status="invalid", error=row)
+            continue
+        if not isinstance(row, dict):
+            result.update(status="invalid", error="Expected an object with the user's fields")
+            continue
+        try:
+            user = UserCreate(**{"first_name": "", "last_name": "", **row})
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+            result.update(status="invalid", error=errors)
+            continue
+
+        result["email"] = user.email
+        if user.email in seen:
+            result.update(status="duplicate")
+            continue
+        seen.add(user.email)
+
+        batch.append((len(results) - 1, user))
+        if len(batch) >= settings.BULK_USERS_BATCH_SIZE:
+            await _insert_batch(db, batch, results, stats)
+            batch = []
+    if batch:
+        await _insert_batch(db, batch, results, stats)
+
+    elapsed = time.perf_counter() - started
+    counts = {status: 0 for status in ("created", "exists", "duplicate", "invalid")}
+    for result in results:
+        counts[result["status"]] += 1
+    return {
+        "results": results,
+        "stats": {
+            "rows": len(results),
+            **counts,
+            "seconds": elapsed,
+            "rows_per_second": len(results) / elapsed if elapsed else 0.0,
+            **stats,
+        },
+    }
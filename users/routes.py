@@ -1,6 +1,6 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi import Form
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,6 +10,8 @@ from users.auth import authenticate_user, create_access_token, get_current_user,
 from users import crud, schemas
 from users.schemas import UserResponse
 from users.models import User
+from users.provisioning import parse_users, provision_users
+from documents.storage import delete_document_files, delete_user_documents
 
 router = APIRouter()
 
@@ -145,6 +147,38 @@ async def create_user(
     return db_user
 
 
+@router.post("/bulk")
+async def bulk_create_users(
+        request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)
+):
+    """
+    Create many users at once from a CSV, newline-delimited JSON or JSON array request body. Only an admin
+    can provision users.
+
+    The format is taken from the Content-Type header ("text/csv", "application/x-ndjson" or
+    "application/json"). Each row has the fields of `POST /users/create`; a CSV body starts with a header
+    row naming them. Passwords are hashed in a process pool and the users are inserted in batched
+    multi-row statements, skipping emails that are already registered.
+
+    Args:
+    - request: The request whose body holds the users.
+    - db: The database session dependency.
+    - current_user: The user making the request, retrieved from the token.
+
+    Returns:
+    - The result of every row and throughput statistics.
+
+    Raises:
+    - HTTPException: If the current user may not provision users or the format is not supported.
+    """
+    await check_permission(current_user, "provision_users", None)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("text/csv", "application/x-ndjson", "application/json"):
+        raise HTTPException(status_code=415, detail="Send users as text/csv, application/x-ndjson or application/json")
+
+    return await provision_users(db, parse_users(request.stream(), content_type))
+
+
 @router.put("/update", response_model=schemas.UserResponse)
 async def update_user(
         user: schemas.UserUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)
@@ -173,7 +207,10 @@ async def update_user(
 @router.delete("/delete")
 async def delete_user(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
-    Delete the currently authenticated user's account.
+    Delete the currently authenticated user's account together with their documents.
+
+    The document rows are deleted in the same transaction as the user; their files and index
+    artifacts are removed once the transaction is committed.
 
     Args:
     - db: The database session dependency.
@@ -189,6 +226,9 @@ async def delete_user(db: AsyncSession = Depends(get_db), current_user: User = D
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     await check_permission(current_user, "delete_user", user)
+    documents = await delete_user_documents(db, user.id)
     await db.delete(user)
     await db.commit()
+    for document in documents:
+        delete_document_files(document)
     return {"message": f"User {current_user.id} deleted"}
@@ -112,3 +112,22 @@ def test_delete_user(client: TestClient, create_test_user: User):
     response = client.delete("/users/delete", headers={"Authorization": f"Bearer {access_token}"})
     assert response.status_code == 200
     assert response.json()["message"] == f"User {create_test_user.id} deleted"
+
+
+def test_bulk_create_users(client: TestClient, create_test_user: User, db: Session):
+    login_data = {"email": create_test_user.email, "password": "password123"}
+    login_response = client.post("/users/token", data=login_data)
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}", "Content-Type": "text/csv"}
+    body = "email,password,first_name\nbulk1@example.com,secret1,Ann\nbulk1@example.com,secret2,Bo\nnot-an-email,x,Cy\n"
+
+    response = client.post("/users/bulk", content=body, headers=headers)
+    assert response.status_code == 403
+
+    create_test_user.is_admin = True
+    db.commit()
+    response = client.post("/users/bulk", content=body, headers=headers)
+    db.query(User).filter(User.email == "bulk1@example.com").delete()
+    db.commit()
+    assert response.status_code == 200
+    assert [row["status"] for row in response.json()["results"]] == ["created", "duplicate", "invalid"]
+    assert response.json()["stats"]["created"] == 1